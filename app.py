@@ -1,28 +1,526 @@
-from flask import Flask, render_template, request, jsonify, send_file, abort
+from flask import Flask, render_template, request, jsonify, send_file, abort, Response, url_for
+from werkzeug.exceptions import HTTPException
 import yt_dlp
+from yt_dlp.postprocessor import FFmpegVideoRemuxerPP, get_postprocessor
 import os
 import time
 import random
 import tempfile
 import threading
-from urllib.parse import urlparse, parse_qs
+from urllib.parse import urlparse, parse_qs, quote
 import re
 from datetime import datetime
 import shutil
 import logging
 import requests
-from PIL import Image
+from requests.adapters import HTTPAdapter
 import io
+import json
+import gc
+import sqlite3
+import socket
+import subprocess
+import sys
+import hashlib
+import heapq
+import zlib
+import atexit
+import zipfile
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor, wait as wait_futures
 
 app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = 500 * 1024 * 1024  # 500MB max
+# Let a fronting Apache/lighttpd serve files from disk (X-Sendfile)
+app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE') == '1'
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Shared state (SQLite caches etc.) lives here so all gunicorn workers on a host see it
+STATE_DIR = os.environ.get('YTDL_STATE_DIR', os.path.join(tempfile.gettempdir(), 'ytdl_state'))
+
+# Video info cache settings
+VIDEO_INFO_CACHE_BACKEND = os.environ.get('VIDEO_INFO_CACHE_BACKEND', 'memory')  # memory, sqlite or none
+VIDEO_INFO_CACHE_TTL = int(os.environ.get('VIDEO_INFO_CACHE_TTL', 600))  # seconds
+VIDEO_INFO_CACHE_SIZE = int(os.environ.get('VIDEO_INFO_CACHE_SIZE', 1000))  # max entries
+VIDEO_INFO_CACHE_PATH = os.environ.get('VIDEO_INFO_CACHE_PATH', os.path.join(STATE_DIR, 'video_info.sqlite3'))
+
+# Download scheduler settings
+MAX_CONCURRENT_DOWNLOADS = int(os.environ.get('MAX_CONCURRENT_DOWNLOADS', 8))  # fetching, per host, shared by all workers
+MAX_QUEUED_DOWNLOADS = int(os.environ.get('MAX_QUEUED_DOWNLOADS', 100))
+DOWNLOAD_QUEUE_PATH = os.environ.get('DOWNLOAD_QUEUE_PATH', os.path.join(STATE_DIR, 'download_queue.sqlite3'))
+DEFAULT_JOB_SECONDS = 60  # ETA estimate until real job durations are known
+
+# Postprocessing stage (ffmpeg merges and conversions, limited separately from fetching)
+POSTPROCESS_WORKERS = int(os.environ.get('POSTPROCESS_WORKERS', os.cpu_count() or 1))  # per host, shared by all workers
+POSTPROCESS_QUEUE_PATH = os.environ.get('POSTPROCESS_QUEUE_PATH', os.path.join(STATE_DIR, 'postprocess_queue.sqlite3'))
+DEFAULT_POSTPROCESS_SECONDS = 10  # ETA estimate until real postprocessing durations are known
+
+# Artifact cache settings (finished downloads reused for identical requests)
+ARTIFACT_CACHE_DIR = os.environ.get('ARTIFACT_CACHE_DIR', os.path.join(STATE_DIR, 'artifacts'))
+ARTIFACT_CACHE_MAX_BYTES = int(os.environ.get('ARTIFACT_CACHE_MAX_BYTES', 10 * 1024 * 1024 * 1024))  # 0 disables
+ARTIFACT_CACHE_POLICY = os.environ.get('ARTIFACT_CACHE_POLICY', 'lru')  # lru or lfu
+
+# Single-flight settings (concurrent identical requests share one operation)
+DOWNLOAD_FLIGHTS_PATH = os.environ.get('DOWNLOAD_FLIGHTS_PATH', os.path.join(STATE_DIR, 'download_flights.sqlite3'))
+DOWNLOAD_FLIGHT_TTL = 3600  # seconds before an unfinished in-flight claim is ignored
+
+# Fragment downloads (HLS/DASH fragments fetched in parallel within one job), threads per stream by quality
+FRAGMENT_CONCURRENCY = {'best': 8, 'high': 6, 'medium': 4, 'low': 2, 'audio_only': 2}
+FRAGMENT_CONCURRENCY.update({  # e.g. FRAGMENT_CONCURRENCY=best=16,high=8
+    quality.strip(): int(value)
+    for quality, _, value in (item.partition('=') for item in os.environ.get('FRAGMENT_CONCURRENCY', '').split(','))
+    if value
+})
+PARALLEL_FORMAT_DOWNLOADS = os.environ.get('PARALLEL_FORMAT_DOWNLOADS', '1') == '1'  # fetch video and audio at once
+MAX_DOWNLOAD_CONNECTIONS = int(os.environ.get('MAX_DOWNLOAD_CONNECTIONS', 64))  # all running downloads together
+
+# Batch downloads (many URLs or a playlist in one request)
+MAX_BATCH_ITEMS = int(os.environ.get('MAX_BATCH_ITEMS', 500))  # videos per batch after playlist expansion
+BATCH_PARALLELISM = int(os.environ.get('BATCH_PARALLELISM', 2))  # running downloads per batch
+MAX_QUEUED_BATCH_ITEMS = int(os.environ.get('MAX_QUEUED_BATCH_ITEMS', 2000))  # queued batch downloads on the host
+BATCH_RETENTION_SECONDS = 24 * 3600  # batch and attached-download records outlive PROGRESS_TTL, as large batches run for hours
+
+# Stream-through downloads: single-file formats piped to the client while yt-dlp fetches them
+STREAM_FORMATS = {
+    'best': 'best[height<=1080][ext=mp4][vcodec!=none][acodec!=none]',
+    'high': 'best[height<=720][ext=mp4][vcodec!=none][acodec!=none]',
+    'medium': 'best[height<=480][ext=mp4][vcodec!=none][acodec!=none]',
+    'low': 'best[height<=360][ext=mp4][vcodec!=none][acodec!=none]',
+    'audio_only': 'bestaudio[ext=m4a]'
+}
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Clip downloads (only a time range of the video is fetched)
+CLIP_PRECISE_CUTS = os.environ.get('CLIP_PRECISE_CUTS', '0') == '1'  # re-encode for exact cuts instead of cutting at keyframes
+
+# Download storage (working directories of running and finished downloads)
+STORAGE_DIR = os.environ.get('STORAGE_DIR', os.path.join(tempfile.gettempdir(), 'ytdl_downloads'))  # e.g. a tmpfs or SSD mount
+STORAGE_MAX_BYTES = int(os.environ.get('STORAGE_MAX_BYTES', 20 * 1024 * 1024 * 1024))
+STORAGE_MIN_FREE_BYTES = int(os.environ.get('STORAGE_MIN_FREE_BYTES', 1024 * 1024 * 1024))  # never fill the disk past this
+STORAGE_INDEX_PATH = os.environ.get('STORAGE_INDEX_PATH', os.path.join(STATE_DIR, 'storage.sqlite3'))
+STORAGE_ORPHAN_GRACE = 600  # seconds before an unindexed download directory counts as orphaned
+FINISHED_FILE_TTL = 3600  # seconds a finished download is kept when nobody fetches it
+PARTIAL_FILE_TTL = 3600  # seconds the partial files of a failed or interrupted download are kept for a retry
+
+# File serving settings
+X_ACCEL_REDIRECT_PREFIX = os.environ.get('X_ACCEL_REDIRECT_PREFIX')  # nginx internal location, e.g. /protected/
+X_ACCEL_REDIRECT_ROOT = os.environ.get('X_ACCEL_REDIRECT_ROOT', tempfile.gettempdir())  # directory that location maps to
+FILE_RETENTION_SECONDS = int(os.environ.get('FILE_RETENTION_SECONDS', 600))  # keep served files this long for resumes
+
+# Progress store settings
+PROGRESS_BACKEND = os.environ.get('PROGRESS_BACKEND', 'sqlite')  # sqlite, memory (single worker only) or redis
+PROGRESS_DB_PATH = os.environ.get('PROGRESS_DB_PATH', os.path.join(STATE_DIR, 'progress.sqlite3'))
+REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+PROGRESS_TTL = 3600  # seconds a progress entry is kept
+PROGRESS_STREAM_INTERVAL = float(os.environ.get('PROGRESS_STREAM_INTERVAL', 0.5))  # min seconds between SSE updates
+PROGRESS_STREAM_KEEPALIVE = 15  # seconds between SSE keepalive comments
+PROGRESS_STREAM_MAX_SECONDS = float(os.environ.get('PROGRESS_STREAM_MAX_SECONDS', 20))  # end each stream well before gunicorn's timeout
+PROGRESS_STREAM_RETRY_MS = 1000  # EventSource reconnect delay after a stream ends
+PROGRESS_MIN_INTERVAL = float(os.environ.get('PROGRESS_MIN_INTERVAL', 0.5))  # min seconds between progress writes of a download
+PROGRESS_MIN_DELTA = float(os.environ.get('PROGRESS_MIN_DELTA', 10))  # percent of progress that is written without waiting
+
+# Thumbnails (pooled connections to the image CDN and an in-memory cache per worker)
+HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', 16))  # kept-alive connections per host
+THUMBNAIL_CACHE_MAX_BYTES = int(os.environ.get('THUMBNAIL_CACHE_MAX_BYTES', 64 * 1024 * 1024))  # 0 disables
+THUMBNAIL_CACHE_TTL = int(os.environ.get('THUMBNAIL_CACHE_TTL', 86400))  # seconds
+THUMBNAIL_WIDTHS = [120, 320, 480, 640, 1280]  # requested widths are rounded up to one of these
+THUMBNAIL_FORMATS = {'jpeg': 'image/jpeg', 'webp': 'image/webp'}
+THUMBNAIL_QUALITY = int(os.environ.get('THUMBNAIL_QUALITY', 80))
+THUMBNAIL_WORKERS = int(os.environ.get('THUMBNAIL_WORKERS', 2))  # threads resizing thumbnails per worker
+# Variants rendered in the background as soon as a thumbnail is fetched, as width:format pairs
+THUMBNAIL_PRECOMPUTE = [
+    (int(width), image_format)
+    for width, _, image_format in (item.strip().partition(':') for item in os.environ.get('THUMBNAIL_PRECOMPUTE', '320:webp,640:webp').split(','))
+    if image_format
+]
+
+# Outbound rate governor (token buckets shared by all workers on the host)
+RATE_GOVERNOR_PATH = os.environ.get('RATE_GOVERNOR_PATH', os.path.join(STATE_DIR, 'rate_governor.sqlite3'))
+YOUTUBE_REQUESTS_PER_MINUTE = float(os.environ.get('YOUTUBE_REQUESTS_PER_MINUTE', 60))
+THUMBNAIL_REQUESTS_PER_MINUTE = float(os.environ.get('THUMBNAIL_REQUESTS_PER_MINUTE', 600))
+EGRESS_REQUESTS_PER_MINUTE = float(os.environ.get('EGRESS_REQUESTS_PER_MINUTE', 120))  # per egress identity
+RATE_LIMIT_BURST = int(os.environ.get('RATE_LIMIT_BURST', 10))
+# Comma-separated proxies (scheme://host:port) or local source addresses; 'default' uses the host's own
+EGRESS_IDENTITIES = [i.strip() for i in os.environ.get('EGRESS_IDENTITIES', 'default').split(',') if i.strip()] or ['default']
+GOVERNOR_MIN_RATE_FRACTION = 0.1  # bot checks never push a bucket below this share of its configured rate
+GOVERNOR_RECOVERY_FRACTION = 0.05  # share of the configured rate regained per successful request
+
+# Extraction method selection (recent success rate and latency, shared by all workers)
+EXTRACTION_STATS_PATH = os.environ.get('EXTRACTION_STATS_PATH', os.path.join(STATE_DIR, 'extraction_stats.sqlite3'))
+EXTRACTION_PROBE_RATE = float(os.environ.get('EXTRACTION_PROBE_RATE', 0.1))  # share of requests trying another method first
+EXTRACTION_STATS_WEIGHT = 0.2  # weight of the latest attempt in the moving averages
+
+# YoutubeDL reuse (warmed instances per thread for info extraction)
+YDL_REUSE_INSTANCES = os.environ.get('YDL_REUSE_INSTANCES', '1') == '1'
+YDL_INSTANCE_MAX_USES = int(os.environ.get('YDL_INSTANCE_MAX_USES', 50))  # extractions before a fresh instance and user agent
+YTDL_PRELOAD = os.environ.get('YTDL_PRELOAD', '0') == '1'  # warm up yt-dlp at import, e.g. once in the gunicorn --preload master
+
+# Metrics (Prometheus text format at /metrics, added up across all workers on the host)
+METRICS_PATH = os.environ.get('METRICS_PATH', os.path.join(STATE_DIR, 'metrics.sqlite3'))
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5))  # seconds a worker keeps observations before adding them up
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)  # seconds
+THROUGHPUT_BUCKETS = tuple(2 ** i * 64 * 1024 for i in range(0, 14, 2))  # bytes per second, 64 KiB/s to 256 MiB/s
+
+YOUTUBE_URL_PATTERNS = [
+    r'(?:https?://)?(?:www\.)?youtube\.com/watch\?v=([a-zA-Z0-9_-]{11})',
+    r'(?:https?://)?(?:www\.)?youtu\.be/([a-zA-Z0-9_-]{11})',
+    r'(?:https?://)?(?:www\.)?youtube\.com/embed/([a-zA-Z0-9_-]{11})',
+    r'(?:https?://)?(?:www\.)?youtube\.com/v/([a-zA-Z0-9_-]{11})',
+    r'(?:https?://)?(?:www\.)?youtube\.com/shorts/([a-zA-Z0-9_-]{11})'
+]
+
+def _sqlite_connect(path):
+    """Open a SQLite connection suitable for sharing a file between workers"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=10, isolation_level=None)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+class MemoryProgressStore:
+    """Download progress kept in this process only (single worker setups)"""
+
+    def __init__(self):
+        self._entries = OrderedDict()  # least recently updated first
+        self._updated_at = {}
+        self._ttls = {}  # entries kept longer than expire()'s max_age
+        self._lock = threading.Lock()
+
+    def get(self, download_id):
+        with self._lock:
+            entry = self._entries.get(download_id)
+            return dict(entry) if entry is not None else None
+
+    def _touch(self, download_id):
+        self._entries.move_to_end(download_id)
+        self._updated_at[download_id] = time.time()
+
+    def set(self, download_id, data, ttl=None):
+        """Store an entry, kept for ttl seconds after its last update instead of expire()'s max_age if given"""
+        with self._lock:
+            self._entries[download_id] = dict(data)
+            self._touch(download_id)
+            if ttl:
+                self._ttls[download_id] = ttl
+            else:
+                self._ttls.pop(download_id, None)
+
+    def update(self, download_id, fields):
+        """Merge fields into an existing entry; returns False if there is none"""
+        with self._lock:
+            entry = self._entries.get(download_id)
+            if entry is None:
+                return False
+            entry.update(fields)
+            self._touch(download_id)
+            return True
+
+    def delete(self, download_id):
+        with self._lock:
+            self._entries.pop(download_id, None)
+            self._updated_at.pop(download_id, None)
+            self._ttls.pop(download_id, None)
+
+    def expire(self, max_age):
+        """Drop entries not updated for max_age seconds, or for their own ttl"""
+        now = time.time()
+        with self._lock:
+            for download_id in list(self._entries):
+                if self._updated_at[download_id] >= now - max_age:
+                    # Least recently updated first: only entries with a longer ttl can be expired after this
+                    if not self._ttls:
+                        break
+                    continue
+                if self._updated_at[download_id] >= now - self._ttls.get(download_id, 0):
+                    continue
+                del self._entries[download_id]
+                del self._updated_at[download_id]
+                self._ttls.pop(download_id, None)
+
+    def items(self):
+        with self._lock:
+            return [(download_id, dict(entry)) for download_id, entry in self._entries.items()]
+
+class SQLiteProgressStore:
+    """Download progress in a SQLite file shared by all workers on the host"""
+
+    def __init__(self, path):
+        self.path = path
+        conn = _sqlite_connect(path)
+        try:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS progress ('
+                'id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS progress_updated ON progress (updated_at)')
+            # Entries kept longer than expire()'s max_age; added after the first release
+            if 'ttl' not in [row[1] for row in conn.execute('PRAGMA table_info(progress)')]:
+                conn.execute('ALTER TABLE progress ADD COLUMN ttl REAL')
+        finally:
+            conn.close()
+
+    def get(self, download_id):
+        conn = _sqlite_connect(self.path)
+        try:
+            row = conn.execute('SELECT data FROM progress WHERE id = ?', (download_id,)).fetchone()
+        finally:
+            conn.close()
+        return json.loads(row[0]) if row else None
+
+    def set(self, download_id, data, ttl=None):
+        """Store an entry, kept for ttl seconds after its last update instead of expire()'s max_age if given"""
+        conn = _sqlite_connect(self.path)
+        try:
+            conn.execute(
+                'INSERT OR REPLACE INTO progress (id, data, updated_at, ttl) VALUES (?, ?, ?, ?)',
+                (download_id, json.dumps(data), time.time(), ttl)
+            )
+        finally:
+            conn.close()
+
+    def update(self, download_id, fields):
+        """Merge fields into an existing entry; returns False if there is none"""
+        conn = _sqlite_connect(self.path)
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT data FROM progress WHERE id = ?', (download_id,)).fetchone()
+            if row is None:
+                conn.execute('ROLLBACK')
+                return False
+            data = json.loads(row[0])
+            data.update(fields)
+            conn.execute(
+                'UPDATE progress SET data = ?, updated_at = ? WHERE id = ?',
+                (json.dumps(data), time.time(), download_id)
+            )
+            conn.execute('COMMIT')
+            return True
+        finally:
+            conn.close()
+
+    def delete(self, download_id):
+        conn = _sqlite_connect(self.path)
+        try:
+            conn.execute('DELETE FROM progress WHERE id = ?', (download_id,))
+        finally:
+            conn.close()
+
+    def expire(self, max_age):
+        """Drop entries not updated for max_age seconds, or for their own ttl"""
+        now = time.time()
+        conn = _sqlite_connect(self.path)
+        try:
+            conn.execute(
+                'DELETE FROM progress WHERE updated_at < ? AND (ttl IS NULL OR updated_at < ? - ttl)',
+                (now - max_age, now)
+            )
+        finally:
+            conn.close()
+
+    def items(self):
+        conn = _sqlite_connect(self.path)
+        try:
+            rows = conn.execute('SELECT id, data FROM progress').fetchall()
+        finally:
+            conn.close()
+        return [(download_id, json.loads(data)) for download_id, data in rows]
+
+class RedisError(RuntimeError):
+    """Error reply from Redis"""
+
+class RedisConnection:
+    """Minimal RESP (Redis protocol) client covering the commands the progress store needs"""
+
+    def __init__(self, url):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or 'localhost'
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip('/') or 0)
+        self._sock = None
+        self._reader = None
+
+    def _connect(self):
+        self._sock = socket.create_connection((self.host, self.port), timeout=10)
+        self._reader = self._sock.makefile('rb')
+        if self.password:
+            self.execute('AUTH', self.password)
+        if self.db:
+            self.execute('SELECT', self.db)
+
+    def close(self):
+        if self._sock is not None:
+            self._reader.close()
+            self._sock.close()
+        self._sock = None
+        self._reader = None
+
+    def execute(self, *args):
+        if self._sock is None:
+            self._connect()
+        parts = [f'*{len(args)}\r\n'.encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode()
+            parts.append(f'${len(data)}\r\n'.encode() + data + b'\r\n')
+        try:
+            self._sock.sendall(b''.join(parts))
+            reply = self._read_reply()
+        except Exception:
+            # Replies may now be out of step with the commands sent; start over on a new connection
+            self.close()
+            raise
+        if isinstance(reply, RedisError):
+            raise reply
+        return reply
+
+    def transaction(self, *commands):
+        """Run commands in one MULTI/EXEC; returns their replies, or None if a WATCHed key changed.
+
+        Raises the first error reply among them.
+        """
+        try:
+            self.execute('MULTI')
+            for command in commands:
+                self.execute(*command)
+        except RedisError:
+            # The connection is still in MULTI
+            self.close()
+            raise
+        replies = self.execute('EXEC')
+        for reply in replies or []:
+            if isinstance(reply, RedisError):
+                raise reply
+        return replies
+
+    def _read_reply(self):
+        """Read one reply; error replies are returned, not raised, so that arrays are read to the end"""
+        line = self._reader.readline()
+        if not line:
+            raise ConnectionError('Redis connection closed')
+        kind, payload = line[:1], line[1:-2]
+        if kind == b'+':
+            return payload.decode()
+        if kind == b'-':
+            return RedisError(f"Redis error: {payload.decode()}")
+        if kind == b':':
+            return int(payload)
+        if kind == b'$':
+            length = int(payload)
+            if length == -1:
+                return None
+            data = self._reader.read(length + 2)
+            return data[:-2]
+        if kind == b'*':
+            length = int(payload)
+            if length == -1:
+                return None
+            return [self._read_reply() for _ in range(length)]
+        raise RuntimeError(f"Unexpected Redis reply: {line!r}")
+
+class RedisProgressStore:
+    """Download progress in Redis hashes (one per download) shared by all workers and hosts.
+
+    Every write sets the key's expiry again, to the ttl given when the entry
+    was stored (kept in the hash under ttl_field) or the store's default.
+    """
+
+    key_prefix = 'ytdl:progress:'
+    ttl_field = '~ttl'
+
+    def __init__(self, url, ttl=PROGRESS_TTL):
+        self.url = url
+        self.ttl = ttl
+        self._local = threading.local()
+
+    def _conn(self):
+        # One connection per thread; sockets must not be shared across a fork either
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = RedisConnection(self.url)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _hset_args(self, key, data):
+        args = ['HSET', key]
+        for field, value in data.items():
+            args.extend([field, json.dumps(value)])
+        return args
+
+    def get(self, download_id):
+        reply = self._conn().execute('HGETALL', self.key_prefix + download_id)
+        if not reply:
+            return None
+        return {
+            reply[i].decode(): json.loads(reply[i + 1]) for i in range(0, len(reply), 2)
+            if reply[i].decode() != self.ttl_field
+        }
+
+    def set(self, download_id, data, ttl=None):
+        """Store an entry, kept for ttl seconds instead of the store's default if given"""
+        key = self.key_prefix + download_id
+        ttl = int(ttl or self.ttl)
+        self._conn().transaction(
+            ['DEL', key],
+            self._hset_args(key, data) + [self.ttl_field, ttl],
+            ['EXPIRE', key, ttl]
+        )
+
+    def update(self, download_id, fields):
+        """Merge fields into an existing entry; returns False if there is none"""
+        key = self.key_prefix + download_id
+        conn = self._conn()
+        try:
+            while True:
+                # Retried if the entry changes or expires before the write, so an expired entry is never recreated
+                conn.execute('WATCH', key)
+                if not conn.execute('EXISTS', key):
+                    conn.execute('UNWATCH')
+                    return False
+                ttl = int(conn.execute('HGET', key, self.ttl_field) or self.ttl)
+                commands = [self._hset_args(key, fields)] if fields else []
+                if conn.transaction(*commands, ['EXPIRE', key, ttl]) is not None:
+                    return True
+        except RedisError:
+            # Drops the WATCH along with the connection
+            conn.close()
+            raise
+
+    def delete(self, download_id):
+        self._conn().execute('DEL', self.key_prefix + download_id)
+
+    def expire(self, max_age):
+        # Keys carry their own TTL, which Redis enforces
+        pass
+
+    def items(self):
+        conn = self._conn()
+        results = []
+        cursor = b'0'
+        while True:
+            cursor, keys = conn.execute('SCAN', cursor, 'MATCH', self.key_prefix + '*', 'COUNT', 100)
+            for key in keys:
+                download_id = key.decode()[len(self.key_prefix):]
+                data = self.get(download_id)
+                if data is not None:
+                    results.append((download_id, data))
+            if cursor in (b'0', '0'):
+                return results
+
+def create_progress_store():
+    """Build the progress store selected by PROGRESS_BACKEND"""
+    if PROGRESS_BACKEND == 'sqlite':
+        return SQLiteProgressStore(PROGRESS_DB_PATH)
+    if PROGRESS_BACKEND == 'redis':
+        return RedisProgressStore(REDIS_URL)
+    return MemoryProgressStore()
+
 # Store download progress and cleanup old entries
-download_progress = {}
+progress_store = create_progress_store()
 
 def get_random_user_agent():
     """Get a random user agent to avoid detection"""
@@ -35,359 +533,2968 @@ def get_random_user_agent():
     ]
     return random.choice(user_agents)
 
-def cleanup_old_downloads():
-    """Clean up old download entries and temp files"""
-    current_time = time.time()
-    expired_ids = []
-    
-    for download_id, data in download_progress.items():
-        # Remove entries older than 1 hour
-        if current_time - float(download_id.split('_')[0]) > 3600:
-            expired_ids.append(download_id)
-            # Clean up temp files if they exist
-            if 'file_path' in data and os.path.exists(data['file_path']):
-                try:
-                    temp_dir = os.path.dirname(data['file_path'])
-                    shutil.rmtree(temp_dir, ignore_errors=True)
-                except Exception as e:
-                    logger.error(f"Error cleaning up temp directory: {e}")
-    
-    for expired_id in expired_ids:
-        del download_progress[expired_id]
+def cleanup_old_downloads():
+    """Expire stale progress entries and download directories past their expiry"""
+    progress_store.expire(PROGRESS_TTL)
+    storage_manager.evict()
+
+class Metrics:
+    """Prometheus counters and histograms, added up across all workers through SQLite.
+
+    Observations are summed in memory and a background thread adds them to
+    the per-series totals every flush_interval seconds, in one transaction, so
+    /metrics on any worker reports the whole host, at most flush_interval
+    behind for the other workers. Gauges such as queue depth are not stored;
+    their callbacks read the shared state at scrape time.
+    """
+
+    def __init__(self, path, flush_interval):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._families = {}
+        self._pending = {}  # (name, labels, suffix, le) -> amount not yet in the file
+        self._lock = threading.Lock()
+        self._pid = None
+        conn = _sqlite_connect(path)
+        try:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS samples (
+                    name TEXT NOT NULL,
+                    labels TEXT NOT NULL,
+                    suffix TEXT NOT NULL,
+                    le TEXT NOT NULL,
+                    value REAL NOT NULL,
+                    PRIMARY KEY (name, labels, suffix, le)
+                )
+            ''')
+        finally:
+            conn.close()
+
+    def counter(self, name, help_text):
+        self._families[name] = ('counter', help_text, None)
+
+    def histogram(self, name, help_text, buckets):
+        self._families[name] = ('histogram', help_text, [float(b) for b in buckets] + [float('inf')])
+
+    def gauge(self, name, help_text, collect):
+        """collect() returns (labels dict, value) pairs when scraped"""
+        self._families[name] = ('gauge', help_text, collect)
+
+    @staticmethod
+    def _labels(labels):
+        def escape(value):
+            return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        return ','.join(f'{key}="{escape(value)}"' for key, value in sorted(labels.items()))
+
+    def _add(self, rows):
+        with self._lock:
+            if self._pid != os.getpid():
+                # First observation in this process; a forked worker drops what it inherited from the master
+                self._pid = os.getpid()
+                self._pending = {}
+                thread = threading.Thread(target=self._flush_loop, name='metrics-flush')
+                thread.daemon = True
+                thread.start()
+            for name, labels, suffix, le, amount in rows:
+                key = (name, labels, suffix, le)
+                self._pending[key] = self._pending.get(key, 0) + amount
+
+    def flush(self):
+        """Add this worker's pending observations to the shared totals"""
+        with self._lock:
+            if self._pid != os.getpid() or not self._pending:
+                return
+            pending, self._pending = self._pending, {}
+        try:
+            conn = _sqlite_connect(self.path)
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                conn.executemany('''
+                    INSERT INTO samples (name, labels, suffix, le, value) VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT(name, labels, suffix, le) DO UPDATE SET value = value + excluded.value
+                ''', [key + (amount,) for key, amount in pending.items()])
+                conn.execute('COMMIT')
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            # Losing samples is better than failing the requests that produced them
+            logger.warning(f"Could not record metrics: {e}")
+
+    def _flush_loop(self):
+        pid = os.getpid()
+        while self._pid == pid:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def inc(self, name, amount=1, **labels):
+        self._add([(name, self._labels(labels), '', '', amount)])
+
+    def observe(self, name, value, **labels):
+        label_str = self._labels(labels)
+        rows = [
+            (name, label_str, '_bucket', self._bound(le), 1)
+            for le in self._families[name][2] if value <= le
+        ]
+        rows += [(name, label_str, '_sum', '', value), (name, label_str, '_count', '', 1)]
+        self._add(rows)
+
+    @contextmanager
+    def time(self, name, **labels):
+        """Observe how long the with block takes, also when it raises"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    @staticmethod
+    def _bound(le):
+        return '+Inf' if le == float('inf') else str(le)
+
+    @staticmethod
+    def _sample(name, labels, value):
+        value = int(value) if float(value).is_integer() else value
+        return f'{name}{{{labels}}} {value}' if labels else f'{name} {value}'
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        self.flush()
+        conn = _sqlite_connect(self.path)
+        try:
+            rows = conn.execute('SELECT name, labels, suffix, le, value FROM samples').fetchall()
+        finally:
+            conn.close()
+        samples = {}
+        for name, labels, suffix, le, value in rows:
+            samples.setdefault(name, {}).setdefault(labels, {})[suffix + le] = value
+        lines = []
+        for name, (kind, help_text, extra) in self._families.items():
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+            if kind == 'gauge':
+                lines += [self._sample(name, self._labels(labels), value) for labels, value in extra()]
+                continue
+            for labels, values in sorted(samples.get(name, {}).items()):
+                if kind == 'counter':
+                    lines.append(self._sample(name, labels, values.get('', 0)))
+                    continue
+                # Buckets nothing fell into are stored nowhere but still belong in the output
+                for le in extra:
+                    bound = self._bound(le)
+                    bucket_labels = ','.join(filter(None, [labels, f'le="{bound}"']))
+                    lines.append(self._sample(f'{name}_bucket', bucket_labels, values.get('_bucket' + bound, 0)))
+                lines.append(self._sample(f'{name}_sum', labels, values.get('_sum', 0)))
+                lines.append(self._sample(f'{name}_count', labels, values.get('_count', 0)))
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics(METRICS_PATH, METRICS_FLUSH_INTERVAL)
+# Observations made since the last flush when a worker shuts down
+atexit.register(metrics.flush)
+metrics.histogram('ytdl_stage_duration_seconds', 'Time spent in each stage of the download pipeline', STAGE_BUCKETS)
+metrics.histogram('ytdl_extraction_duration_seconds', 'Duration of extraction attempts by method and outcome', STAGE_BUCKETS)
+metrics.histogram('ytdl_postprocessor_duration_seconds', 'Wall time of each yt-dlp postprocessor run', STAGE_BUCKETS)
+metrics.histogram('ytdl_download_throughput_bytes_per_second', 'Average download speed of finished downloads', THROUGHPUT_BUCKETS)
+metrics.counter('ytdl_downloaded_bytes_total', 'Bytes of finished downloads')
+metrics.counter('ytdl_downloads_total', 'Download jobs by outcome')
+metrics.counter('ytdl_download_errors_total', 'Download errors by category')
+metrics.counter('ytdl_cache_requests_total', 'Cache lookups by cache and result (hit or miss)')
+
+class FileLeases:
+    """Counts active transfers per file so cleanup never removes a file that is being served.
+
+    Counts live in the storage index, per worker process, so eviction in any
+    worker on the host sees transfers served by the others. Counts left by a
+    worker that died mid-transfer are dropped when they are next checked.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        conn = _sqlite_connect(path)
+        try:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS leases ('
+                'path TEXT NOT NULL, owner_pid INTEGER NOT NULL, count INTEGER NOT NULL, '
+                'PRIMARY KEY (path, owner_pid))'
+            )
+        finally:
+            conn.close()
+
+    def acquire(self, path):
+        conn = _sqlite_connect(self.path)
+        try:
+            conn.execute(
+                'INSERT INTO leases (path, owner_pid, count) VALUES (?, ?, 1) '
+                'ON CONFLICT(path, owner_pid) DO UPDATE SET count = count + 1',
+                (path, os.getpid())
+            )
+        finally:
+            conn.close()
+
+    def release(self, path):
+        conn = _sqlite_connect(self.path)
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('UPDATE leases SET count = count - 1 WHERE path = ? AND owner_pid = ?', (path, os.getpid()))
+            conn.execute('DELETE FROM leases WHERE path = ? AND owner_pid = ? AND count <= 0', (path, os.getpid()))
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+
+    def _holders(self, where, args):
+        conn = _sqlite_connect(self.path)
+        try:
+            alive = False
+            for path, owner_pid in conn.execute(f'SELECT path, owner_pid FROM leases WHERE {where}', args).fetchall():
+                if owner_pid == os.getpid() or _pid_alive(owner_pid):
+                    alive = True
+                else:
+                    conn.execute('DELETE FROM leases WHERE path = ? AND owner_pid = ?', (path, owner_pid))
+            return alive
+        finally:
+            conn.close()
+
+    def active(self, path):
+        return self._holders('path = ?', (path,))
+
+    def active_in(self, directory):
+        """Whether any file below directory is being transferred"""
+        prefix = os.path.join(directory, '')
+        return self._holders('substr(path, 1, ?) = ?', (len(prefix), prefix))
+
+file_leases = FileLeases(STORAGE_INDEX_PATH)
+
+class StorageFull(Exception):
+    """Not enough storage budget or free disk space for a download"""
+
+class StorageManager:
+    """Working directories for downloads under one root, with a byte budget and an expiry index.
+
+    Every directory is recorded in SQLite, shared by all workers on the host.
+    A running download reserves its expected size before writing, so the
+    budget and the disk's free space are checked up front. Finished directories
+    get an expiry time and are evicted in expiry order through an index. Jobs
+    get a stable directory per video and quality, so a retried or requeued job
+    finds the partial files of an earlier attempt and yt-dlp continues them;
+    at startup a sweep hands the directories of crashed workers over to that.
+    """
+
+    def __init__(self, root, index_path, max_bytes, min_free_bytes):
+        self.root = root
+        self.index_path = index_path
+        self.max_bytes = max_bytes
+        self.min_free_bytes = min_free_bytes
+        self.evictions = 0
+        self.rejections = 0
+        self.swept = 0
+        self._pid = None
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        conn = _sqlite_connect(index_path)
+        try:
+            # owner_pid is set while a download writes to the directory, expires_at once it has finished
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS dirs ('
+                'path TEXT PRIMARY KEY, download_id TEXT NOT NULL, owner_pid INTEGER, '
+                'bytes INTEGER NOT NULL DEFAULT 0, created_at REAL NOT NULL, expires_at REAL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS dirs_expires ON dirs (expires_at)')
+        finally:
+            conn.close()
+
+    def start(self):
+        """Sweep orphaned directories once per process (safe to call repeatedly and after fork)"""
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        thread = threading.Thread(target=self.sweep, name='storage-sweeper')
+        thread.daemon = True
+        thread.start()
+
+    def create_dir(self, download_id, work_key=None):
+        """Working directory for a download; the same work_key always gets the same directory"""
+        if work_key:
+            path = os.path.join(self.root, f'ytdl_job_{work_key[:32]}')
+            os.makedirs(path, exist_ok=True)
+        else:
+            path = tempfile.mkdtemp(prefix=f'ytdl_{download_id}_', dir=self.root)
+        conn = _sqlite_connect(self.index_path)
+        try:
+            # Reusing a directory keeps its reservation but takes it off the eviction schedule
+            conn.execute('''
+                INSERT INTO dirs (path, download_id, owner_pid, created_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT(path) DO UPDATE SET
+                    download_id = excluded.download_id, owner_pid = excluded.owner_pid, expires_at = NULL
+            ''', (path, download_id, os.getpid(), time.time()))
+        finally:
+            conn.close()
+        return path
+
+    def _fits(self, conn, nbytes):
+        used = conn.execute('SELECT COALESCE(SUM(bytes), 0) FROM dirs').fetchone()[0]
+        free = shutil.disk_usage(self.root).free
+        return used + nbytes <= self.max_bytes and free - nbytes >= self.min_free_bytes
+
+    def has_room(self, nbytes=0):
+        conn = _sqlite_connect(self.index_path)
+        try:
+            return self._fits(conn, nbytes)
+        finally:
+            conn.close()
+
+    def reserve(self, path, nbytes):
+        """Admit a download expected to write nbytes into path; raises StorageFull if it can't fit"""
+        for attempt in range(2):
+            conn = _sqlite_connect(self.index_path)
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                # The directory's own earlier reservation doesn't count against it
+                conn.execute('UPDATE dirs SET bytes = 0 WHERE path = ?', (path,))
+                if self._fits(conn, nbytes):
+                    conn.execute('UPDATE dirs SET bytes = ? WHERE path = ?', (nbytes, path))
+                    conn.execute('COMMIT')
+                    return
+                conn.execute('ROLLBACK')
+            finally:
+                conn.close()
+            if attempt == 0:
+                self.evict(nbytes)
+        with self._lock:
+            self.rejections += 1
+        raise StorageFull(f"Not enough storage for {nbytes} bytes")
+
+    def finish(self, path, expires_in):
+        """Record a finished download's real size and when it may be evicted"""
+        size = 0
+        for dirpath, _, filenames in os.walk(path):
+            for name in filenames:
+                try:
+                    size += os.path.getsize(os.path.join(dirpath, name))
+                except OSError:
+                    pass
+        conn = _sqlite_connect(self.index_path)
+        try:
+            conn.execute(
+                'UPDATE dirs SET bytes = ?, owner_pid = NULL, expires_at = ? WHERE path = ?',
+                (size, time.time() + expires_in, path)
+            )
+        finally:
+            conn.close()
+
+    def keep_partial(self, path, expires_in):
+        """Keep what a failed download wrote for a retry to continue; empty directories are removed"""
+        try:
+            empty = not os.listdir(path)
+        except OSError:
+            empty = True
+        if empty:
+            self.remove(path)
+        else:
+            self.finish(path, expires_in)
+
+    def touch(self, path, expires_in):
+        """Keep a finished directory for another expires_in seconds, e.g. after it was served"""
+        conn = _sqlite_connect(self.index_path)
+        try:
+            conn.execute(
+                'UPDATE dirs SET expires_at = ? WHERE path = ? AND expires_at IS NOT NULL',
+                (time.time() + expires_in, path)
+            )
+        finally:
+            conn.close()
+
+    def remove(self, path):
+        shutil.rmtree(path, ignore_errors=True)
+        conn = _sqlite_connect(self.index_path)
+        try:
+            conn.execute('DELETE FROM dirs WHERE path = ?', (path,))
+        finally:
+            conn.close()
+
+    def evict(self, needed=0):
+        """Remove expired directories, then the soonest-expiring ones until needed bytes fit"""
+        conn = _sqlite_connect(self.index_path)
+        try:
+            rows = conn.execute(
+                'SELECT path, download_id, expires_at FROM dirs WHERE expires_at IS NOT NULL ORDER BY expires_at'
+            ).fetchall() if needed else conn.execute(
+                'SELECT path, download_id, expires_at FROM dirs WHERE expires_at < ? ORDER BY expires_at',
+                (time.time(),)
+            ).fetchall()
+            for path, download_id, expires_at in rows:
+                if expires_at > time.time() and self._fits(conn, needed):
+                    break
+                # Never remove files while a client is still transferring them
+                if file_leases.active_in(path):
+                    continue
+                # A job may have taken the directory back up since it was selected
+                if not conn.execute(
+                    'DELETE FROM dirs WHERE path = ? AND expires_at IS NOT NULL', (path,)
+                ).rowcount:
+                    continue
+                shutil.rmtree(path, ignore_errors=True)
+                progress = progress_store.get(download_id)
+                if progress and os.path.dirname(progress.get('file_path') or '') == path:
+                    progress_store.delete(download_id)
+                with self._lock:
+                    self.evictions += 1
+        finally:
+            conn.close()
+
+    def sweep(self):
+        """Keep the partial files of downloads whose worker died, and remove unindexed leftovers"""
+        try:
+            conn = _sqlite_connect(self.index_path)
+            try:
+                indexed = set()
+                for path, owner_pid in conn.execute('SELECT path, owner_pid FROM dirs').fetchall():
+                    if not os.path.isdir(path):
+                        conn.execute('DELETE FROM dirs WHERE path = ?', (path,))
+                        continue
+                    if owner_pid is not None and not _pid_alive(owner_pid):
+                        # The scheduler requeues the job, which continues from these files
+                        conn.execute(
+                            'UPDATE dirs SET owner_pid = NULL, expires_at = ? WHERE path = ? AND owner_pid = ?',
+                            (time.time() + PARTIAL_FILE_TTL, path, owner_pid)
+                        )
+                        self.swept += 1
+                    indexed.add(path)
+            finally:
+                conn.close()
+            # Also covers directories from before the index existed, which lived in the system temp dir
+            cutoff = time.time() - STORAGE_ORPHAN_GRACE
+            for parent in {self.root, tempfile.gettempdir()}:
+                for name in os.listdir(parent):
+                    path = os.path.join(parent, name)
+                    if (re.match(r'(ytdl|thumbnail)_(\d+_|job_)', name) and path not in indexed
+                            and os.path.isdir(path) and os.path.getmtime(path) < cutoff):
+                        shutil.rmtree(path, ignore_errors=True)
+                        self.swept += 1
+            if self.swept:
+                logger.info(f"Storage sweep recovered or removed {self.swept} orphaned download directories")
+        except Exception as e:
+            logger.error(f"Storage sweep error: {e}")
+
+    def stats(self):
+        conn = _sqlite_connect(self.index_path)
+        try:
+            dirs, used, running = conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(bytes), 0), COUNT(owner_pid) FROM dirs'
+            ).fetchone()
+        finally:
+            conn.close()
+        return {
+            'root': self.root,
+            'directories': dirs,
+            'running': running,
+            'bytes': used,
+            'max_bytes': self.max_bytes,
+            'free_bytes': shutil.disk_usage(self.root).free,
+            'min_free_bytes': self.min_free_bytes,
+            'evictions': self.evictions,
+            'rejections': self.rejections,
+            'swept': self.swept
+        }
+
+storage_manager = StorageManager(STORAGE_DIR, STORAGE_INDEX_PATH, STORAGE_MAX_BYTES, STORAGE_MIN_FREE_BYTES)
+
+class ProgressNotifier:
+    """Wakes progress streams in this process whenever ProgressHook records an update"""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self.version = 0
+
+    def notify(self):
+        with self._cond:
+            self.version += 1
+            self._cond.notify_all()
+
+    def wait(self, version, timeout):
+        """Block until an update newer than version arrives or timeout passes; returns the latest version"""
+        with self._cond:
+            if self.version == version:
+                self._cond.wait(timeout)
+            return self.version
+
+progress_notifier = ProgressNotifier()
+
+class DownloadCancelled(Exception):
+    """The download was cancelled through the API"""
+
+class JobControl:
+    """Cancellation of the downloads running in this process.
+
+    A running download has a flag that its progress and postprocessor hooks
+    check, so yt-dlp stops at its next progress update. ffmpeg reports no
+    progress, so the ffmpeg processes started for a download are tracked
+    and killed when it is cancelled.
+    """
+
+    def __init__(self):
+        self._jobs = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def running(self, download_id):
+        """Register the download this thread runs for the duration of the with block"""
+        with self._lock:
+            self._jobs[download_id] = (threading.Event(), [])
+        self._local.download_id = download_id
+        try:
+            yield
+        finally:
+            self._local.download_id = None
+            with self._lock:
+                self._jobs.pop(download_id, None)
+
+    def current(self):
+        """The download this thread works for, if any"""
+        return getattr(self._local, 'download_id', None)
+
+    @contextmanager
+    def working_for(self, download_id):
+        """Attribute what this helper thread starts to a download running on another thread"""
+        previous = self.current()
+        self._local.download_id = download_id
+        try:
+            yield
+        finally:
+            self._local.download_id = previous
+
+    def cancel(self, download_id):
+        """Stop a download running in this process; returns False if it doesn't run here"""
+        with self._lock:
+            job = self._jobs.get(download_id)
+        if job is None:
+            return False
+        cancelled, processes = job
+        cancelled.set()
+        for process in list(processes):
+            if process.poll() is None:
+                process.kill()
+        return True
+
+    def is_cancelled(self, download_id):
+        with self._lock:
+            job = self._jobs.get(download_id)
+        return job is not None and job[0].is_set()
+
+    def check(self, download_id):
+        if self.is_cancelled(download_id):
+            raise DownloadCancelled(f"Download {download_id} was cancelled")
+
+    def track(self, process):
+        """Attach a child process to the download running on this thread, if any"""
+        with self._lock:
+            job = self._jobs.get(self.current())
+            if job is not None:
+                job[1].append(process)
+        if job is not None and job[0].is_set():
+            process.kill()
+
+job_control = JobControl()
+
+# CPU time of the exited ffmpeg processes each thread (i.e. each running download) waited for
+_child_cpu = threading.local()
+
+def _thread_children_cpu_seconds():
+    return getattr(_child_cpu, 'seconds', 0.0)
+
+class TrackedPopen(yt_dlp.utils.Popen):
+    """Popen for yt-dlp's ffmpeg postprocessors and downloader that registers ffmpeg with the download it works for.
+
+    The process is reaped with os.wait4, which returns its own resource
+    usage, so its CPU time is added to the waiting thread's total rather than
+    read from process-wide counters.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        job_control.track(self)
+
+    def _try_wait(self, wait_flags):
+        try:
+            pid, status, usage = os.wait4(self.pid, wait_flags)
+        except ChildProcessError:
+            # Already reaped elsewhere; like Popen, report it as exited
+            return self.pid, 0
+        if pid:
+            _child_cpu.seconds = _thread_children_cpu_seconds() + usage.ru_utime + usage.ru_stime
+        return pid, status
+
+# FFmpegPostProcessor and FFmpegFD (used for clips) start ffmpeg through these module-level names
+yt_dlp.postprocessor.ffmpeg.Popen = TrackedPopen
+yt_dlp.downloader.external.Popen = TrackedPopen
+
+class FileProgress:
+    """Byte counts of one file of a download, as last reported by yt-dlp"""
+    __slots__ = ('downloaded', 'total', 'speed')
+
+    def __init__(self):
+        self.downloaded = 0
+        self.total = 0
+        self.speed = None
+
+class ProgressHook:
+    """yt-dlp progress hook keeping a download's progress as raw numbers.
+
+    yt-dlp calls it for every chunk or fragment, many times a second with
+    fragmented formats, and from several threads when formats are fetched in
+    parallel. A call only updates the byte counts of its file; their sum is
+    written to the progress store once PROGRESS_MIN_INTERVAL seconds have
+    passed or it moved by PROGRESS_MIN_DELTA percent since the last write,
+    and whenever a file completes. Readers format it, see format_progress.
+    """
+
+    def __init__(self, download_id):
+        self.download_id = download_id
+        # Number of yt-dlp extractions this download has needed so far
+        self.extraction_calls = 0
+        self.writes = 0
+        self._files = {}
+        self._lock = threading.Lock()
+        self._written_at = 0.0
+        self._written_percent = 0.0
+    
+    def __call__(self, d):
+        # Raising here is how yt-dlp is stopped mid-download
+        job_control.check(self.download_id)
+        try:
+            status = d['status']
+            if status not in ('downloading', 'finished'):
+                return
+            with self._lock:
+                record = self._files.get(d.get('filename'))
+                if record is None:
+                    record = self._files[d.get('filename')] = FileProgress()
+                record.downloaded = d.get('downloaded_bytes') or record.downloaded
+                record.total = d.get('total_bytes') or d.get('total_bytes_estimate') or record.total
+                if status == 'finished':
+                    record.total = record.downloaded
+                    record.speed = None
+                else:
+                    record.speed = d.get('speed')
+                self._write(status == 'finished')
+        except Exception as e:
+            logger.error(f"Progress hook error: {e}")
+
+    def _write(self, force):
+        downloaded = total = speed = 0
+        for record in self._files.values():
+            downloaded += record.downloaded
+            total += record.total
+            speed += record.speed or 0
+        percent = 100.0 * downloaded / total if total else 0.0
+        now = time.monotonic()
+        if not (force or now - self._written_at >= PROGRESS_MIN_INTERVAL
+                or abs(percent - self._written_percent) >= PROGRESS_MIN_DELTA):
+            return
+        self._written_at, self._written_percent = now, percent
+        self.writes += 1
+        progress_store.set(self.download_id, {
+            'status': 'downloading',
+            'downloaded_bytes': downloaded,
+            'total_bytes': total,
+            'bytes_per_second': int(speed) or None,
+            'eta_seconds': int((total - downloaded) / speed) if speed and total > downloaded else None,
+            'extraction_calls': self.extraction_calls
+        })
+        progress_notifier.notify()
+
+    def postprocessing(self, d):
+        """yt-dlp postprocessor hook: the files are complete while ffmpeg merges or converts them"""
+        if d['status'] == 'started':
+            with self._lock:
+                progress_store.update(self.download_id, {'status': 'processing', 'postprocessor': d['postprocessor']})
+            progress_notifier.notify()
+
+def format_progress(progress):
+    """API view of stored progress: the byte counts of a running download as percent and speed strings"""
+    if progress.get('status') not in ('downloading', 'postprocess_queued', 'processing') or 'downloaded_bytes' not in progress:
+        return progress
+    total = progress.get('total_bytes')
+    speed = progress.get('bytes_per_second')
+    return dict(
+        progress,
+        percent=f"{min(100.0, 100.0 * progress['downloaded_bytes'] / total):.1f}%" if total else 'N/A',
+        speed=f"{yt_dlp.utils.format_bytes(speed)}/s" if speed else 'N/A'
+    )
+
+def extract_video_id(url):
+    """Return the 11-character video ID from a YouTube URL, or None"""
+    for pattern in YOUTUBE_URL_PATTERNS:
+        match = re.match(pattern, url)
+        if match:
+            return match.group(1)
+    return None
+
+def extract_playlist_id(url):
+    """Playlist ID from a YouTube URL carrying a list parameter"""
+    if not re.match(r'(?:https?://)?(?:www\.|m\.)?youtube\.com/', url):
+        return None
+    match = re.search(r'[?&]list=([a-zA-Z0-9_-]+)', url)
+    return match.group(1) if match else None
+
+def is_valid_youtube_url(url):
+    """Validate YouTube URL with improved regex"""
+    return extract_video_id(url) is not None
+
+class MemoryVideoInfoCache:
+    """Per-process LRU cache of video info with a TTL"""
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, video_id):
+        with self._lock:
+            entry = self._entries.get(video_id)
+            if entry is None or entry[0] < time.time():
+                if entry is not None:
+                    del self._entries[video_id]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(video_id)
+            self.hits += 1
+            return dict(entry[1])
+
+    def set(self, video_id, info):
+        with self._lock:
+            self._entries[video_id] = (time.time() + self.ttl, dict(info))
+            self._entries.move_to_end(video_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'backend': 'memory',
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl
+            }
+
+class SQLiteVideoInfoCache:
+    """LRU cache of video info in a SQLite file shared by all workers on the host"""
+
+    def __init__(self, path, ttl, max_entries):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        conn = _sqlite_connect(path)
+        try:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS video_info ('
+                'video_id TEXT PRIMARY KEY, info TEXT NOT NULL, '
+                'expires_at REAL NOT NULL, last_access REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS video_info_last_access ON video_info (last_access)')
+            conn.execute('CREATE TABLE IF NOT EXISTS cache_stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+            conn.execute("INSERT OR IGNORE INTO cache_stats VALUES ('hits', 0), ('misses', 0)")
+        finally:
+            conn.close()
+
+    def get(self, video_id):
+        now = time.time()
+        conn = _sqlite_connect(self.path)
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute(
+                'SELECT info, expires_at FROM video_info WHERE video_id = ?', (video_id,)
+            ).fetchone()
+            if row is None or row[1] < now:
+                if row is not None:
+                    conn.execute('DELETE FROM video_info WHERE video_id = ?', (video_id,))
+                conn.execute("UPDATE cache_stats SET value = value + 1 WHERE name = 'misses'")
+                conn.execute('COMMIT')
+                return None
+            conn.execute('UPDATE video_info SET last_access = ? WHERE video_id = ?', (now, video_id))
+            conn.execute("UPDATE cache_stats SET value = value + 1 WHERE name = 'hits'")
+            conn.execute('COMMIT')
+            return json.loads(row[0])
+        finally:
+            conn.close()
+
+    def set(self, video_id, info):
+        now = time.time()
+        conn = _sqlite_connect(self.path)
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute(
+                'INSERT OR REPLACE INTO video_info VALUES (?, ?, ?, ?)',
+                (video_id, json.dumps(info), now + self.ttl, now)
+            )
+            conn.execute('DELETE FROM video_info WHERE expires_at < ?', (now,))
+            conn.execute(
+                'DELETE FROM video_info WHERE video_id IN ('
+                'SELECT video_id FROM video_info ORDER BY last_access DESC LIMIT -1 OFFSET ?)',
+                (self.max_entries,)
+            )
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+
+    def stats(self):
+        conn = _sqlite_connect(self.path)
+        try:
+            counters = dict(conn.execute('SELECT name, value FROM cache_stats').fetchall())
+            size = conn.execute('SELECT COUNT(*) FROM video_info').fetchone()[0]
+        finally:
+            conn.close()
+        return {
+            'backend': 'sqlite',
+            'hits': counters.get('hits', 0),
+            'misses': counters.get('misses', 0),
+            'size': size,
+            'max_entries': self.max_entries,
+            'ttl': self.ttl
+        }
+
+def create_video_info_cache():
+    """Build the video info cache selected by VIDEO_INFO_CACHE_BACKEND"""
+    if VIDEO_INFO_CACHE_BACKEND == 'none':
+        return None
+    if VIDEO_INFO_CACHE_BACKEND == 'sqlite':
+        return SQLiteVideoInfoCache(VIDEO_INFO_CACHE_PATH, VIDEO_INFO_CACHE_TTL, VIDEO_INFO_CACHE_SIZE)
+    return MemoryVideoInfoCache(VIDEO_INFO_CACHE_TTL, VIDEO_INFO_CACHE_SIZE)
+
+video_info_cache = create_video_info_cache()
+
+class SingleFlight:
+    """Collapses concurrent calls with the same key into one execution.
+
+    The first caller runs the function; callers arriving while it runs wait
+    and get the same result, or the same exception raised.
+    """
+
+    def __init__(self):
+        self.executions = 0
+        self.shared = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+                self.executions += 1
+            else:
+                self.shared += 1
+        if not leader:
+            return future.result()
+        try:
+            result = fn()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    def stats(self):
+        with self._lock:
+            return {'executions': self.executions, 'shared': self.shared, 'in_flight': len(self._calls)}
+
+video_info_flight = SingleFlight()
+
+def get_video_info(url):
+    """Get video information, serving repeat lookups of the same video ID from the cache"""
+    with metrics.time('ytdl_stage_duration_seconds', stage='video_info'):
+        return _get_video_info(url)
+
+def _get_video_info(url):
+    video_id = extract_video_id(url)
+    use_cache = video_info_cache is not None and video_id is not None
+    if use_cache:
+        cached = video_info_cache.get(video_id)
+        metrics.inc('ytdl_cache_requests_total', cache='video_info', result='miss' if cached is None else 'hit')
+        if cached is not None:
+            return cached
+    
+    def extract():
+        info = extract_video_info(url)
+        if info and use_cache:
+            video_info_cache.set(video_id, info)
+        return info
+    
+    if video_id is None:
+        return extract()
+    # Concurrent lookups of the same video share one extraction
+    return video_info_flight.do(video_id, extract)
+
+# Extraction methods by name, each with different YouTube player clients; ExtractionMethodSelector picks the order
+EXTRACTION_METHODS = {
+    'multi_client': {
+        'extractor_args': {
+            'youtube': {
+                'player_client': ['android', 'web', 'mweb', 'tv_embedded'],
+                'skip': ['dash'],
+                'player_skip': ['webpage', 'configs'],
+                'player_params': {'hl': 'en', 'gl': 'US'},
+                'player_include': ['player_response', 'player_js'],
+                'extract_flat': False,
+                'extract_info': True
+            }
+        }
+    },
+    'web': {
+        'extractor_args': {
+            'youtube': {
+                'player_client': ['web'],
+                'skip': ['dash'],
+                'player_skip': ['webpage'],
+                'player_params': {'hl': 'en', 'gl': 'US'}
+            }
+        }
+    },
+    'android': {
+        'extractor_args': {
+            'youtube': {
+                'player_client': ['android'],
+                'skip': ['dash'],
+                'player_params': {'hl': 'en', 'gl': 'US'}
+            }
+        }
+    }
+}
+
+def redact_identity(identity):
+    """An egress identity as it may be shown in stats and logs: proxies without their credentials"""
+    if '://' not in identity:
+        return identity
+    parsed = urlparse(identity)
+    host = f'[{parsed.hostname}]' if ':' in (parsed.hostname or '') else parsed.hostname or ''
+    return f"{parsed.scheme}://{host}{f':{parsed.port}' if parsed.port else ''}"
+
+class RateGovernor:
+    """Token buckets for outbound requests, shared by all workers through SQLite.
+
+    There is one bucket per target host and one per egress identity. reserve()
+    takes the tokens right away and returns how long the caller has to wait
+    before sending, which is zero while we are under budget, so nothing sleeps
+    unless we are actually over the rate. Bot checks halve a bucket's rate and
+    successful requests bring it back gradually. Egress buckets are named
+    after the redacted identity, so proxy credentials never show up in stats.
+    """
+
+    def __init__(self, path, host_rates, identity_rate, identities, burst):
+        self.path = path
+        self.identities = identities
+        self.burst = burst
+        self._egress_buckets = {}
+        for index, identity in enumerate(identities):
+            name = f'egress:{redact_identity(identity)}'
+            # Proxies that only differ in their credentials still get a bucket each
+            self._egress_buckets[identity] = name if name not in self._egress_buckets.values() else f'{name}#{index}'
+        rates = {f'host:{host}': rate for host, rate in host_rates.items()}
+        rates.update({name: identity_rate for name in self._egress_buckets.values()})
+        conn = _sqlite_connect(path)
+        try:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS buckets (
+                    name TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    rate REAL NOT NULL,
+                    base_rate REAL NOT NULL,
+                    requests INTEGER NOT NULL DEFAULT 0,
+                    throttled INTEGER NOT NULL DEFAULT 0,
+                    throttle_seconds REAL NOT NULL DEFAULT 0,
+                    blocks INTEGER NOT NULL DEFAULT 0
+                )
+            ''')
+            # Buckets of identities that are no longer configured, which older releases named with credentials
+            egress_names = list(self._egress_buckets.values())
+            conn.execute(
+                f"DELETE FROM buckets WHERE name LIKE 'egress:%' AND name NOT IN ({', '.join('?' * len(egress_names))})",
+                egress_names
+            )
+            for name, rate in rates.items():
+                # Keep the adapted state of existing buckets but pick up configuration changes
+                conn.execute('''
+                    INSERT INTO buckets (name, tokens, updated_at, rate, base_rate) VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT(name) DO UPDATE SET base_rate = excluded.base_rate, rate = MIN(rate, excluded.base_rate)
+                ''', (name, burst, time.time(), rate, rate))
+        finally:
+            conn.close()
+
+    def _available(self, row, now):
+        tokens, updated_at, rate = row
+        return min(self.burst, tokens + (now - updated_at) * rate / 60)
+
+    def reserve(self, host, use_identity=True):
+        """Take a token for host and the least loaded egress identity; returns (identity, wait_seconds)"""
+        now = time.time()
+        conn = _sqlite_connect(self.path)
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            rows = {
+                name: (tokens, updated_at, rate)
+                for name, tokens, updated_at, rate in conn.execute('SELECT name, tokens, updated_at, rate FROM buckets')
+            }
+            names = [f'host:{host}'] if f'host:{host}' in rows else []
+            identity = None
+            if use_identity:
+                identity = max(self.identities, key=lambda i: self._available(rows[self._egress_buckets[i]], now))
+                names.append(self._egress_buckets[identity])
+            wait = 0.0
+            for name in names:
+                tokens = self._available(rows[name], now) - 1
+                bucket_wait = -tokens * 60 / rows[name][2] if tokens < 0 else 0.0
+                wait = max(wait, bucket_wait)
+                conn.execute('''
+                    UPDATE buckets SET tokens = ?, updated_at = ?, requests = requests + 1,
+                        throttled = throttled + ?, throttle_seconds = throttle_seconds + ?
+                    WHERE name = ?
+                ''', (tokens, now, 1 if bucket_wait > 0 else 0, bucket_wait, name))
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+        return identity, wait
+
+    def acquire(self, host, use_identity=True):
+        """Wait only as long as the buckets require; returns the egress identity to use"""
+        identity, wait = self.reserve(host, use_identity)
+        metrics.observe('ytdl_stage_duration_seconds', wait, stage='rate_limit_wait')
+        if wait > 0:
+            logger.info(f"Rate governor: delaying request to {host} by {wait:.2f}s")
+            time.sleep(wait)
+        return identity
+
+    def _bucket_names(self, host, identity):
+        return [f'host:{host}'] + ([self._egress_buckets[identity]] if identity else [])
+
+    def report_blocked(self, host, identity):
+        """YouTube answered with a bot check: halve the rates and drop any saved-up burst"""
+        now = time.time()
+        conn = _sqlite_connect(self.path)
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for name in self._bucket_names(host, identity):
+                conn.execute('''
+                    UPDATE buckets SET rate = MAX(base_rate * ?, rate / 2), tokens = MIN(tokens, 0),
+                        updated_at = MAX(updated_at, ?), blocks = blocks + 1
+                    WHERE name = ?
+                ''', (GOVERNOR_MIN_RATE_FRACTION, now, name))
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+        logger.warning(f"Rate governor: bot check from {host} via {redact_identity(identity or 'default')}, backing off")
+
+    def report_success(self, host, identity):
+        """Let a backed-off bucket recover a little towards its configured rate"""
+        conn = _sqlite_connect(self.path)
+        try:
+            for name in self._bucket_names(host, identity):
+                conn.execute(
+                    'UPDATE buckets SET rate = MIN(base_rate, rate + base_rate * ?) WHERE name = ? AND rate < base_rate',
+                    (GOVERNOR_RECOVERY_FRACTION, name)
+                )
+        finally:
+            conn.close()
+
+    def stats(self):
+        now = time.time()
+        conn = _sqlite_connect(self.path)
+        try:
+            rows = conn.execute('''
+                SELECT name, tokens, updated_at, rate, base_rate, requests, throttled, throttle_seconds, blocks
+                FROM buckets ORDER BY name
+            ''').fetchall()
+        finally:
+            conn.close()
+        return {
+            'buckets': {
+                name: {
+                    'rate_per_minute': round(rate, 2),
+                    'configured_rate_per_minute': round(base_rate, 2),
+                    'tokens': round(self._available((tokens, updated_at, rate), now), 2),
+                    'requests': requests,
+                    'throttle_events': throttled,
+                    'throttle_seconds': round(throttle_seconds, 2),
+                    'bot_checks': blocks
+                }
+                for name, tokens, updated_at, rate, base_rate, requests, throttled, throttle_seconds, blocks in rows
+            }
+        }
+
+rate_governor = RateGovernor(
+    RATE_GOVERNOR_PATH,
+    {'www.youtube.com': YOUTUBE_REQUESTS_PER_MINUTE, 'i.ytimg.com': THUMBNAIL_REQUESTS_PER_MINUTE},
+    EGRESS_REQUESTS_PER_MINUTE, EGRESS_IDENTITIES, RATE_LIMIT_BURST
+)
+
+def egress_options(identity):
+    """yt-dlp options that route requests through an egress identity"""
+    if not identity or identity == 'default':
+        return {}
+    if '://' in identity:
+        return {'proxy': identity}
+    return {'source_address': identity}
+
+def is_bot_check(error):
+    return "Sign in to confirm you're not a bot" in str(error)
+
+class ExtractionMethodSelector:
+    """Orders EXTRACTION_METHODS by how they have been doing lately.
+
+    Each method keeps exponentially weighted averages of its success rate and
+    attempt duration in SQLite, so extract_video_info, download_video and all
+    workers learn from each other. Methods are tried cheapest first by expected
+    seconds per successful extraction; a share of requests starts with another
+    method instead, so a method that was failing is noticed once it recovers.
+    """
+
+    def __init__(self, path, methods, probe_rate):
+        self.path = path
+        self.methods = list(methods)
+        self.probe_rate = probe_rate
+        conn = _sqlite_connect(path)
+        try:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS method_stats (
+                    method TEXT PRIMARY KEY,
+                    success_rate REAL NOT NULL,
+                    avg_seconds REAL NOT NULL,
+                    attempts INTEGER NOT NULL,
+                    successes INTEGER NOT NULL,
+                    last_attempt_at REAL NOT NULL
+                )
+            ''')
+        finally:
+            conn.close()
+
+    def _load(self):
+        conn = _sqlite_connect(self.path)
+        try:
+            return {
+                row[0]: row[1:]
+                for row in conn.execute(
+                    'SELECT method, success_rate, avg_seconds, attempts, successes, last_attempt_at FROM method_stats'
+                )
+            }
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _expected_seconds(stats):
+        # Untried methods sort first so every method gets measured
+        if stats is None:
+            return 0.0
+        success_rate, avg_seconds = stats[0], stats[1]
+        return avg_seconds / max(success_rate, 0.01)
+
+    def order(self):
+        """Method names in the order to try them for one request"""
+        stats = self._load()
+        ordered = sorted(self.methods, key=lambda name: self._expected_seconds(stats.get(name)))
+        if len(ordered) > 1 and random.random() < self.probe_rate:
+            ordered.insert(0, ordered.pop(random.randrange(1, len(ordered))))
+        return ordered
+
+    def record(self, method, success, seconds):
+        now = time.time()
+        conn = _sqlite_connect(self.path)
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('''
+                INSERT INTO method_stats (method, success_rate, avg_seconds, attempts, successes, last_attempt_at)
+                VALUES (?, ?, ?, 1, ?, ?)
+                ON CONFLICT(method) DO UPDATE SET
+                    success_rate = success_rate + (excluded.success_rate - success_rate) * ?,
+                    avg_seconds = avg_seconds + (excluded.avg_seconds - avg_seconds) * ?,
+                    attempts = attempts + 1,
+                    successes = successes + excluded.successes,
+                    last_attempt_at = excluded.last_attempt_at
+            ''', (
+                method, 1.0 if success else 0.0, seconds, 1 if success else 0, now,
+                EXTRACTION_STATS_WEIGHT, EXTRACTION_STATS_WEIGHT
+            ))
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+
+    def stats(self):
+        stats = self._load()
+        methods = {}
+        for name in self.methods:
+            if name not in stats:
+                methods[name] = {'attempts': 0}
+                continue
+            success_rate, avg_seconds, attempts, successes, last_attempt_at = stats[name]
+            methods[name] = {
+                'recent_success_rate': round(success_rate, 3),
+                'recent_avg_seconds': round(avg_seconds, 3),
+                'expected_seconds_per_success': round(self._expected_seconds(stats[name]), 3),
+                'attempts': attempts,
+                'successes': successes,
+                'last_attempt_at': datetime.fromtimestamp(last_attempt_at).isoformat()
+            }
+        return {
+            'order': sorted(self.methods, key=lambda name: self._expected_seconds(stats.get(name))),
+            'probe_rate': self.probe_rate,
+            'methods': methods
+        }
+
+extraction_selector = ExtractionMethodSelector(EXTRACTION_STATS_PATH, EXTRACTION_METHODS, EXTRACTION_PROBE_RATE)
+
+def is_method_failure(error):
+    """Whether an extraction error says something about the method rather than the video"""
+    return 'Video unavailable' not in str(error)
+
+def record_extraction(method_name, started, error=None):
+    """Count an extraction attempt in the metrics and, unless the video itself is at fault, the method stats"""
+    seconds = time.time() - started
+    if error is None:
+        outcome = 'success'
+    else:
+        outcome = 'failure' if is_method_failure(error) else 'unavailable'
+    metrics.observe('ytdl_extraction_duration_seconds', seconds, method=method_name, outcome=outcome)
+    if outcome != 'unavailable':
+        extraction_selector.record(method_name, error is None, seconds)
+
+def summarize_video_info(info):
+    """Reduce a full yt-dlp info dict to the fields the API returns"""
+    # Get available formats for quality options
+    formats = info.get('formats', [])
+    available_qualities = []
+
+    # Extract unique quality options
+    quality_map = {}
+    for fmt in formats:
+        if fmt.get('height') and fmt.get('ext') in ['mp4', 'webm']:
+            height = fmt['height']
+            if height not in quality_map:
+                quality_map[height] = {
+                    'height': height,
+                    'ext': fmt['ext'],
+                    'filesize': fmt.get('filesize', 0),
+                    'format_id': fmt['format_id']
+                }
+            # Keep the best format for each height
+            elif fmt.get('filesize', 0) > quality_map[height]['filesize']:
+                quality_map[height] = {
+                    'height': height,
+                    'ext': fmt['ext'],
+                    'filesize': fmt.get('filesize', 0),
+                    'format_id': fmt['format_id']
+                }
+
+    available_qualities = sorted(quality_map.values(), key=lambda x: x['height'], reverse=True)
+
+    return {
+        'title': info.get('title', 'Unknown'),
+        'duration': info.get('duration', 0),
+        'uploader': info.get('uploader', 'Unknown'),
+        'view_count': info.get('view_count', 0),
+        'thumbnail': info.get('thumbnail', ''),
+        'description': info.get('description', '')[:200] + '...' if info.get('description') else '',
+        'upload_date': info.get('upload_date', ''),
+        'available_qualities': available_qualities,
+        'video_id': info.get('id', '')
+    }
+
+def extract_video_info(url):
+    """Extract video information without downloading"""
+    methods = extraction_selector.order()
+    for i, method_name in enumerate(methods):
+        identity = rate_governor.acquire('www.youtube.com')
+        started = time.time()
+        try:
+            with ydl_factory.info_extractor(method_name, identity) as ydl:
+                info = ydl.extract_info(url, download=False)
+                record_extraction(method_name, started)
+                rate_governor.report_success('www.youtube.com', identity)
+                
+                return summarize_video_info(info)
+                
+        except Exception as e:
+            record_extraction(method_name, started, e)
+            if is_bot_check(e):
+                rate_governor.report_blocked('www.youtube.com', identity)
+            logger.warning(f"Extraction method {method_name} failed: {str(e)}")
+            if i == len(methods) - 1:  # Last method
+                logger.error(f"All extraction methods failed for URL: {url}")
+                return None
+            continue
+    
+    return None
+
+def expand_playlist(url):
+    """Video IDs in a playlist, from a flat extraction that doesn't visit each video"""
+    identity = rate_governor.acquire('www.youtube.com')
+    ydl_opts = {
+        'quiet': True,
+        'no_warnings': True,
+        'extract_flat': 'in_playlist',
+        'skip_download': True,
+        'playlistend': MAX_BATCH_ITEMS,
+        'http_headers': {'User-Agent': get_random_user_agent()}
+    }
+    ydl_opts.update(egress_options(identity))
+    try:
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            info = ydl.extract_info(url, download=False)
+    except Exception as e:
+        if is_bot_check(e):
+            rate_governor.report_blocked('www.youtube.com', identity)
+        raise
+    rate_governor.report_success('www.youtube.com', identity)
+    return [entry['id'] for entry in (info or {}).get('entries') or [] if entry and entry.get('id')]
+
+_http_adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE)
+_http_local = threading.local()
+
+def get_http_session():
+    """Session for outbound HTTP; one per thread, all sharing one keep-alive connection pool"""
+    session = getattr(_http_local, 'session', None)
+    if session is None:
+        session = requests.Session()
+        session.mount('https://', _http_adapter)
+        session.mount('http://', _http_adapter)
+        _http_local.session = session
+    return session
+
+class ThumbnailCache:
+    """Per-process LRU of thumbnail images by video ID, bounded by total bytes"""
+
+    def __init__(self, max_bytes, ttl):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, video_id):
+        with self._lock:
+            entry = self._entries.get(video_id)
+            if entry is None or entry[0] < time.time():
+                if entry is not None:
+                    self._remove(video_id)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(video_id)
+            self.hits += 1
+            return dict(entry[1])
+
+    def set(self, video_id, thumbnail):
+        if len(thumbnail['data']) > self.max_bytes:
+            return
+        with self._lock:
+            if video_id in self._entries:
+                self._remove(video_id)
+            self._entries[video_id] = (time.time() + self.ttl, dict(thumbnail))
+            self.size += len(thumbnail['data'])
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, video_id):
+        _, thumbnail = self._entries.pop(video_id)
+        self.size -= len(thumbnail['data'])
+
+    def stats(self):
+        with self._lock:
+            return {
+                'backend': 'memory',
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._entries),
+                'bytes': self.size,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl
+            }
+
+thumbnail_cache = ThumbnailCache(THUMBNAIL_CACHE_MAX_BYTES, THUMBNAIL_CACHE_TTL) if THUMBNAIL_CACHE_MAX_BYTES > 0 else None
+thumbnail_flight = SingleFlight()
+
+def fetch_thumbnail(video_id, thumbnail_url):
+    """Download a thumbnail into the cache; returns a dict with data, content_type and etag"""
+    def fetch():
+        rate_governor.acquire(urlparse(thumbnail_url).hostname, use_identity=False)
+        with metrics.time('ytdl_stage_duration_seconds', stage='thumbnail_fetch'):
+            response = get_http_session().get(thumbnail_url, headers={'User-Agent': get_random_user_agent()}, timeout=10)
+        response.raise_for_status()
+        thumbnail = {
+            'data': response.content,
+            'content_type': response.headers.get('Content-Type', 'image/jpeg'),
+            'etag': hashlib.sha256(response.content).hexdigest()[:32]
+        }
+        if thumbnail_cache is not None:
+            thumbnail_cache.set(video_id, thumbnail)
+        thumbnail_variants.precompute(video_id, thumbnail)
+        return thumbnail
+
+    return thumbnail_flight.do(video_id, fetch)
+
+def get_thumbnail(video_id, thumbnail_url):
+    """Cached thumbnail for a video, fetched on a miss"""
+    if thumbnail_cache is None:
+        return fetch_thumbnail(video_id, thumbnail_url)
+    thumbnail = thumbnail_cache.get(video_id)
+    metrics.inc('ytdl_cache_requests_total', cache='thumbnails', result='miss' if thumbnail is None else 'hit')
+    return thumbnail or fetch_thumbnail(video_id, thumbnail_url)
+
+def render_thumbnail(data, width, image_format):
+    """Scale an image down to width and encode it as jpeg or webp"""
+    # Imported here so workers that never resize a thumbnail don't load PIL
+    from PIL import Image
+
+    image = Image.open(io.BytesIO(data))
+    if width < image.width:
+        height = max(1, round(image.height * width / image.width))
+        # JPEG decoders can scale by 1/2, 1/4 or 1/8 while decoding, which is far cheaper than resampling
+        image.draft('RGB', (width, height))
+        factor = min(image.width // width, image.height // height)
+        if factor > 1:
+            image = image.reduce(factor)
+        if image.size != (width, height):
+            image = image.resize((width, height), Image.LANCZOS)
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    output = io.BytesIO()
+    if image_format == 'webp':
+        # Encoder effort 2 is about twice as fast as the default for a few percent larger files
+        image.save(output, 'WEBP', quality=THUMBNAIL_QUALITY, method=2)
+    else:
+        image.save(output, 'JPEG', quality=THUMBNAIL_QUALITY, optimize=True, progressive=True)
+    return output.getvalue()
+
+class ThumbnailVariants:
+    """Renders resized thumbnails on a small thread pool, once per variant.
+
+    Finished variants go into the thumbnail cache next to the originals.
+    Concurrent requests for a variant that is still being rendered wait for
+    the same job.
+    """
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.rendered = 0
+        self.render_seconds = 0.0
+        self._pool = None
+        self._pid = None
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def _submit(self, key, original, width, image_format):
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is not None:
+                return job
+            # The pool's threads don't survive a fork, so each worker process gets its own
+            if self._pid != os.getpid():
+                self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='thumbnail')
+                self._pid = os.getpid()
+            job = self._jobs[key] = self._pool.submit(self._render, key, original, width, image_format)
+            return job
+
+    def _render(self, key, original, width, image_format):
+        try:
+            started = time.time()
+            data = render_thumbnail(original['data'], width, image_format)
+            variant = {
+                'data': data,
+                'content_type': THUMBNAIL_FORMATS[image_format],
+                'etag': hashlib.sha256(data).hexdigest()[:32]
+            }
+            if thumbnail_cache is not None:
+                thumbnail_cache.set(key, variant)
+            with self._lock:
+                self.rendered += 1
+                self.render_seconds += time.time() - started
+            return variant
+        finally:
+            with self._lock:
+                del self._jobs[key]
+
+    def get(self, video_id, original, width, image_format):
+        """A variant of a thumbnail, rendered now unless it is cached"""
+        key = f'{video_id}:{width}:{image_format}'
+        variant = thumbnail_cache.get(key) if thumbnail_cache is not None else None
+        return variant or self._submit(key, original, width, image_format).result()
+
+    def precompute(self, video_id, original):
+        """Start rendering the THUMBNAIL_PRECOMPUTE variants without waiting for them"""
+        if thumbnail_cache is None:
+            return
+        for width, image_format in THUMBNAIL_PRECOMPUTE:
+            self._submit(f'{video_id}:{width}:{image_format}', original, width, image_format)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'rendered': self.rendered,
+                'avg_render_ms': round(self.render_seconds * 1000 / self.rendered, 2) if self.rendered else None,
+                'in_progress': len(self._jobs)
+            }
+
+thumbnail_variants = ThumbnailVariants(THUMBNAIL_WORKERS)
+
+def thumbnail_width(requested):
+    """The smallest preset width at least as large as requested"""
+    return next((width for width in THUMBNAIL_WIDTHS if width >= requested), THUMBNAIL_WIDTHS[-1])
+
+def download_thumbnail(thumbnail_url, video_id, temp_dir):
+    """Download and save thumbnail"""
+    try:
+        with metrics.time('ytdl_stage_duration_seconds', stage='thumbnail'):
+            thumbnail = get_thumbnail(video_id, thumbnail_url)
+            
+            # Save thumbnail
+            thumbnail_path = os.path.join(temp_dir, f'{video_id}_thumbnail.jpg')
+            with open(thumbnail_path, 'wb') as f:
+                f.write(thumbnail['data'])
+        
+        return thumbnail_path
+    except Exception as e:
+        logger.error(f"Error downloading thumbnail: {e}")
+        return None
+
+# Enhanced quality mapping for better format selection
+QUALITY_FORMATS = {
+    'best': 'bestvideo[height<=1080][ext=mp4]+bestaudio[ext=m4a]/best[height<=1080]/best',
+    'high': 'bestvideo[height<=720][ext=mp4]+bestaudio[ext=m4a]/best[height<=720]/best',
+    'medium': 'bestvideo[height<=480][ext=mp4]+bestaudio[ext=m4a]/best[height<=480]/best',
+    'low': 'bestvideo[height<=360][ext=mp4]+bestaudio[ext=m4a]/best[height<=360]/worst',
+    'audio_only': 'bestaudio[ext=m4a]/bestaudio'
+}
+
+def get_postprocessors(quality):
+    """yt-dlp postprocessors applied to downloads of this quality"""
+    if quality == 'audio_only':
+        return []
+    return [{
+        'key': 'FFmpegVideoConvertor',
+        'preferedformat': 'mp4',
+    }]
+
+# Codecs stream-copied into mp4 without re-encoding: only those every player handles in mp4.
+# HEVC, AV1 and Opus fit in mp4 too, but e.g. QuickTime, iOS Safari and older Android can't play them there
+MP4_VIDEO_CODECS = ('avc1', 'h264')
+MP4_AUDIO_CODECS = ('mp4a', 'aac', 'mp3')
+
+def choose_postprocessing(info, quality):
+    """Decide how to get yt-dlp's selected formats into mp4: 'none', 'remux' or 'transcode'"""
+    if not get_postprocessors(quality):
+        return 'none'
+    
+    formats = info.get('requested_formats') or [info]
+    for fmt in formats:
+        vcodec = (fmt.get('vcodec') or 'none').split('.')[0].lower()
+        acodec = (fmt.get('acodec') or 'none').split('.')[0].lower()
+        if vcodec != 'none' and vcodec not in MP4_VIDEO_CODECS:
+            return 'transcode'
+        if acodec != 'none' and acodec not in MP4_AUDIO_CODECS:
+            return 'transcode'
+    
+    # Separate streams are merged with stream copy into mp4 (merge_output_format)
+    if len(formats) > 1 or info.get('ext') == 'mp4':
+        return 'none'
+    return 'remux'
+
+class PostprocessTimer:
+    """yt-dlp postprocessor hook adding up the wall and CPU time of a download's postprocessing.
+
+    Postprocessors run on the download's thread, and ffmpeg's CPU time is
+    counted per thread by TrackedPopen, so jobs postprocessing at the same
+    time don't count each other's ffmpeg runs.
+    """
+
+    def __init__(self):
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self._started = {}
+
+    def __call__(self, d):
+        name = d.get('postprocessor')
+        if d['status'] == 'started':
+            self._started[name] = (time.perf_counter(), _thread_children_cpu_seconds())
+        elif d['status'] == 'finished' and name in self._started:
+            wall_start, cpu_start = self._started.pop(name)
+            wall_seconds = time.perf_counter() - wall_start
+            self.wall_seconds += wall_seconds
+            self.cpu_seconds += _thread_children_cpu_seconds() - cpu_start
+            metrics.observe('ytdl_postprocessor_duration_seconds', wall_seconds, postprocessor=name)
+
+def fragment_concurrency(quality):
+    """Fragment threads per stream, capped so all running downloads stay within MAX_DOWNLOAD_CONNECTIONS"""
+    streams = MAX_CONCURRENT_DOWNLOADS * (2 if PARALLEL_FORMAT_DOWNLOADS else 1)
+    return max(1, min(FRAGMENT_CONCURRENCY.get(quality, 1), MAX_DOWNLOAD_CONNECTIONS // streams))
+
+class ParallelFormatsYoutubeDL(yt_dlp.YoutubeDL):
+    """YoutubeDL that downloads the formats of a merged download (bestvideo+bestaudio) at the same time.
+
+    process_info fetches the requested formats one after another and merges
+    them afterwards. Here every format but the last starts on a thread and
+    reports success right away; the last one runs inline and then waits for
+    the others, so all files are complete before the merge runs.
+    """
+
+    def process_info(self, info_dict):
+        formats = info_dict.get('requested_formats') or []
+        if len(formats) > 1:
+            info_dict['_parallel_formats'] = {'remaining': len(formats), 'pending': []}
+        try:
+            return super().process_info(info_dict)
+        finally:
+            info_dict.pop('_parallel_formats', None)
+
+    def dl(self, name, info, subtitle=False, test=False):
+        group = info.get('_parallel_formats')
+        # A single call for all formats (e.g. ffmpeg merging while downloading) has nothing to overlap
+        if group is None or subtitle or test or 'requested_formats' in info:
+            return super().dl(name, info, subtitle=subtitle, test=test)
+
+        group['remaining'] -= 1
+        if group['remaining'] > 0:
+            future = Future()
+            # So that ffmpeg started for this format (e.g. HLS/DASH) is killed if the download is cancelled
+            download_id = job_control.current()
+
+            def run():
+                try:
+                    with job_control.working_for(download_id):
+                        future.set_result(yt_dlp.YoutubeDL.dl(self, name, info))
+                except BaseException as e:
+                    future.set_exception(e)
+
+            threading.Thread(target=run, daemon=True).start()
+            group['pending'].append(future)
+            return True, True
+
+        try:
+            success, real_download = super().dl(name, info)
+        finally:
+            # Never let the caller clean up or merge while another format is still being written
+            wait_futures(group['pending'])
+        for future in group['pending']:
+            other_success, other_real_download = future.result()
+            success = success and other_success
+            real_download = real_download or other_real_download
+        return success, real_download
+
+def estimate_download_bytes(info, clip=None):
+    """Disk space a download needs: the selected formats, plus room for the merged or converted copy"""
+    formats = info.get('requested_formats') or [info]
+    size = sum(f.get('filesize') or f.get('filesize_approx') or 0 for f in formats)
+    duration = info.get('duration')
+    if clip and duration:
+        start, end = clip
+        size = size * max(0, min(end or duration, duration) - start) / duration
+    return int(size * 2)
+
+def clip_label(clip):
+    """Part of a clip's file name naming its time range, e.g. 1m05s-1m35s"""
+    def timestamp(seconds):
+        minutes, seconds = divmod(seconds, 60)
+        return f"{int(minutes)}m{seconds:02g}s" if minutes else f"{seconds:g}s"
+    start, end = clip
+    return f"{timestamp(start)}-{timestamp(end) if end is not None else 'end'}"
+
+# Request headers of a regular browser visit; yt-dlp sends them with a random User-Agent
+BROWSER_HEADERS = {
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,image/apng,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.9',
+    'Accept-Encoding': 'gzip, deflate, br',
+    'DNT': '1',
+    'Connection': 'keep-alive',
+    'Upgrade-Insecure-Requests': '1',
+    'Sec-Fetch-Dest': 'document',
+    'Sec-Fetch-Mode': 'navigate',
+    'Sec-Fetch-Site': 'none',
+    'Sec-Fetch-User': '?1',
+    'Cache-Control': 'max-age=0'
+}
+
+class YoutubeDLFactory:
+    """yt-dlp options from precomputed profiles, and warmed YoutubeDL instances for info extraction.
+
+    The options for each extraction method, and for each method and quality
+    when downloading, are put together once; callers get a copy to add their
+    per-request settings to. Info extraction reuses one YoutubeDL per thread,
+    method and egress identity, so extractors, the cookie jar and HTTP
+    connections are set up once instead of on every request. A YoutubeDL's
+    request handlers keep the headers it was created with, so the user agent
+    now changes with each new instance: after max_uses extractions, or right
+    away when an extraction fails.
+    """
+
+    def __init__(self, methods, qualities, max_uses):
+        self.max_uses = max_uses
+        self.created = 0
+        self.reused = 0
+        self.discarded = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        common = {
+            'retries': 3,
+            'fragment_retries': 3,
+            'ignoreerrors': False,
+            'no_warnings': True,
+            'cookiesfrombrowser': None,
+            'cookiefile': None
+        }
+        self.info_profiles = {
+            name: {**common, 'quiet': True, 'extract_flat': False, 'skip_download': True, **method}
+            for name, method in methods.items()
+        }
+        self.download_profiles = {
+            (name, quality): {
+                **common,
+                'format': quality_format,
+                'writesubtitles': False,
+                'writeautomaticsub': False,
+                'merge_output_format': 'mp4',
+                'concurrent_fragment_downloads': fragment_concurrency(quality),
+                **method
+            }
+            for name, method in methods.items()
+            for quality, quality_format in qualities.items()
+        }
+
+    @staticmethod
+    def _with_identity(profile, identity):
+        options = dict(profile)
+        options['http_headers'] = dict(BROWSER_HEADERS, **{'User-Agent': get_random_user_agent()})
+        options.update(egress_options(identity))
+        return options
+
+    def info_options(self, method_name, identity):
+        return self._with_identity(self.info_profiles[method_name], identity)
+
+    def download_options(self, method_name, quality, identity):
+        profile = self.download_profiles.get((method_name, quality))
+        if profile is None:
+            profile = dict(
+                self.download_profiles[(method_name, 'best')],
+                format='best', concurrent_fragment_downloads=fragment_concurrency(quality)
+            )
+        return self._with_identity(profile, identity)
+
+    def _instances(self):
+        # Instances hold sockets, so a forked worker must not use its parent's
+        if getattr(self._local, 'pid', None) != os.getpid():
+            self._local.pid = os.getpid()
+            self._local.instances = {}
+        return self._local.instances
+
+    @contextmanager
+    def info_extractor(self, method_name, identity):
+        """A YoutubeDL for extract_info(download=False), reused by later calls on this thread"""
+        if not YDL_REUSE_INSTANCES:
+            with yt_dlp.YoutubeDL(self.info_options(method_name, identity)) as ydl:
+                yield ydl
+            return
+        instances = self._instances()
+        key = (method_name, identity)
+        entry = instances.pop(key, None)
+        with self._lock:
+            if entry is None:
+                self.created += 1
+            else:
+                self.reused += 1
+        ydl, uses = entry if entry is not None else (yt_dlp.YoutubeDL(self.info_options(method_name, identity)), 0)
+        try:
+            yield ydl
+        except BaseException:
+            # Start over with fresh cookies and connections after a bot check or any other failure
+            with self._lock:
+                self.discarded += 1
+            ydl.close()
+            raise
+        if uses + 1 >= self.max_uses:
+            ydl.close()
+        else:
+            instances[key] = (ydl, uses + 1)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'reuse': YDL_REUSE_INSTANCES,
+                'created': self.created,
+                'reused': self.reused,
+                'discarded': self.discarded,
+                'max_uses': self.max_uses
+            }
+
+ydl_factory = YoutubeDLFactory(EXTRACTION_METHODS, QUALITY_FORMATS, YDL_INSTANCE_MAX_USES)
+
+# Left in a job's directory next to the media file: partial downloads (kept for resuming), the
+# per-format files of a merge, and thumbnails
+LEFTOVER_FILE_RE = re.compile(r'(\.part|\.part-Frag\d+|\.ytdl|\.temp\.\w+|\.f\d+(-\w+)?\.\w+|\.(jpe?g|png|webp))$', re.IGNORECASE)
+
+def find_downloaded_file(temp_dir, result, thumbnail_path=None):
+    """Path of the media file a download produced, or None.
+
+    yt-dlp reports it in requested_downloads; otherwise it is looked for
+    among the files of the job's directory, preferring yt-dlp's extension.
+    """
+    for requested in (result or {}).get('requested_downloads') or []:
+        if requested.get('filepath') and os.path.exists(requested['filepath']):
+            return requested['filepath']
+    files = sorted(
+        f for f in os.listdir(temp_dir)
+        if not f.startswith('.') and not LEFTOVER_FILE_RE.search(f) and os.path.join(temp_dir, f) != thumbnail_path
+    )
+    extension = (result or {}).get('ext')
+    expected = [f for f in files if extension and f.endswith('.' + extension)]
+    files = expected or files
+    return os.path.join(temp_dir, files[0]) if files else None
+
+def download_video(url, quality='best', download_id=None, download_thumbnail_option=False, work_key=None, clip=None):
+    """Download video with improved error handling and progress tracking.
+
+    Downloads with the same work_key share a working directory, so partial
+    files left by a failed or interrupted attempt are continued, not restarted.
+    With clip, a (start, end) pair of seconds where end may be None for the
+    end of the video, only that range is fetched: ffmpeg seeks in the remote
+    streams and copies the packets from the preceding keyframe on, so cuts
+    are exact only with CLIP_PRECISE_CUTS, which re-encodes the clip.
+    """
+    if not download_id:
+        download_id = str(int(time.time()))
+    
+    # Working directory, tracked against the storage budget
+    temp_dir = storage_manager.create_dir(download_id, work_key)
+    
+    # One hook for all attempts so the extraction count covers the whole download
+    progress_hook = ProgressHook(download_id)
+    postprocess_stage = PostprocessStage(download_id)
+    postprocess_timer = PostprocessTimer()
+    
+    methods = extraction_selector.order()
+    for i, method_name in enumerate(methods):
+        identity = rate_governor.acquire('www.youtube.com')
+        extraction_started = None
+        try:
+            job_control.check(download_id)
+            # A previous attempt may have given up its download slot for postprocessing
+            postprocess_stage.resume()
+            ydl_opts = ydl_factory.download_options(method_name, quality, identity)
+            ydl_opts.update({
+                'outtmpl': os.path.join(temp_dir, '%(title)s.%(ext)s'),
+                'progress_hooks': [progress_hook],
+                'writethumbnail': download_thumbnail_option,
+                # Added per download once the selected formats are known, see choose_postprocessing
+                'postprocessors': [],
+                # The stage hook goes first: it may wait for a postprocessing slot, which is not postprocessing time
+                'postprocessor_hooks': [
+                    postprocess_stage, postprocess_timer, progress_hook.postprocessing,
+                    lambda d: job_control.check(download_id)
+                ]
+            })
+            if clip:
+                start, end = clip
+                ydl_opts.update({
+                    'outtmpl': os.path.join(temp_dir, f"%(title)s ({clip_label(clip)}).%(ext)s"),
+                    'download_ranges': yt_dlp.utils.download_range_func(
+                        None, [(start, float('inf') if end is None else end)]
+                    ),
+                    'force_keyframes_at_cuts': CLIP_PRECISE_CUTS
+                })
+            
+            downloader_class = ParallelFormatsYoutubeDL if PARALLEL_FORMAT_DOWNLOADS else yt_dlp.YoutubeDL
+            with downloader_class(ydl_opts) as ydl:
+                progress_store.set(download_id, {
+                    'status': 'starting',
+                    'percent': '0%',
+                    'extraction_calls': progress_hook.extraction_calls
+                })
+                
+                # Extract once; the same info dict feeds the thumbnail, format selection and the download
+                progress_hook.extraction_calls += 1
+                extraction_started = time.time()
+                info = ydl.extract_info(url, download=False)
+                record_extraction(method_name, extraction_started)
+                extraction_started = None
+                rate_governor.report_success('www.youtube.com', identity)
+                if video_info_cache is not None and info.get('id'):
+                    video_info_cache.set(info['id'], summarize_video_info(info))
+                job_control.check(download_id)
+                
+                thumbnail_path = None
+                if download_thumbnail_option and info.get('thumbnail'):
+                    thumbnail_path = download_thumbnail(
+                        info['thumbnail'], 
+                        info.get('id') or download_id, 
+                        temp_dir
+                    )
+                
+                # Only re-encode when the selected streams can't simply be copied into mp4
+                postprocess_mode = choose_postprocessing(info, quality)
+                
+                # Check the storage budget before writing anything
+                storage_manager.reserve(temp_dir, estimate_download_bytes(info, clip))
+                if postprocess_mode == 'remux':
+                    ydl.add_post_processor(FFmpegVideoRemuxerPP(ydl, preferedformat='mp4'))
+                elif postprocess_mode == 'transcode':
+                    for pp_def in get_postprocessors(quality):
+                        pp_args = {k: v for k, v in pp_def.items() if k != 'key'}
+                        ydl.add_post_processor(get_postprocessor(pp_def['key'])(ydl, **pp_args))
+                
+                download_started = time.perf_counter()
+                try:
+                    result = ydl.process_ie_result(info, download=True)
+                finally:
+                    postprocess_stage.leave()
+                # process_ie_result also runs the postprocessors and waits for their slot; those are timed separately
+                download_seconds = (
+                    time.perf_counter() - download_started - postprocess_timer.wall_seconds - postprocess_stage.wait_seconds
+                )
+                metrics.observe('ytdl_stage_duration_seconds', download_seconds, stage='download')
+                if postprocess_timer.wall_seconds:
+                    metrics.observe('ytdl_stage_duration_seconds', postprocess_timer.wall_seconds, stage='postprocess')
+                progress_store.update(download_id, {
+                    'postprocess_mode': postprocess_mode,
+                    'postprocess_wall_seconds': round(postprocess_timer.wall_seconds, 3),
+                    'postprocess_cpu_seconds': round(postprocess_timer.cpu_seconds, 3)
+                })
+                logger.info(
+                    f"Download {download_id} postprocessing: {postprocess_mode}, "
+                    f"{postprocess_timer.wall_seconds:.2f}s wall, {postprocess_timer.cpu_seconds:.2f}s CPU"
+                )
+                
+                file_path = find_downloaded_file(temp_dir, result, thumbnail_path)
+                if file_path:
+                    file_size = os.path.getsize(file_path)
+                    metrics.inc('ytdl_downloaded_bytes_total', file_size)
+                    if download_seconds > 0:
+                        metrics.observe('ytdl_download_throughput_bytes_per_second', file_size / download_seconds)
+                    # Update progress with file path and thumbnail path
+                    fields = {'file_path': file_path}
+                    if thumbnail_path:
+                        fields['thumbnail_path'] = thumbnail_path
+                    progress_store.update(download_id, fields)
+                    return file_path
+                else:
+                    raise Exception("No file was downloaded")
+                    
+        except DownloadCancelled:
+            storage_manager.remove(temp_dir)
+            raise
+        except StorageFull as e:
+            metrics.inc('ytdl_download_errors_total', category='storage_full')
+            logger.warning(f"Download {download_id} rejected: {e}")
+            error_msg = "The server is out of storage space. Please try again later."
+            progress_store.set(download_id, {
+                'status': 'error',
+                'message': error_msg,
+                'extraction_calls': progress_hook.extraction_calls
+            })
+            storage_manager.remove(temp_dir)
+            raise Exception(error_msg)
+        except yt_dlp.utils.DownloadError as e:
+            if job_control.is_cancelled(download_id):
+                # yt-dlp reports the killed ffmpeg as a postprocessing error
+                storage_manager.remove(temp_dir)
+                raise DownloadCancelled(f"Download {download_id} was cancelled") from e
+            error_msg = str(e)
+            # Only extraction failures count against the method, not failures of the download itself
+            if extraction_started is not None:
+                record_extraction(method_name, extraction_started, error_msg)
+            if is_bot_check(error_msg):
+                metrics.inc('ytdl_download_errors_total', category='bot_check')
+                rate_governor.report_blocked('www.youtube.com', identity)
+                error_msg = "YouTube is blocking requests. Please try again later."
+            elif "Video unavailable" in error_msg:
+                metrics.inc('ytdl_download_errors_total', category='unavailable')
+                error_msg = "This video is not available for download."
+            elif "Failed to extract any player response" in error_msg:
+                metrics.inc('ytdl_download_errors_total', category='player_response')
+                logger.warning(f"Player response extraction failed with method {method_name}: {error_msg}")
+                if i == len(methods) - 1:  # Last method
+                    error_msg = "Unable to extract video information. YouTube may have changed their API."
+                    progress_store.set(download_id, {
+                        'status': 'error',
+                        'message': error_msg,
+                        'extraction_calls': progress_hook.extraction_calls
+                    })
+                    storage_manager.keep_partial(temp_dir, PARTIAL_FILE_TTL)
+                    raise Exception(error_msg)
+                continue  # Try next method
+            else:
+                metrics.inc('ytdl_download_errors_total', category='download_error')
+                progress_store.set(download_id, {
+                    'status': 'error',
+                    'message': error_msg,
+                    'extraction_calls': progress_hook.extraction_calls
+                })
+                storage_manager.keep_partial(temp_dir, PARTIAL_FILE_TTL)
+                raise Exception(error_msg)
+        except Exception as e:
+            if job_control.is_cancelled(download_id):
+                storage_manager.remove(temp_dir)
+                raise DownloadCancelled(f"Download {download_id} was cancelled") from e
+            if extraction_started is not None:
+                record_extraction(method_name, extraction_started, e)
+            metrics.inc('ytdl_download_errors_total', category='other')
+            logger.warning(f"Download method {method_name} failed: {str(e)}")
+            if i == len(methods) - 1:  # Last method
+                error_msg = f"Download failed: {str(e)}"
+                progress_store.set(download_id, {
+                    'status': 'error',
+                    'message': error_msg,
+                    'extraction_calls': progress_hook.extraction_calls
+                })
+                storage_manager.keep_partial(temp_dir, PARTIAL_FILE_TTL)
+                raise Exception(error_msg)
+            continue  # Try next method
+    
+    storage_manager.keep_partial(temp_dir, PARTIAL_FILE_TTL)
+    return None
+
+def artifact_key(video_id, quality, clip=None):
+    """Content address for a download: video ID, format selector, postprocessor settings and clip range"""
+    material = [video_id, QUALITY_FORMATS.get(quality, 'best'), get_postprocessors(quality)]
+    if clip:
+        material.append([clip[0], clip[1], CLIP_PRECISE_CUTS])
+    return hashlib.sha256(json.dumps(material, sort_keys=True).encode()).hexdigest()
+
+def work_key(key, download_thumbnail):
+    """Key of the job producing an artifact, which names its directory and lets identical requests share it.
+
+    Only jobs asked for a thumbnail fetch one, so those are separate jobs.
+    """
+    if not download_thumbnail:
+        return key
+    return hashlib.sha256(f'{key}:thumbnail'.encode()).hexdigest()
+
+class ArtifactCache:
+    """On-disk cache of finished downloads with a byte budget, shared by all workers on the host.
+
+    Files live in one directory per key and are moved in with an atomic rename;
+    the SQLite index tracks size and usage for LRU/LFU eviction.
+    """
+
+    def __init__(self, root, max_bytes, policy='lru'):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.index_path = os.path.join(root, 'index.sqlite3')
+        conn = _sqlite_connect(self.index_path)
+        try:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS artifacts ('
+                'key TEXT PRIMARY KEY, path TEXT NOT NULL, size INTEGER NOT NULL, '
+                'created_at REAL NOT NULL, last_access REAL NOT NULL, hits INTEGER NOT NULL DEFAULT 0)'
+            )
+            conn.execute('CREATE TABLE IF NOT EXISTS cache_stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+            conn.execute("INSERT OR IGNORE INTO cache_stats VALUES ('hits', 0), ('misses', 0)")
+        finally:
+            conn.close()
+
+    def lookup(self, key):
+        """Path of the cached artifact for key, or None"""
+        conn = _sqlite_connect(self.index_path)
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT path FROM artifacts WHERE key = ?', (key,)).fetchone()
+            if row is not None and not os.path.exists(row[0]):
+                conn.execute('DELETE FROM artifacts WHERE key = ?', (key,))
+                row = None
+            if row is None:
+                conn.execute("UPDATE cache_stats SET value = value + 1 WHERE name = 'misses'")
+            else:
+                conn.execute(
+                    'UPDATE artifacts SET last_access = ?, hits = hits + 1 WHERE key = ?', (time.time(), key)
+                )
+                conn.execute("UPDATE cache_stats SET value = value + 1 WHERE name = 'hits'")
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+        return row[0] if row else None
+
+    def store(self, key, file_path):
+        """Move a finished download into the cache and return its new path"""
+        key_dir = os.path.join(self.root, key)
+        os.makedirs(key_dir, exist_ok=True)
+        final_path = os.path.join(key_dir, os.path.basename(file_path))
+        try:
+            os.replace(file_path, final_path)
+        except OSError:
+            # Different filesystem: copy next to the destination, then rename atomically
+            partial_path = final_path + f'.{os.getpid()}.tmp'
+            shutil.copyfile(file_path, partial_path)
+            os.replace(partial_path, final_path)
+            os.remove(file_path)
+        
+        now = time.time()
+        conn = _sqlite_connect(self.index_path)
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute(
+                'INSERT OR REPLACE INTO artifacts (key, path, size, created_at, last_access) VALUES (?, ?, ?, ?, ?)',
+                (key, final_path, os.path.getsize(final_path), now, now)
+            )
+            evicted = self._evict(conn, keep=key)
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+        for path in evicted:
+            shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+        if evicted:
+            # Finished downloads served from an evicted artifact are gone, like evicted storage directories
+            evicted = set(evicted)
+            for download_id, progress in progress_store.items():
+                if progress.get('file_path') in evicted:
+                    progress_store.delete(download_id)
+        return final_path
+
+    def _evict(self, conn, keep):
+        """Drop index rows until the cache fits its budget; returns paths to delete"""
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM artifacts').fetchone()[0]
+        if total <= self.max_bytes:
+            return []
+        order = 'hits, last_access' if self.policy == 'lfu' else 'last_access'
+        evicted = []
+        for key, path, size in conn.execute(
+            f'SELECT key, path, size FROM artifacts WHERE key != ? ORDER BY {order}', (keep,)
+        ).fetchall():
+            if total <= self.max_bytes:
+                break
+            # Never remove files while a client is still transferring them; the cache stays over budget until then
+            if file_leases.active(path):
+                continue
+            conn.execute('DELETE FROM artifacts WHERE key = ?', (key,))
+            evicted.append(path)
+            total -= size
+        return evicted
+
+    def stats(self):
+        conn = _sqlite_connect(self.index_path)
+        try:
+            counters = dict(conn.execute('SELECT name, value FROM cache_stats').fetchall())
+            count, total = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM artifacts').fetchone()
+        finally:
+            conn.close()
+        return {
+            'backend': 'disk',
+            'hits': counters.get('hits', 0),
+            'misses': counters.get('misses', 0),
+            'size': count,
+            'bytes': total,
+            'max_bytes': self.max_bytes,
+            'policy': self.policy
+        }
+
+artifact_cache = ArtifactCache(ARTIFACT_CACHE_DIR, ARTIFACT_CACHE_MAX_BYTES, ARTIFACT_CACHE_POLICY) if ARTIFACT_CACHE_MAX_BYTES > 0 else None
+
+class DownloadFlights:
+    """Tracks which download is producing each (video ID, quality) across all workers on the host"""
+
+    def __init__(self, path):
+        self.path = path
+        conn = _sqlite_connect(path)
+        try:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS flights ('
+                'download_id TEXT PRIMARY KEY, key TEXT NOT NULL, started_at REAL NOT NULL, '
+                'followers INTEGER NOT NULL DEFAULT 0)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS flights_key ON flights (key)')
+            # Set when the download's own caller cancelled while others were attached; added after the first release
+            if 'leader_detached' not in [row[1] for row in conn.execute('PRAGMA table_info(flights)')]:
+                conn.execute('ALTER TABLE flights ADD COLUMN leader_detached INTEGER NOT NULL DEFAULT 0')
+        finally:
+            conn.close()
+
+    def claim(self, key, download_id):
+        """Register download_id as the producer of key; returns the existing producer's ID if one is running"""
+        now = time.time()
+        conn = _sqlite_connect(self.path)
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute(
+                'SELECT download_id FROM flights WHERE key = ? AND started_at > ?',
+                (key, now - DOWNLOAD_FLIGHT_TTL)
+            ).fetchone()
+            if row is None:
+                conn.execute('INSERT INTO flights (download_id, key, started_at) VALUES (?, ?, ?)', (download_id, key, now))
+            else:
+                conn.execute('UPDATE flights SET followers = followers + 1 WHERE download_id = ?', (row[0],))
+            conn.execute('DELETE FROM flights WHERE started_at < ?', (now - DOWNLOAD_FLIGHT_TTL,))
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+        return row[0] if row else None
+
+    def detach_leader(self, download_id):
+        """Let the caller that started a download leave it if others are attached; returns False if none are"""
+        conn = _sqlite_connect(self.path)
+        try:
+            return conn.execute(
+                'UPDATE flights SET leader_detached = 1 WHERE download_id = ? AND followers > 0', (download_id,)
+            ).rowcount > 0
+        finally:
+            conn.close()
+
+    def detach_follower(self, download_id):
+        """Let an attached caller leave a download; returns True if nobody is left waiting for it"""
+        conn = _sqlite_connect(self.path)
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute(
+                'UPDATE flights SET followers = followers - 1 WHERE download_id = ? AND followers > 0', (download_id,)
+            )
+            row = conn.execute(
+                'SELECT followers, leader_detached FROM flights WHERE download_id = ?', (download_id,)
+            ).fetchone()
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+        return row is not None and row == (0, 1)
+
+    def release(self, key, download_id):
+        """Mark a download as finished so later requests for key start a new one"""
+        conn = _sqlite_connect(self.path)
+        try:
+            conn.execute('DELETE FROM flights WHERE key = ? AND download_id = ?', (key, download_id))
+        finally:
+            conn.close()
+
+    def stats(self):
+        conn = _sqlite_connect(self.path)
+        try:
+            in_flight, followers = conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(followers), 0) FROM flights'
+            ).fetchone()
+        finally:
+            conn.close()
+        return {'in_flight': in_flight, 'attached': followers}
+
+download_flights = DownloadFlights(DOWNLOAD_FLIGHTS_PATH)
+
+def run_download_job(download_id, job):
+    """Run a scheduled download job and record its outcome in the progress store"""
+    key = job.get('artifact_key')
+    flight_key = job.get('flight_key')
+    started = time.perf_counter()
+    try:
+        with job_control.running(download_id):
+            file_path = download_video(
+                job['url'], job['quality'], download_id, job['download_thumbnail'],
+                work_key=flight_key, clip=job.get('clip')
+            )
+        if not file_path:
+            raise Exception("No file was downloaded")
+        fields = {'status': 'finished', 'file_path': file_path, 'filename': os.path.basename(file_path)}
+        temp_dir = os.path.dirname(file_path)
+        if key and artifact_cache is not None:
+            # Later requests for the same artifact are served straight from the cache
+            fields['file_path'] = artifact_cache.store(key, file_path)
+            fields['cached'] = True
+            storage_manager.remove(temp_dir)
+        else:
+            storage_manager.finish(temp_dir, FINISHED_FILE_TTL)
+        # Only now, with the file in its final place, is the download reported finished
+        progress_store.update(download_id, fields)
+        metrics.inc('ytdl_downloads_total', outcome='finished')
+    except DownloadCancelled:
+        metrics.inc('ytdl_downloads_total', outcome='cancelled')
+        logger.info(f"Download {download_id} cancelled")
+        progress_store.set(download_id, {'status': 'cancelled', 'message': 'The download was cancelled.'})
+    except Exception as e:
+        metrics.inc('ytdl_downloads_total', outcome='error')
+        logger.error(f"Background download error: {e}")
+        progress_store.set(download_id, {
+            'status': 'error', 
+            'message': str(e)
+        })
+    finally:
+        progress_notifier.notify()
+        metrics.observe('ytdl_stage_duration_seconds', time.perf_counter() - started, stage='job')
+        if flight_key:
+            download_flights.release(flight_key, download_id)
+
+def _pid_alive(pid):
+    """Check whether a process with this PID is still running"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+# The download queue and the postprocessing queue keep their jobs in tables of this shape
+
+def _create_jobs_table(conn, columns=''):
+    """Create a job queue table: id, the given extra columns, then status, owning worker and timestamps"""
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS jobs ('
+        f'id TEXT PRIMARY KEY, {columns}'
+        'status TEXT NOT NULL, owner_pid INTEGER, enqueued_at REAL NOT NULL, '
+        'started_at REAL, finished_at REAL)'
+    )
+    conn.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, enqueued_at)')
+
+def _average_job_seconds(conn, default):
+    """Average run time of the last finished jobs in a job queue, or default before any finished"""
+    row = conn.execute(
+        'SELECT AVG(finished_at - started_at) FROM ('
+        "SELECT started_at, finished_at FROM jobs WHERE status = 'done' "
+        'ORDER BY finished_at DESC LIMIT 20)'
+    ).fetchone()
+    return row[0] or default
+
+def _prune_finished_jobs(conn):
+    # Finished jobs are only kept around for ETA estimates
+    conn.execute("DELETE FROM jobs WHERE status = 'done' AND finished_at < ?", (time.time() - 3600,))
+
+class DownloadScheduler:
+    """Bounded download worker pool fed by a persistent FIFO job queue.
+
+    Jobs live in a SQLite file so every gunicorn worker on the host shares one
+    concurrency limit and queued jobs survive a worker restart. When choosing the
+    next job, clients with fewer running jobs go first, oldest job first.
+    """
+
+    def __init__(self, path, max_workers, max_queued, runner):
+        self.path = path
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.runner = runner
+        self._cond = threading.Condition()
+        self._pid = None
+        self._running_here = set()
+        conn = _sqlite_connect(path)
+        try:
+            _create_jobs_table(conn, 'client TEXT NOT NULL, payload TEXT NOT NULL, ')
+            # Cap on running jobs of the job's client (batches); added after the first release
+            columns = [row[1] for row in conn.execute('PRAGMA table_info(jobs)')]
+            if 'client_limit' not in columns:
+                conn.execute('ALTER TABLE jobs ADD COLUMN client_limit INTEGER')
+            # Set on running jobs to be cancelled by whichever worker runs them
+            if 'cancel_requested' not in columns:
+                conn.execute('ALTER TABLE jobs ADD COLUMN cancel_requested INTEGER NOT NULL DEFAULT 0')
+        finally:
+            conn.close()
+
+    def start(self):
+        """Start the dispatcher in this process (safe to call repeatedly and after fork)"""
+        with self._cond:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        thread = threading.Thread(target=self._dispatch_loop, name='download-dispatcher')
+        thread.daemon = True
+        thread.start()
+
+    def submit(self, download_id, client, job):
+        """Queue a job; returns False when the queue is full"""
+        self.start()
+        conn = _sqlite_connect(self.path)
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            # Batch jobs have their own limit, see submit_many
+            queued = conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND client_limit IS NULL"
+            ).fetchone()[0]
+            if queued >= self.max_queued:
+                conn.execute('ROLLBACK')
+                return False
+            conn.execute(
+                "INSERT INTO jobs (id, client, payload, status, enqueued_at) VALUES (?, ?, ?, 'queued', ?)",
+                (download_id, client, json.dumps(job), time.time())
+            )
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+        with self._cond:
+            self._cond.notify()
+        return True
+
+    def submit_many(self, jobs, client, client_limit, max_queued):
+        """Queue (download_id, job) pairs at once, running at most client_limit of them together.
+
+        Returns False, queueing nothing, if that would put more than max_queued
+        such jobs in the queue.
+        """
+        self.start()
+        conn = _sqlite_connect(self.path)
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            queued = conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND client_limit IS NOT NULL"
+            ).fetchone()[0]
+            if queued + len(jobs) > max_queued:
+                conn.execute('ROLLBACK')
+                return False
+            now = time.time()
+            conn.executemany(
+                "INSERT INTO jobs (id, client, payload, status, enqueued_at, client_limit) VALUES (?, ?, ?, 'queued', ?, ?)",
+                [(download_id, client, json.dumps(job), now, client_limit) for download_id, job in jobs]
+            )
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+        with self._cond:
+            self._cond.notify()
+        return True
+
+    def acquire(self, download_id, client):
+        """Take a slot for a stream-through download, done outside the queue; returns False if none is free
+
+        The slot is a 'streaming' row: it counts against the limit like a
+        running job, but has no job to requeue if its worker dies.
+        """
+        conn = _sqlite_connect(self.path)
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            running = conn.execute("SELECT COUNT(*) FROM jobs WHERE status IN ('running', 'streaming')").fetchone()[0]
+            if running >= self.max_workers:
+                conn.execute('ROLLBACK')
+                return False
+            now = time.time()
+            conn.execute(
+                "INSERT INTO jobs (id, client, payload, status, owner_pid, enqueued_at, started_at) "
+                "VALUES (?, ?, '{}', 'streaming', ?, ?, ?)",
+                (download_id, client, os.getpid(), now, now)
+            )
+            conn.execute('COMMIT')
+            return True
+        finally:
+            conn.close()
+
+    def release(self, download_id):
+        """Give back a slot taken with acquire()"""
+        conn = _sqlite_connect(self.path)
+        try:
+            conn.execute("DELETE FROM jobs WHERE id = ? AND status = 'streaming'", (download_id,))
+        finally:
+            conn.close()
+        with self._cond:
+            self._cond.notify()
+
+    def handoff(self, download_id):
+        """Free the download slot of a running job that moves on to postprocessing"""
+        conn = _sqlite_connect(self.path)
+        try:
+            conn.execute(
+                "UPDATE jobs SET status = 'postprocessing' WHERE id = ? AND status = 'running'", (download_id,)
+            )
+        finally:
+            conn.close()
+        with self._cond:
+            self._cond.notify()
+
+    def resume(self, download_id):
+        """Take a download slot again for a job back from postprocessing, waiting for one to free up"""
+        while True:
+            job_control.check(download_id)
+            conn = _sqlite_connect(self.path)
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                running = conn.execute("SELECT COUNT(*) FROM jobs WHERE status IN ('running', 'streaming')").fetchone()[0]
+                # Also done when the job is not handed off, e.g. downloads run outside the queue
+                if running < self.max_workers or not conn.execute(
+                    "SELECT 1 FROM jobs WHERE id = ? AND status = 'postprocessing'", (download_id,)
+                ).fetchone():
+                    conn.execute(
+                        "UPDATE jobs SET status = 'running' WHERE id = ? AND status = 'postprocessing'", (download_id,)
+                    )
+                    conn.execute('COMMIT')
+                    return
+                conn.execute('ROLLBACK')
+            finally:
+                conn.close()
+            with self._cond:
+                self._cond.wait(timeout=1)
+
+    def cancel(self, download_id):
+        """Cancel a job: a queued one is dropped, a running one flagged for its worker.
+
+        Returns ('queued', job) or ('running', job), or (None, None) if the job
+        is neither queued nor running. Jobs being postprocessed count as running.
+        """
+        conn = _sqlite_connect(self.path)
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute(
+                "SELECT status, payload FROM jobs WHERE id = ? AND status IN ('queued', 'running', 'postprocessing')",
+                (download_id,)
+            ).fetchone()
+            if row is None:
+                conn.execute('ROLLBACK')
+                return None, None
+            if row[0] == 'queued':
+                conn.execute('DELETE FROM jobs WHERE id = ?', (download_id,))
+            else:
+                conn.execute('UPDATE jobs SET cancel_requested = 1 WHERE id = ?', (download_id,))
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+        if row[0] == 'queued':
+            return 'queued', json.loads(row[1])
+        # Right away if it runs in this process; otherwise its worker's dispatcher picks the flag up
+        job_control.cancel(download_id)
+        return 'running', json.loads(row[1])
+
+    def _apply_cancellations(self):
+        """Stop jobs running in this process that were cancelled through another worker"""
+        with self._cond:
+            if not self._running_here:
+                return
+        conn = _sqlite_connect(self.path)
+        try:
+            cancelled = conn.execute(
+                "SELECT id FROM jobs WHERE status IN ('running', 'postprocessing') AND owner_pid = ? AND cancel_requested = 1",
+                (os.getpid(),)
+            ).fetchall()
+        finally:
+            conn.close()
+        for (download_id,) in cancelled:
+            job_control.cancel(download_id)
+
+    def queue_status(self, download_id):
+        """Queue position and ETA for a queued job, or None if it is not queued"""
+        return self.queue_statuses([download_id]).get(download_id)
+
+    def queue_statuses(self, download_ids):
+        """Queue position and ETA of each of the given jobs that is queued, by download_id.
+
+        Replays the claims _claim_next would make from the current queue, with
+        its client fairness and batch limits, assuming every job takes the
+        recent average time; the position is the job's place in that order.
+        One replay covers all the jobs, e.g. the items of a batch.
+        """
+        conn = _sqlite_connect(self.path)
+        try:
+            queued = conn.execute(
+                "SELECT id, client, client_limit FROM jobs WHERE status = 'queued' ORDER BY enqueued_at, rowid"
+            ).fetchall()
+            wanted = set(download_ids) & {job_id for job_id, _, _ in queued}
+            if not wanted:
+                return {}
+            running = conn.execute(
+                "SELECT client, started_at FROM jobs WHERE status IN ('running', 'streaming')"
+            ).fetchall()
+            average = _average_job_seconds(conn, DEFAULT_JOB_SECONDS)
+        finally:
+            conn.close()
+        
+        now = time.time()
+        # Per client, its unlimited jobs and its batch jobs, oldest first
+        pending = {}
+        for order, (job_id, client, client_limit) in enumerate(queued):
+            unlimited, limited = pending.setdefault(client, (deque(), deque()))
+            (unlimited if client_limit is None else limited).append((order, job_id, client_limit))
+        running_per_client = {}
+        finishes = []
+        for client, started_at in running:
+            running_per_client[client] = running_per_client.get(client, 0) + 1
+            heapq.heappush(finishes, (max(now, (started_at or now) + average), client))
+        
+        statuses = {}
+        clock, position = now, 0
+        while True:
+            while len(finishes) < self.max_workers:
+                # Same choice as _claim_next: clients with fewer running jobs first, then the oldest job
+                best = None
+                for client, (unlimited, limited) in pending.items():
+                    count = running_per_client.get(client, 0)
+                    candidates = [jobs[0] for jobs in (unlimited, limited) if jobs and (
+                        jobs[0][2] is None or jobs[0][2] > count
+                    )]
+                    if candidates:
+                        key = (count, min(candidates)[0])
+                        if best is None or key < best[0]:
+                            best = (key, client, min(candidates))
+                if best is None:
+                    break
+                _, client, (_, job_id, client_limit) = best
+                position += 1
+                if job_id in wanted:
+                    statuses[job_id] = {'queue_position': position, 'eta_seconds': int(clock - now + average)}
+                    if len(statuses) == len(wanted):
+                        return statuses
+                pending[client][0 if client_limit is None else 1].popleft()
+                running_per_client[client] = running_per_client.get(client, 0) + 1
+                heapq.heappush(finishes, (clock + average, client))
+            if not finishes:
+                # Left over jobs can't be claimed as things stand; they come after all others
+                for job_id in wanted - statuses.keys():
+                    statuses[job_id] = {'queue_position': position + 1, 'eta_seconds': int(clock - now + average)}
+                return statuses
+            clock, client = heapq.heappop(finishes)
+            running_per_client[client] -= 1
+
+    def counts(self):
+        """Number of queued, running, streaming and postprocessing jobs on the host"""
+        statuses = ('queued', 'running', 'streaming', 'postprocessing')
+        conn = _sqlite_connect(self.path)
+        try:
+            counts = dict(conn.execute(
+                f"SELECT status, COUNT(*) FROM jobs WHERE status IN {statuses} GROUP BY status"
+            ).fetchall())
+        finally:
+            conn.close()
+        return {status: counts.get(status, 0) for status in statuses}
+
+    def retry_after(self):
+        """Seconds a rejected client should wait before retrying"""
+        conn = _sqlite_connect(self.path)
+        try:
+            average = _average_job_seconds(conn, DEFAULT_JOB_SECONDS)
+        finally:
+            conn.close()
+        # A queue slot frees up whenever any running job finishes
+        return max(1, int(average / self.max_workers))
+
+    def _requeue_orphans(self, conn):
+        """Put jobs whose worker process died back in the queue, and free the slots of its streams"""
+        for job_id, status, owner_pid in conn.execute(
+            "SELECT id, status, owner_pid FROM jobs WHERE status IN ('running', 'streaming', 'postprocessing')"
+        ).fetchall():
+            if owner_pid == os.getpid() or _pid_alive(owner_pid):
+                continue
+            if status == 'streaming':
+                conn.execute("DELETE FROM jobs WHERE id = ? AND status = 'streaming'", (job_id,))
+            else:
+                logger.warning(f"Requeueing download {job_id} from dead worker {owner_pid}")
+                conn.execute(
+                    "UPDATE jobs SET status = 'queued', owner_pid = NULL, started_at = NULL "
+                    "WHERE id = ? AND status IN ('running', 'postprocessing')",
+                    (job_id,)
+                )
+
+    def _claim_next(self):
+        """Atomically move the next fair job from queued to running, if a slot is free"""
+        conn = _sqlite_connect(self.path)
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            self._requeue_orphans(conn)
+            running = conn.execute("SELECT COUNT(*) FROM jobs WHERE status IN ('running', 'streaming')").fetchone()[0]
+            row = None
+            if running < self.max_workers:
+                row = conn.execute(
+                    'SELECT j.id, j.payload, j.enqueued_at FROM jobs j '
+                    "WHERE j.status = 'queued' AND (j.client_limit IS NULL OR j.client_limit > "
+                    "(SELECT COUNT(*) FROM jobs r WHERE r.status IN ('running', 'streaming') AND r.client = j.client)) "
+                    "ORDER BY (SELECT COUNT(*) FROM jobs r WHERE r.status IN ('running', 'streaming') AND r.client = j.client), "
+                    'j.enqueued_at LIMIT 1'
+                ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', owner_pid = ?, started_at = ? WHERE id = ?",
+                    (os.getpid(), time.time(), row[0])
+                )
+            _prune_finished_jobs(conn)
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        metrics.observe('ytdl_stage_duration_seconds', time.time() - row[2], stage='queue_wait')
+        return row[0], json.loads(row[1])
+
+    def _finish(self, download_id):
+        conn = _sqlite_connect(self.path)
+        try:
+            conn.execute(
+                "UPDATE jobs SET status = 'done', finished_at = ? WHERE id = ?", (time.time(), download_id)
+            )
+        finally:
+            conn.close()
+        with self._cond:
+            self._cond.notify()
+
+    def _run(self, download_id, job):
+        with self._cond:
+            self._running_here.add(download_id)
+        try:
+            self.runner(download_id, job)
+        except Exception as e:
+            logger.error(f"Scheduled download {download_id} failed: {e}")
+        finally:
+            with self._cond:
+                self._running_here.discard(download_id)
+            self._finish(download_id)
+
+    def _dispatch_loop(self):
+        while True:
+            try:
+                self._apply_cancellations()
+                claimed = self._claim_next()
+            except Exception as e:
+                logger.error(f"Download dispatcher error: {e}")
+                claimed = None
+            if claimed is None:
+                # Wake up on local submits/finishes, and poll for jobs queued by other workers
+                with self._cond:
+                    self._cond.wait(timeout=1)
+                continue
+            thread = threading.Thread(target=self._run, args=claimed)
+            thread.daemon = True
+            thread.start()
+
+download_scheduler = DownloadScheduler(
+    DOWNLOAD_QUEUE_PATH, MAX_CONCURRENT_DOWNLOADS, MAX_QUEUED_DOWNLOADS, run_download_job
+)
+metrics.gauge('ytdl_download_queue_depth', 'Download jobs waiting for a slot', lambda: [({}, download_scheduler.counts()['queued'])])
+metrics.gauge('ytdl_active_downloads', 'Download jobs running', lambda: [
+    ({}, sum(download_scheduler.counts()[status] for status in ('running', 'streaming')))
+])
+metrics.gauge('ytdl_storage_used_bytes', 'Bytes in download working directories', lambda: [({}, storage_manager.stats()['bytes'])])
+
+class PostprocessPool:
+    """Host-wide limit on downloads being postprocessed with ffmpeg at once, fed by a FIFO handoff queue.
+
+    Fetching is network-bound and merging or converting with ffmpeg is
+    CPU-bound, so the two stages have separate limits. Before a download's
+    first ffmpeg postprocessor runs, its job gives up its download slot
+    (DownloadScheduler.handoff) and waits here for one of max_workers slots.
+    Like the download queue, the table lives in SQLite so all workers on the
+    host share the limit.
+    """
+
+    def __init__(self, path, max_workers):
+        self.path = path
+        self.max_workers = max_workers
+        self._cond = threading.Condition()
+        conn = _sqlite_connect(path)
+        try:
+            _create_jobs_table(conn)
+        finally:
+            conn.close()
+
+    def acquire(self, download_id, on_wait):
+        """Wait in line for a slot, calling on_wait(queue_position, eta_seconds) about once a second meanwhile.
+
+        Returns the expected postprocessing seconds once the slot is taken.
+        """
+        enqueued_at = time.time()
+        conn = _sqlite_connect(self.path)
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO jobs (id, status, owner_pid, enqueued_at) VALUES (?, 'waiting', ?, ?)",
+                (download_id, os.getpid(), enqueued_at)
+            )
+        finally:
+            conn.close()
+        while True:
+            claimed, position, average = self._try_claim(download_id)
+            if claimed:
+                metrics.observe('ytdl_stage_duration_seconds', time.time() - enqueued_at, stage='postprocess_wait')
+                return int(average)
+            on_wait(position, int(((position - 1) // self.max_workers + 1) * average))
+            # Woken by releases in this process; the timeout picks up those of other workers
+            with self._cond:
+                self._cond.wait(timeout=1)
+
+    def _try_claim(self, download_id):
+        """Take a slot if one is free for this job's place in line; returns (claimed, position, average seconds)"""
+        conn = _sqlite_connect(self.path)
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for job_id, owner_pid in conn.execute(
+                "SELECT id, owner_pid FROM jobs WHERE status IN ('waiting', 'running')"
+            ).fetchall():
+                if owner_pid != os.getpid() and not _pid_alive(owner_pid):
+                    conn.execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+            running = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'running'").fetchone()[0]
+            position = conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = 'waiting' AND "
+                "enqueued_at <= (SELECT enqueued_at FROM jobs WHERE id = ?)",
+                (download_id,)
+            ).fetchone()[0]
+            claimed = position <= self.max_workers - running
+            if claimed:
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', started_at = ? WHERE id = ?", (time.time(), download_id)
+                )
+            average = _average_job_seconds(conn, DEFAULT_POSTPROCESS_SECONDS)
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+        return claimed, position, average
+
+    def release(self, download_id):
+        """Leave the line, or give back the slot"""
+        conn = _sqlite_connect(self.path)
+        try:
+            conn.execute("DELETE FROM jobs WHERE id = ? AND status = 'waiting'", (download_id,))
+            conn.execute(
+                "UPDATE jobs SET status = 'done', finished_at = ? WHERE id = ? AND status = 'running'",
+                (time.time(), download_id)
+            )
+            _prune_finished_jobs(conn)
+        finally:
+            conn.close()
+        with self._cond:
+            self._cond.notify_all()
+
+    def counts(self):
+        """Number of jobs waiting for and holding a postprocessing slot on the host"""
+        conn = _sqlite_connect(self.path)
+        try:
+            counts = dict(conn.execute(
+                "SELECT status, COUNT(*) FROM jobs WHERE status IN ('waiting', 'running') GROUP BY status"
+            ).fetchall())
+        finally:
+            conn.close()
+        return {'waiting': counts.get('waiting', 0), 'running': counts.get('running', 0)}
+
+postprocess_pool = PostprocessPool(POSTPROCESS_QUEUE_PATH, POSTPROCESS_WORKERS)
+metrics.gauge('ytdl_postprocess_queue_depth', 'Downloads waiting for a postprocessing slot', lambda: [({}, postprocess_pool.counts()['waiting'])])
+metrics.gauge('ytdl_active_postprocessing', 'Downloads being postprocessed', lambda: [({}, postprocess_pool.counts()['running'])])
+
+# Postprocessors that run ffmpeg, by the names yt-dlp gives postprocessor hooks
+FFMPEG_POSTPROCESSORS = {
+    pp.pp_key() for pp in vars(yt_dlp.postprocessor.ffmpeg).values()
+    if isinstance(pp, type) and issubclass(pp, yt_dlp.postprocessor.ffmpeg.FFmpegPostProcessor)
+}
+
+class PostprocessStage:
+    """yt-dlp postprocessor hook moving a download from fetching to the postprocessing stage.
+
+    Before the download's first ffmpeg postprocessor starts, the job frees its
+    download slot and waits for a postprocessing slot, reporting its place in
+    line as progress. leave() gives the slot back, and resume() takes a
+    download slot again before another attempt fetches the download.
+    """
 
-class ProgressHook:
     def __init__(self, download_id):
         self.download_id = download_id
-    
+        self.entered = False
+        self.handed_off = False
+        self.wait_seconds = 0.0
+
     def __call__(self, d):
+        if d['status'] != 'started' or self.entered or d['postprocessor'] not in FFMPEG_POSTPROCESSORS:
+            return
+        self.entered = True
+        self.handed_off = True
+        started = time.perf_counter()
+        download_scheduler.handoff(self.download_id)
         try:
-            if d['status'] == 'downloading':
-                # Extract percentage safely
-                percent_str = d.get('_percent_str', '0%').strip()
-                speed_str = d.get('_speed_str', 'N/A')
-                
-                download_progress[self.download_id] = {
-                    'status': 'downloading',
-                    'percent': percent_str,
-                    'speed': speed_str,
-                    'downloaded_bytes': d.get('downloaded_bytes', 0),
-                    'total_bytes': d.get('total_bytes', 0)
-                }
-            elif d['status'] == 'finished':
-                download_progress[self.download_id] = {
-                    'status': 'finished',
-                    'filename': os.path.basename(d['filename']),
-                    'file_path': d['filename']
-                }
-        except Exception as e:
-            logger.error(f"Progress hook error: {e}")
+            expected_seconds = postprocess_pool.acquire(self.download_id, self._waiting)
+        finally:
+            self.wait_seconds = time.perf_counter() - started
+        progress_store.update(self.download_id, {
+            'status': 'processing', 'queue_position': None, 'eta_seconds': expected_seconds
+        })
+        progress_notifier.notify()
 
-def is_valid_youtube_url(url):
-    """Validate YouTube URL with improved regex"""
-    youtube_patterns = [
-        r'(?:https?://)?(?:www\.)?youtube\.com/watch\?v=([a-zA-Z0-9_-]{11})',
-        r'(?:https?://)?(?:www\.)?youtu\.be/([a-zA-Z0-9_-]{11})',
-        r'(?:https?://)?(?:www\.)?youtube\.com/embed/([a-zA-Z0-9_-]{11})',
-        r'(?:https?://)?(?:www\.)?youtube\.com/v/([a-zA-Z0-9_-]{11})',
-        r'(?:https?://)?(?:www\.)?youtube\.com/shorts/([a-zA-Z0-9_-]{11})'
-    ]
-    
-    for pattern in youtube_patterns:
-        if re.match(pattern, url):
-            return True
-    return False
+    def _waiting(self, queue_position, eta_seconds):
+        job_control.check(self.download_id)
+        progress_store.update(self.download_id, {
+            'status': 'postprocess_queued', 'queue_position': queue_position, 'eta_seconds': eta_seconds
+        })
+        progress_notifier.notify()
 
-def get_video_info(url):
-    """Extract video information without downloading"""
-    # Try different extraction methods
-    extraction_methods = [
-        {
-            'extractor_args': {
-                'youtube': {
-                    'player_client': ['android', 'web', 'mweb', 'tv_embedded'],
-                    'skip': ['dash'],
-                    'player_skip': ['webpage', 'configs'],
-                    'player_params': {'hl': 'en', 'gl': 'US'},
-                    'player_include': ['player_response', 'player_js'],
-                    'extract_flat': False,
-                    'extract_info': True
-                }
-            }
-        },
-        {
-            'extractor_args': {
-                'youtube': {
-                    'player_client': ['web'],
-                    'skip': ['dash'],
-                    'player_skip': ['webpage'],
-                    'player_params': {'hl': 'en', 'gl': 'US'}
-                }
-            }
-        },
-        {
-            'extractor_args': {
-                'youtube': {
-                    'player_client': ['android'],
-                    'skip': ['dash'],
-                    'player_params': {'hl': 'en', 'gl': 'US'}
-                }
-            }
-        }
-    ]
-    
-    for i, method in enumerate(extraction_methods):
-        try:
-            ydl_opts = {
-                'quiet': True,
-                'no_warnings': True,
-                'extract_flat': False,
-                'skip_download': True,
-                'http_headers': {
-                    'User-Agent': get_random_user_agent(),
-                    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,image/apng,*/*;q=0.8',
-                    'Accept-Language': 'en-US,en;q=0.9',
-                    'Accept-Encoding': 'gzip, deflate, br',
-                    'DNT': '1',
-                    'Connection': 'keep-alive',
-                    'Upgrade-Insecure-Requests': '1',
-                    'Sec-Fetch-Dest': 'document',
-                    'Sec-Fetch-Mode': 'navigate',
-                    'Sec-Fetch-Site': 'none',
-                    'Sec-Fetch-User': '?1',
-                    'Cache-Control': 'max-age=0'
-                },
-                'sleep_interval': 2,
-                'max_sleep_interval': 5,
-                'retries': 3,
-                'fragment_retries': 3,
-                'ignoreerrors': False,
-                'no_warnings': True,
-                'cookiesfrombrowser': None,
-                'cookiefile': None
-            }
-            ydl_opts.update(method)
-            
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=False)
-                
-                # Get available formats for quality options
-                formats = info.get('formats', [])
-                available_qualities = []
-                
-                # Extract unique quality options
-                quality_map = {}
-                for fmt in formats:
-                    if fmt.get('height') and fmt.get('ext') in ['mp4', 'webm']:
-                        height = fmt['height']
-                        if height not in quality_map:
-                            quality_map[height] = {
-                                'height': height,
-                                'ext': fmt['ext'],
-                                'filesize': fmt.get('filesize', 0),
-                                'format_id': fmt['format_id']
-                            }
-                        # Keep the best format for each height
-                        elif fmt.get('filesize', 0) > quality_map[height]['filesize']:
-                            quality_map[height] = {
-                                'height': height,
-                                'ext': fmt['ext'],
-                                'filesize': fmt.get('filesize', 0),
-                                'format_id': fmt['format_id']
-                            }
-                
-                available_qualities = sorted(quality_map.values(), key=lambda x: x['height'], reverse=True)
-                
-                return {
-                    'title': info.get('title', 'Unknown'),
-                    'duration': info.get('duration', 0),
-                    'uploader': info.get('uploader', 'Unknown'),
-                    'view_count': info.get('view_count', 0),
-                    'thumbnail': info.get('thumbnail', ''),
-                    'description': info.get('description', '')[:200] + '...' if info.get('description') else '',
-                    'upload_date': info.get('upload_date', ''),
-                    'available_qualities': available_qualities,
-                    'video_id': info.get('id', '')
-                }
-                
-        except Exception as e:
-            logger.warning(f"Extraction method {i+1} failed: {str(e)}")
-            if i == len(extraction_methods) - 1:  # Last method
-                logger.error(f"All extraction methods failed for URL: {url}")
-                return None
-            continue
-    
-    return None
+    def leave(self):
+        if self.entered:
+            postprocess_pool.release(self.download_id)
+            self.entered = False
 
-def download_thumbnail(thumbnail_url, video_id, temp_dir):
-    """Download and save thumbnail"""
-    try:
-        headers = {
-            'User-Agent': get_random_user_agent()
-        }
-        response = requests.get(thumbnail_url, headers=headers, timeout=10)
-        response.raise_for_status()
-        
-        # Save thumbnail
-        thumbnail_path = os.path.join(temp_dir, f'{video_id}_thumbnail.jpg')
-        with open(thumbnail_path, 'wb') as f:
-            f.write(response.content)
-        
-        return thumbnail_path
-    except Exception as e:
-        logger.error(f"Error downloading thumbnail: {e}")
-        return None
+    def resume(self):
+        if self.handed_off:
+            download_scheduler.resume(self.download_id)
+            self.handed_off = False
+        self.wait_seconds = 0.0
 
-def download_video(url, quality='best', download_id=None, download_thumbnail_option=False):
-    """Download video with improved error handling and progress tracking"""
-    if not download_id:
-        download_id = str(int(time.time()))
-    
-    # Create temporary directory with better naming
-    temp_dir = tempfile.mkdtemp(prefix=f'ytdl_{download_id}_')
-    
-    # Anti-detection measures
-    time.sleep(random.uniform(1, 3))
-    
-    # Enhanced quality mapping for better format selection
-    quality_formats = {
-        'best': 'bestvideo[height<=1080][ext=mp4]+bestaudio[ext=m4a]/best[height<=1080]/best',
-        'high': 'bestvideo[height<=720][ext=mp4]+bestaudio[ext=m4a]/best[height<=720]/best',
-        'medium': 'bestvideo[height<=480][ext=mp4]+bestaudio[ext=m4a]/best[height<=480]/best',
-        'low': 'bestvideo[height<=360][ext=mp4]+bestaudio[ext=m4a]/best[height<=360]/worst',
-        'audio_only': 'bestaudio[ext=m4a]/bestaudio'
-    }
-    
-    # Try different extraction methods
-    extraction_methods = [
-        {
-            'extractor_args': {
-                'youtube': {
-                    'player_client': ['android', 'web', 'mweb', 'tv_embedded'],
-                    'skip': ['dash'],
-                    'player_skip': ['webpage', 'configs'],
-                    'player_params': {'hl': 'en', 'gl': 'US'},
-                    'player_include': ['player_response', 'player_js'],
-                    'extract_flat': False,
-                    'extract_info': True
-                }
-            }
-        },
-        {
-            'extractor_args': {
-                'youtube': {
-                    'player_client': ['web'],
-                    'skip': ['dash'],
-                    'player_skip': ['webpage'],
-                    'player_params': {'hl': 'en', 'gl': 'US'}
-                }
-            }
-        },
-        {
-            'extractor_args': {
-                'youtube': {
-                    'player_client': ['android'],
-                    'skip': ['dash'],
-                    'player_params': {'hl': 'en', 'gl': 'US'}
-                }
-            }
-        }
-    ]
-    
-    for i, method in enumerate(extraction_methods):
+def get_client_id():
+    """Identify the requesting client for per-client queue fairness"""
+    forwarded = request.headers.get('X-Forwarded-For', '')
+    if forwarded:
+        return forwarded.split(',')[0].strip()
+    return request.remote_addr or 'unknown'
+
+@app.before_request
+def start_background_workers():
+    # Idempotent; also restarts the dispatcher in freshly forked workers so queued jobs resume
+    download_scheduler.start()
+    storage_manager.start()
+
+# Run in the stream's yt-dlp process, with the options passed as JSON; yt-dlp reports its errors itself
+STREAM_CHILD_CODE = """
+import json, sys, yt_dlp
+try:
+    sys.exit(yt_dlp.YoutubeDL(json.loads(sys.argv[1])).download([sys.argv[2]]))
+except yt_dlp.utils.DownloadError:
+    sys.exit(1)
+"""
+
+def start_stream_download(url, quality):
+    """Start yt-dlp writing a single-file format to stdout.
+
+    yt-dlp runs in a child process so that it has a stdout of its own, but
+    with the options a queued download would get: those of the best-rated
+    extraction method and an egress identity from the rate governor.
+    Returns (process, first_chunk), or None if yt-dlp exited without output,
+    e.g. because the video has no single-file format at this quality.
+    """
+    method_name = extraction_selector.order()[0]
+    identity = rate_governor.acquire('www.youtube.com')
+    options = ydl_factory.download_options(method_name, quality, identity)
+    options.update({
+        'format': STREAM_FORMATS[quality],
+        'outtmpl': '-',
+        'noplaylist': True,
+        'quiet': True,
+        'noprogress': True,
+        'logtostderr': True
+    })
+    started = time.time()
+    # A file rather than a pipe, which nothing would read while the response streams
+    with tempfile.TemporaryFile() as stderr:
+        process = subprocess.Popen(
+            [sys.executable, '-c', STREAM_CHILD_CODE, json.dumps(options), url],
+            stdout=subprocess.PIPE,
+            stderr=stderr
+        )
+        first_chunk = process.stdout.read1(STREAM_CHUNK_SIZE)
+        if not first_chunk:
+            process.wait()
+            stderr.seek(0)
+            error = stderr.read().decode(errors='replace').strip()
+            if is_bot_check(error):
+                rate_governor.report_blocked('www.youtube.com', identity)
+            logger.warning(f"Stream download unavailable for {url}: {error}")
+            return None
+    record_extraction(method_name, started)
+    rate_governor.report_success('www.youtube.com', identity)
+    metrics.inc('ytdl_downloads_total', outcome='streamed')
+    return process, first_chunk
+
+def stream_download_response(process, first_chunk, filename, on_close):
+    """Chunked response fed directly from a yt-dlp process's stdout"""
+    def generate():
         try:
-            ydl_opts = {
-                'format': quality_formats.get(quality, 'best'),
-                'outtmpl': os.path.join(temp_dir, '%(title)s.%(ext)s'),
-                'http_headers': {
-                    'User-Agent': get_random_user_agent(),
-                    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,image/apng,*/*;q=0.8',
-                    'Accept-Language': 'en-US,en;q=0.9',
-                    'Accept-Encoding': 'gzip, deflate, br',
-                    'DNT': '1',
-                    'Connection': 'keep-alive',
-                    'Upgrade-Insecure-Requests': '1',
-                    'Sec-Fetch-Dest': 'document',
-                    'Sec-Fetch-Mode': 'navigate',
-                    'Sec-Fetch-Site': 'none',
-                    'Sec-Fetch-User': '?1',
-                    'Cache-Control': 'max-age=0'
-                },
-                'sleep_interval': 2,
-                'max_sleep_interval': 5,
-                'retries': 3,
-                'fragment_retries': 3,
-                'ignoreerrors': False,
-                'no_warnings': True,
-                'progress_hooks': [ProgressHook(download_id)],
-                'writesubtitles': False,
-                'writeautomaticsub': False,
-                'writethumbnail': download_thumbnail_option,
-                'merge_output_format': 'mp4',
-                'cookiesfrombrowser': None,
-                'cookiefile': None,
-                'postprocessors': [{
-                    'key': 'FFmpegVideoConvertor',
-                    'preferedformat': 'mp4',
-                }] if quality != 'audio_only' else []
-            }
-            ydl_opts.update(method)
-            
-            # First get video info to extract thumbnail if requested
-            video_info = get_video_info(url)
-            thumbnail_path = None
-            
-            if download_thumbnail_option and video_info and video_info.get('thumbnail'):
-                thumbnail_path = download_thumbnail(
-                    video_info['thumbnail'], 
-                    video_info.get('video_id', download_id), 
-                    temp_dir
-                )
-            
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                download_progress[download_id] = {'status': 'starting', 'percent': '0%'}
-                ydl.download([url])
-                
-                # Find the downloaded file
-                files = [f for f in os.listdir(temp_dir) if not f.startswith('.')]
-                if files:
-                    file_path = os.path.join(temp_dir, files[0])
-                    # Update progress with file path and thumbnail path
-                    if download_id in download_progress:
-                        download_progress[download_id]['file_path'] = file_path
-                        if thumbnail_path:
-                            download_progress[download_id]['thumbnail_path'] = thumbnail_path
-                    return file_path
-                else:
-                    raise Exception("No file was downloaded")
-                    
-        except yt_dlp.utils.DownloadError as e:
-            error_msg = str(e)
-            if "Sign in to confirm you're not a bot" in error_msg:
-                error_msg = "YouTube is blocking requests. Please try again later."
-            elif "Video unavailable" in error_msg:
-                error_msg = "This video is not available for download."
-            elif "Failed to extract any player response" in error_msg:
-                logger.warning(f"Player response extraction failed with method {i+1}: {error_msg}")
-                if i == len(extraction_methods) - 1:  # Last method
-                    error_msg = "Unable to extract video information. YouTube may have changed their API."
-                    download_progress[download_id] = {'status': 'error', 'message': error_msg}
-                    shutil.rmtree(temp_dir, ignore_errors=True)
-                    raise Exception(error_msg)
-                continue  # Try next method
-            else:
-                download_progress[download_id] = {'status': 'error', 'message': error_msg}
-                shutil.rmtree(temp_dir, ignore_errors=True)
-                raise Exception(error_msg)
-        except Exception as e:
-            logger.warning(f"Download method {i+1} failed: {str(e)}")
-            if i == len(extraction_methods) - 1:  # Last method
-                error_msg = f"Download failed: {str(e)}"
-                download_progress[download_id] = {'status': 'error', 'message': error_msg}
-                shutil.rmtree(temp_dir, ignore_errors=True)
-                raise Exception(error_msg)
-            continue  # Try next method
+            yield first_chunk
+            while True:
+                chunk = process.stdout.read1(STREAM_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+            if process.wait() != 0:
+                logger.error(f"Stream download of {filename} ended with exit code {process.returncode}")
+        finally:
+            # Also runs when the client disconnects mid-transfer
+            if process.poll() is None:
+                process.kill()
+            process.wait()
+            on_close()
     
-    return None
+    mimetype = 'audio/mp4' if filename.endswith('.m4a') else 'video/mp4'
+    return Response(generate(), mimetype=mimetype, headers={
+        'Content-Disposition': f"attachment; filename*=UTF-8''{quote(filename)}",
+        'X-Accel-Buffering': 'no'
+    })
 
 @app.route('/')
 def index():
@@ -433,6 +3540,53 @@ def get_video_info_api():
         logger.error(f"Error in get_video_info_api: {error_msg}")
         return jsonify({'error': error_msg}), 400
 
+def storage_full_response():
+    response = jsonify({'error': 'The server is out of storage space. Please try again later.'})
+    response.headers['Retry-After'] = str(download_scheduler.retry_after())
+    return response, 507
+
+def finish_from_cache(download_id, key):
+    """Mark a download finished if its artifact is cached; returns the cached file or None"""
+    if artifact_cache is None:
+        return None
+    cached_path = artifact_cache.lookup(key)
+    metrics.inc('ytdl_cache_requests_total', cache='artifacts', result='hit' if cached_path else 'miss')
+    if cached_path:
+        # Already downloaded and processed: finish immediately without touching YouTube
+        progress_store.set(download_id, {
+            'status': 'finished',
+            'filename': os.path.basename(cached_path),
+            'file_path': cached_path,
+            'cached': True
+        })
+    return cached_path
+
+def parse_timestamp(value):
+    """Seconds from a number or an [[HH:]MM:]SS[.fff] string; None when not given"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        seconds = float(value)
+    else:
+        match = re.fullmatch(r'(?:(?:(\d+):)?(\d+):)?(\d+(?:\.\d+)?)', str(value).strip())
+        if not match:
+            raise ValueError(f"Invalid timestamp: {value}")
+        hours, minutes, secs = match.groups()
+        seconds = int(hours or 0) * 3600 + int(minutes or 0) * 60 + float(secs)
+    if not 0 <= seconds < float('inf'):
+        raise ValueError(f"Invalid timestamp: {value}")
+    return seconds
+
+def parse_clip(data):
+    """The (start, end) range asked for with start/end, or None for the whole video"""
+    start = parse_timestamp(data.get('start')) or 0
+    end = parse_timestamp(data.get('end'))
+    if end is not None and end <= start:
+        raise ValueError('The clip must end after it starts')
+    if not start and end is None:
+        return None
+    return [start, end]
+
 @app.route('/api/download', methods=['POST'])
 def download_video_api():
     try:
@@ -446,6 +3600,7 @@ def download_video_api():
         url = data.get('url', '').strip()
         quality = data.get('quality', 'best')
         download_thumbnail_option = data.get('download_thumbnail', False)
+        stream = bool(data.get('stream')) and quality in STREAM_FORMATS
         
         if not url:
             return jsonify({'error': 'URL is required'}), 400
@@ -453,25 +3608,65 @@ def download_video_api():
         if not is_valid_youtube_url(url):
             return jsonify({'error': 'Invalid YouTube URL'}), 400
         
+        try:
+            clip = parse_clip(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        # Clips are cut by ffmpeg into a file, which can't be piped while it is written.
+        # A stream takes its worker for the whole download, which only threaded workers can spare
+        stream = stream and clip is None and request.environ.get('wsgi.multithread', False)
+        
         # Generate unique download ID
         download_id = f"{int(time.time())}_{random.randint(1000, 9999)}"
         
-        # Start download in background thread
-        def background_download():
-            try:
-                file_path = download_video(url, quality, download_id, download_thumbnail_option)
-                if download_id in download_progress:
-                    download_progress[download_id]['file_path'] = file_path
-            except Exception as e:
-                logger.error(f"Background download error: {e}")
-                download_progress[download_id] = {
-                    'status': 'error', 
-                    'message': str(e)
-                }
+        job = {
+            'url': url,
+            'quality': quality,
+            'download_thumbnail': download_thumbnail_option
+        }
+        if clip:
+            job['clip'] = clip
+        video_id = extract_video_id(url)
+        key = artifact_key(video_id, quality, clip)
+        if artifact_cache is not None:
+            cached_path = finish_from_cache(download_id, key)
+            if cached_path:
+                if stream:
+                    return send_download(cached_path, download_id)
+                return jsonify({'download_id': download_id, 'cached': True})
+            job['artifact_key'] = key
         
-        thread = threading.Thread(target=background_download)
-        thread.daemon = True
-        thread.start()
+        # Stream-through mode: pipe bytes to the client while yt-dlp is still fetching.
+        # Formats that need merging (or a busy server) fall back to the queued download below
+        if stream and download_scheduler.acquire(download_id, get_client_id()):
+            started = start_stream_download(url, quality)
+            if started:
+                extension = 'm4a' if quality == 'audio_only' else 'mp4'
+                return stream_download_response(
+                    *started, f'{video_id}.{extension}', lambda: download_scheduler.release(download_id)
+                )
+            download_scheduler.release(download_id)
+        
+        # Share a download of the same video and quality that is already running;
+        # this caller still gets its own download_id, whose progress mirrors the running one
+        flight_key = work_key(key, download_thumbnail_option)
+        leader_id = download_flights.claim(flight_key, download_id)
+        if leader_id:
+            progress_store.set(download_id, {'status': 'queued', 'follows': leader_id}, ttl=BATCH_RETENTION_SECONDS)
+            return jsonify({'download_id': download_id, 'attached': True})
+        job['flight_key'] = flight_key
+        
+        if not storage_manager.has_room():
+            download_flights.release(flight_key, download_id)
+            return storage_full_response()
+        
+        progress_store.set(download_id, {'status': 'queued'})
+        if not download_scheduler.submit(download_id, get_client_id(), job):
+            progress_store.delete(download_id)
+            download_flights.release(flight_key, download_id)
+            response = jsonify({'error': 'Too many downloads in progress. Please try again later.'})
+            response.headers['Retry-After'] = str(download_scheduler.retry_after())
+            return response, 429
         
         return jsonify({'download_id': download_id})
     
@@ -479,6 +3674,241 @@ def download_video_api():
         logger.error(f"Download API error: {e}")
         return jsonify({'error': 'An error occurred while starting the download.'}), 500
 
+@app.route('/api/download/<download_id>', methods=['DELETE'])
+def cancel_download_api(download_id):
+    try:
+        progress = progress_store.get(detached_progress_key(download_id)) or progress_store.get(download_id)
+        if not progress or progress.get('status') == 'batch':
+            return jsonify({'error': 'Download not found'}), 404
+        # An attached download's own record stays queued; the shared download tells whether it ended
+        _, current = resolve_progress(download_id)
+        if current.get('status') in ('finished', 'error', 'cancelled'):
+            return jsonify({'error': 'The download has already ended', 'status': current['status']}), 409
+        
+        cancelled = {'status': 'cancelled', 'message': 'The download was cancelled.'}
+        if progress.get('follows'):
+            # Only this caller stops waiting; the shared download goes on for the others
+            progress_store.set(download_id, cancelled)
+            # ... unless the caller that started it has left too, and nobody else is waiting for it
+            if download_flights.detach_follower(progress['follows']):
+                cancel_job(progress['follows'], cancelled)
+            return jsonify({'download_id': download_id, 'status': 'cancelled'})
+        if download_flights.detach_leader(download_id):
+            # Others are attached to this download: it goes on for them, only this caller sees it cancelled
+            progress_store.set(detached_progress_key(download_id), cancelled, ttl=BATCH_RETENTION_SECONDS)
+            return jsonify({'download_id': download_id, 'status': 'cancelled'})
+        
+        state = cancel_job(download_id, cancelled)
+        if state == 'queued':
+            return jsonify({'download_id': download_id, 'status': 'cancelled'})
+        if state == 'running':
+            # The download's worker stops it and removes its files, then reports it cancelled
+            return jsonify({'download_id': download_id, 'status': 'cancelling'}), 202
+        return jsonify({'error': 'The download is not queued or running'}), 409
+    
+    except Exception as e:
+        logger.error(f"Cancel download API error: {e}")
+        return jsonify({'error': 'An error occurred while cancelling the download.'}), 500
+
+def cancel_job(download_id, cancelled):
+    """Cancel a download's queued or running job; returns the scheduler's state for it"""
+    state, job = download_scheduler.cancel(download_id)
+    if state == 'queued':
+        if job.get('flight_key'):
+            download_flights.release(job['flight_key'], download_id)
+        progress_store.set(download_id, cancelled)
+    return state
+
+@app.route('/api/batch', methods=['POST'])
+def create_batch_api():
+    try:
+        cleanup_old_downloads()
+        
+        data = request.get_json()
+        if not data:
+            return jsonify({'error': 'No data provided'}), 400
+        
+        urls = data.get('urls') or []
+        if not isinstance(urls, list):
+            return jsonify({'error': 'urls must be a list'}), 400
+        if data.get('url'):
+            urls = [data['url']] + urls
+        if not urls:
+            return jsonify({'error': 'url or urls is required'}), 400
+        quality = data.get('quality', 'best')
+        download_thumbnail_option = bool(data.get('download_thumbnail', False))
+        
+        # Playlists are expanded to their videos; duplicates keep their first position
+        video_ids, invalid = [], []
+        for url in urls:
+            url = str(url).strip()
+            video_id = extract_video_id(url)
+            if video_id:
+                video_ids.append(video_id)
+            elif extract_playlist_id(url):
+                try:
+                    video_ids.extend(expand_playlist(url))
+                except Exception as e:
+                    logger.warning(f"Playlist expansion failed for {url}: {e}")
+                    invalid.append(url)
+            else:
+                invalid.append(url)
+        unique_ids = list(dict.fromkeys(video_ids))
+        if not unique_ids:
+            return jsonify({'error': 'No valid YouTube videos or playlists found', 'invalid': invalid}), 400
+        if len(unique_ids) > MAX_BATCH_ITEMS:
+            return jsonify({'error': f'A batch can hold at most {MAX_BATCH_ITEMS} videos'}), 400
+        
+        batch_id = f"{int(time.time())}_batch{random.randint(1000, 9999)}"
+        items, jobs = [], []
+        for i, video_id in enumerate(unique_ids):
+            download_id = f'{batch_id}_{i}'
+            url = f'https://www.youtube.com/watch?v={video_id}'
+            items.append({'video_id': video_id, 'download_id': download_id})
+            # Same shortcuts as single downloads: cached artifacts and already running downloads
+            key = artifact_key(video_id, quality)
+            if finish_from_cache(download_id, key):
+                continue
+            flight_key = work_key(key, download_thumbnail_option)
+            leader_id = download_flights.claim(flight_key, download_id)
+            if leader_id:
+                progress_store.set(download_id, {'status': 'queued', 'follows': leader_id}, ttl=BATCH_RETENTION_SECONDS)
+                continue
+            job = {
+                'url': url,
+                'quality': quality,
+                'download_thumbnail': download_thumbnail_option,
+                'flight_key': flight_key
+            }
+            if artifact_cache is not None:
+                job['artifact_key'] = key
+            # Items may wait for hours behind BATCH_PARALLELISM; once one runs its progress is rewritten often
+            progress_store.set(download_id, {'status': 'queued'}, ttl=BATCH_RETENTION_SECONDS)
+            jobs.append((download_id, job))
+        
+        if jobs and not storage_manager.has_room():
+            for download_id, job in jobs:
+                download_flights.release(job['flight_key'], download_id)
+            for item in items:
+                progress_store.delete(item['download_id'])
+            return storage_full_response()
+        
+        # The whole batch is one client to the scheduler, so it runs BATCH_PARALLELISM items
+        # at a time and can't crowd out single downloads
+        if jobs and not download_scheduler.submit_many(
+                jobs, f'batch:{batch_id}', BATCH_PARALLELISM, MAX_QUEUED_BATCH_ITEMS):
+            for download_id, job in jobs:
+                download_flights.release(job['flight_key'], download_id)
+            for item in items:
+                progress_store.delete(item['download_id'])
+            response = jsonify({'error': 'Too many batch downloads queued. Please try again later.'})
+            response.headers['Retry-After'] = str(download_scheduler.retry_after())
+            return response, 429
+        
+        progress_store.set(batch_id, {'status': 'batch', 'quality': quality, 'items': items}, ttl=BATCH_RETENTION_SECONDS)
+        return jsonify({
+            'batch_id': batch_id,
+            'total': len(items),
+            'duplicates': len(video_ids) - len(unique_ids),
+            'invalid': invalid
+        })
+    
+    except Exception as e:
+        logger.error(f"Batch API error: {e}")
+        return jsonify({'error': 'An error occurred while starting the batch.'}), 500
+
+def parse_percent(value):
+    try:
+        return float(str(value).rstrip('%'))
+    except ValueError:
+        return 0.0
+
+@app.route('/api/batch/<batch_id>')
+def get_batch(batch_id):
+    try:
+        batch = progress_store.get(batch_id)
+        if not batch or batch.get('status') != 'batch':
+            return jsonify({'error': 'Batch not found'}), 404
+        
+        items, counts, percent_total = [], {}, 0.0
+        progresses = lookup_progresses([item['download_id'] for item in batch['items']])
+        for item, progress in zip(batch['items'], progresses):
+            status = progress.get('status', 'not_found')
+            counts[status] = counts.get(status, 0) + 1
+            percent = 100.0 if status in ('finished', 'error', 'cancelled') else parse_percent(progress.get('percent', 0))
+            percent_total += percent
+            entry = dict(item, status=status, percent=f'{percent:.1f}%')
+            for field in ('message', 'filename', 'queue_position', 'eta_seconds', 'speed'):
+                if field in progress:
+                    entry[field] = progress[field]
+            items.append(entry)
+        
+        total = len(items)
+        return jsonify({
+            'batch_id': batch_id,
+            'status': 'finished' if sum(counts.get(s, 0) for s in ('finished', 'error', 'cancelled')) == total else 'running',
+            'total': total,
+            'counts': counts,
+            'percent': f'{percent_total / total:.1f}%',
+            'items': items
+        })
+    except Exception as e:
+        logger.error(f"Batch progress API error: {e}")
+        return jsonify({'error': 'Failed to get batch progress'}), 500
+
+def parse_thumbnail_variant(width, image_format):
+    """Validate requested thumbnail size and format; returns (width, format, error)"""
+    if width in (None, '') and not image_format:
+        return None, None, None
+    image_format = (image_format or 'jpeg').lower().replace('jpg', 'jpeg')
+    if image_format not in THUMBNAIL_FORMATS:
+        return None, None, f"format must be one of: {', '.join(THUMBNAIL_FORMATS)}"
+    if width in (None, ''):
+        return THUMBNAIL_WIDTHS[-1], image_format, None
+    try:
+        width = int(width)
+    except (TypeError, ValueError):
+        width = 0
+    if width <= 0:
+        return None, None, 'width must be a positive integer'
+    return thumbnail_width(width), image_format, None
+
+def thumbnail_response(url, width=None, image_format=None):
+    """Thumbnail of a video as an attachment, served from memory with an ETag.
+
+    With width/format set, a scaled jpeg or webp variant is returned instead
+    of the image YouTube serves.
+    """
+    # Repeat requests are answered from the cache without looking up the video again
+    video_id = extract_video_id(url)
+    thumbnail = None
+    if image_format and video_id and thumbnail_cache is not None:
+        thumbnail = thumbnail_cache.get(f'{video_id}:{width}:{image_format}')
+    original = None
+    if thumbnail is None and thumbnail_cache is not None and video_id:
+        original = thumbnail_cache.get(video_id)
+    if thumbnail is None and original is None:
+        video_info = get_video_info(url)
+        if not video_info or not video_info.get('thumbnail'):
+            return jsonify({'error': 'Could not extract thumbnail information.'}), 400
+        video_id = video_info.get('video_id') or video_id or 'thumbnail'
+        try:
+            original = fetch_thumbnail(video_id, video_info['thumbnail'])
+        except Exception as e:
+            logger.error(f"Error downloading thumbnail: {e}")
+            return jsonify({'error': 'Failed to download thumbnail.'}), 500
+    if thumbnail is None:
+        thumbnail = thumbnail_variants.get(video_id, original, width, image_format) if image_format else original
+    
+    extension = 'webp' if thumbnail['content_type'] == 'image/webp' else 'jpg'
+    filename = f"{video_id}_thumbnail.{extension}"
+    response = Response(thumbnail['data'], mimetype=thumbnail['content_type'])
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response.headers['Cache-Control'] = 'private, max-age=3600'
+    response.set_etag(thumbnail['etag'])
+    # Answers If-None-Match with 304 on GET requests
+    return response.make_conditional(request)
+
 @app.route('/api/download-thumbnail', methods=['POST'])
 def download_thumbnail_api():
     try:
@@ -494,58 +3924,234 @@ def download_thumbnail_api():
         if not is_valid_youtube_url(url):
             return jsonify({'error': 'Invalid YouTube URL'}), 400
         
-        # Get video info first
-        video_info = get_video_info(url)
-        if not video_info or not video_info.get('thumbnail'):
-            return jsonify({'error': 'Could not extract thumbnail information.'}), 400
-        
-        # Create temporary directory
-        temp_dir = tempfile.mkdtemp(prefix=f'thumbnail_{int(time.time())}_')
-        
-        # Download thumbnail
-        thumbnail_path = download_thumbnail(
-            video_info['thumbnail'], 
-            video_info.get('video_id', 'thumbnail'), 
-            temp_dir
-        )
-        
-        if not thumbnail_path:
-            return jsonify({'error': 'Failed to download thumbnail.'}), 500
-        
-        # Return thumbnail file
-        filename = f"{video_info.get('video_id', 'thumbnail')}_thumbnail.jpg"
-        
-        # Schedule cleanup after download
-        def cleanup_after_download():
-            time.sleep(10)  # Wait 10 seconds
-            try:
-                shutil.rmtree(temp_dir, ignore_errors=True)
-            except Exception as e:
-                logger.error(f"Thumbnail cleanup error: {e}")
+        width, image_format, error = parse_thumbnail_variant(data.get('width'), data.get('format'))
+        if error:
+            return jsonify({'error': error}), 400
         
-        cleanup_thread = threading.Thread(target=cleanup_after_download)
-        cleanup_thread.daemon = True
-        cleanup_thread.start()
-        
-        return send_file(thumbnail_path, as_attachment=True, download_name=filename)
+        return thumbnail_response(url, width, image_format)
         
     except Exception as e:
         logger.error(f"Thumbnail download API error: {e}")
         return jsonify({'error': 'An error occurred while downloading the thumbnail.'}), 500
 
+@app.route('/api/thumbnail/<video_id>')
+def get_thumbnail_api(video_id):
+    try:
+        if not re.fullmatch(r'[a-zA-Z0-9_-]{11}', video_id):
+            return jsonify({'error': 'Invalid YouTube video ID'}), 400
+        width, image_format, error = parse_thumbnail_variant(request.args.get('width'), request.args.get('format'))
+        if error:
+            return jsonify({'error': error}), 400
+        return thumbnail_response(f'https://www.youtube.com/watch?v={video_id}', width, image_format)
+    except Exception as e:
+        logger.error(f"Thumbnail API error: {e}")
+        return jsonify({'error': 'An error occurred while downloading the thumbnail.'}), 500
+
+def detached_progress_key(download_id):
+    """Where the progress seen by a download's caller is kept once it left a download others still share"""
+    return f'{download_id}:detached'
+
+def resolve_progress(download_id):
+    """Stored progress for a download; downloads attached to another one report that one's progress"""
+    progress = progress_store.get(detached_progress_key(download_id)) or progress_store.get(download_id)
+    if progress and progress.get('follows'):
+        leader_id = progress['follows']
+        return leader_id, dict(progress_store.get(leader_id) or progress, follows=leader_id)
+    return download_id, progress
+
+def lookup_progress(download_id):
+    """Current progress for a download, including its queue position while it waits"""
+    return lookup_progresses([download_id])[0]
+
+def lookup_progresses(download_ids):
+    """Current progress for several downloads, with the queue positions of all waiting ones found at once"""
+    resolved = []
+    for download_id in download_ids:
+        job_id, progress = resolve_progress(download_id)
+        resolved.append((job_id, progress or {'status': 'not_found'}))
+    waiting = [job_id for job_id, progress in resolved if progress.get('status') in ('queued', 'not_found')]
+    queue_statuses = download_scheduler.queue_statuses(waiting) if waiting else {}
+    return [
+        format_progress(dict(progress, status='queued', **queue_statuses[job_id]) if job_id in queue_statuses else progress)
+        for job_id, progress in resolved
+    ]
+
 @app.route('/api/progress/<download_id>')
 def get_progress(download_id):
     try:
-        progress = download_progress.get(download_id, {'status': 'not_found'})
-        return jsonify(progress)
+        return jsonify(lookup_progress(download_id))
     except Exception as e:
         logger.error(f"Progress API error: {e}")
         return jsonify({'status': 'error', 'message': 'Failed to get progress'}), 500
 
+@app.route('/api/progress/<download_id>/stream')
+def stream_progress(download_id):
+    file_url = url_for('download_file', download_id=download_id)
+    
+    def generate():
+        last_progress = None
+        last_sent = 0
+        started = time.time()
+        version = progress_notifier.version
+        # Streams end after PROGRESS_STREAM_MAX_SECONDS so none holds a worker for a whole download;
+        # EventSource reconnects after the retry delay and gets the current progress again
+        yield f"retry: {PROGRESS_STREAM_RETRY_MS}\n\n"
+        while time.time() - started < PROGRESS_STREAM_MAX_SECONDS:
+            try:
+                progress = lookup_progress(download_id)
+            except Exception as e:
+                logger.error(f"Progress stream error: {e}")
+                progress = {'status': 'error', 'message': 'Failed to get progress'}
+            
+            status = progress.get('status')
+            if status == 'finished':
+                yield f"event: finished\ndata: {json.dumps(dict(progress, file_url=file_url))}\n\n"
+                return
+            # Give a job that is still being handed to a worker a moment to show up
+            if status in ('error', 'cancelled') or (status == 'not_found' and time.time() - started > PROGRESS_STREAM_KEEPALIVE):
+                # Not named 'error': EventSource reserves that for connection failures
+                yield f"event: failed\ndata: {json.dumps(progress)}\n\n"
+                return
+            
+            if progress != last_progress:
+                yield f"data: {json.dumps(progress)}\n\n"
+                last_progress = progress
+                last_sent = time.time()
+            elif time.time() - last_sent >= PROGRESS_STREAM_KEEPALIVE:
+                yield ": keepalive\n\n"
+                last_sent = time.time()
+            
+            # Throttle to one update per interval; updates in between are coalesced
+            remaining = last_sent + PROGRESS_STREAM_INTERVAL - time.time()
+            if remaining > 0:
+                time.sleep(remaining)
+            # Woken by ProgressHook in this worker; the timeout picks up updates made by other workers
+            version = progress_notifier.wait(version, timeout=1)
+    
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@app.route('/api/cache-stats')
+def get_cache_stats():
+    try:
+        return jsonify({
+            'video_info': video_info_cache.stats() if video_info_cache else {'backend': 'none'},
+            'artifacts': artifact_cache.stats() if artifact_cache else {'backend': 'none'},
+            'thumbnails': thumbnail_cache.stats() if thumbnail_cache else {'backend': 'none'},
+            'thumbnail_variants': thumbnail_variants.stats(),
+            'storage': storage_manager.stats(),
+            'youtube_dl_instances': ydl_factory.stats(),
+            'single_flight': {
+                'video_info': video_info_flight.stats(),
+                'downloads': download_flights.stats()
+            }
+        })
+    except Exception as e:
+        logger.error(f"Cache stats API error: {e}")
+        return jsonify({'error': 'Failed to get cache stats'}), 500
+
+@app.route('/api/extraction-stats')
+def get_extraction_stats():
+    try:
+        return jsonify(extraction_selector.stats())
+    except Exception as e:
+        logger.error(f"Extraction stats API error: {e}")
+        return jsonify({'error': 'Failed to get extraction stats'}), 500
+
+@app.route('/api/rate-stats')
+def get_rate_stats():
+    try:
+        return jsonify(rate_governor.stats())
+    except Exception as e:
+        logger.error(f"Rate stats API error: {e}")
+        return jsonify({'error': 'Failed to get rate stats'}), 500
+
+@app.route('/metrics')
+def get_metrics():
+    try:
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+    except Exception as e:
+        logger.error(f"Metrics API error: {e}")
+        return jsonify({'error': 'Failed to get metrics'}), 500
+
+class LeasedFile(io.FileIO):
+    """File opened for one transfer; closing it (after the last byte or a client abort) ends the transfer"""
+
+    def __init__(self, path, on_close):
+        super().__init__(path, 'rb')
+        self._on_close = on_close
+
+    def close(self):
+        if not self.closed:
+            try:
+                super().close()
+            finally:
+                self._on_close()
+
+def build_file_response(file_path, filename, on_close):
+    """Response serving a file from disk, offloaded to the front-end server when configured"""
+    if X_ACCEL_REDIRECT_PREFIX:
+        relative_path = os.path.relpath(file_path, X_ACCEL_REDIRECT_ROOT)
+        if not relative_path.startswith('..'):
+            # nginx streams the file itself, including Range and conditional requests
+            on_close()
+            response = Response(status=200)
+            response.headers['X-Accel-Redirect'] = X_ACCEL_REDIRECT_PREFIX.rstrip('/') + '/' + quote(relative_path)
+            response.headers['Content-Disposition'] = f"attachment; filename*=UTF-8''{quote(filename)}"
+            return response
+    if app.config['USE_X_SENDFILE']:
+        on_close()
+        return send_file(file_path, as_attachment=True, download_name=filename)
+    
+    stat = os.stat(file_path)
+    # The file object keeps a real fileno, so gunicorn's wsgi.file_wrapper can still use sendfile()
+    response = send_file(
+        LeasedFile(file_path, on_close),
+        as_attachment=True,
+        download_name=filename,
+        conditional=False,
+        etag=f"{stat.st_mtime}-{stat.st_size}-{zlib.adler32(file_path.encode())}",
+        last_modified=stat.st_mtime,
+        max_age=0
+    )
+    response.content_length = stat.st_size
+    # Answers Range, If-Range, If-None-Match and If-Modified-Since
+    return response.make_conditional(request, accept_ranges=True, complete_length=stat.st_size)
+
+def send_download(file_path, job_id):
+    """Serve a finished download, holding a file lease for the whole transfer.
+
+    The storage manager evicts the file once no transfer is active and
+    nobody has fetched it for FILE_RETENTION_SECONDS.
+    """
+    transfer_ended = threading.Event()
+    started = time.perf_counter()
+    
+    def end_transfer():
+        if not transfer_ended.is_set():
+            transfer_ended.set()
+            # Offloaded transfers (X-Accel-Redirect, X-Sendfile) end as soon as the response is built
+            metrics.observe('ytdl_stage_duration_seconds', time.perf_counter() - started, stage='send_file')
+            file_leases.release(file_path)
+            progress_store.update(job_id, {'last_served_at': time.time()})
+            storage_manager.touch(os.path.dirname(file_path), FILE_RETENTION_SECONDS)
+    
+    file_leases.acquire(file_path)
+    try:
+        progress_store.update(job_id, {'last_served_at': time.time()})
+        # Offloaded transfers hold no lease while the front-end server sends the file; this expiry covers them
+        storage_manager.touch(os.path.dirname(file_path), FILE_RETENTION_SECONDS)
+        return build_file_response(file_path, os.path.basename(file_path), end_transfer)
+    except Exception:
+        end_transfer()
+        raise
+
 @app.route('/api/download-file/<download_id>')
 def download_file(download_id):
     try:
-        progress = download_progress.get(download_id)
+        job_id, progress = resolve_progress(download_id)
         
         if not progress or progress.get('status') != 'finished':
             abort(404)
@@ -554,27 +4160,96 @@ def download_file(download_id):
         if not file_path or not os.path.exists(file_path):
             abort(404)
         
-        filename = os.path.basename(file_path)
+        return send_download(file_path, job_id)
         
-        # Schedule cleanup after download
-        def cleanup_after_download():
-            time.sleep(10)  # Wait 10 seconds
-            try:
-                temp_dir = os.path.dirname(file_path)
-                shutil.rmtree(temp_dir, ignore_errors=True)
-                if download_id in download_progress:
-                    del download_progress[download_id]
-            except Exception as e:
-                logger.error(f"Cleanup error: {e}")
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Download file error: {e}")
+        abort(500)
+
+class ZipStream(io.RawIOBase):
+    """Unseekable sink for zipfile; what it writes is handed on to a response generator"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+def stream_zip(entries):
+    """Yield a zip of (name, path) entries as it is built; nothing is staged on disk"""
+    sink = ZipStream()
+    # Media is already compressed, so entries are stored; zip64 since videos can exceed 4 GiB
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for name, path in entries:
+            with open(path, 'rb') as source, archive.open(name, 'w', force_zip64=True) as target:
+                while True:
+                    chunk = source.read(STREAM_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    target.write(chunk)
+                    yield sink.take()
+    yield sink.take()
+
+@app.route('/api/batch/<batch_id>/zip')
+def download_batch_zip(batch_id):
+    try:
+        batch = progress_store.get(batch_id)
+        if not batch or batch.get('status') != 'batch':
+            abort(404)
         
-        cleanup_thread = threading.Thread(target=cleanup_after_download)
-        cleanup_thread.daemon = True
-        cleanup_thread.start()
+        # Finished items only; unfinished ones can be fetched with a later request
+        entries, names, job_ids = [], set(), []
+        for item in batch['items']:
+            job_id, progress = resolve_progress(item['download_id'])
+            file_path = (progress or {}).get('file_path')
+            if not progress or progress.get('status') != 'finished' or not file_path or not os.path.exists(file_path):
+                continue
+            name = os.path.basename(file_path)
+            if name in names:
+                stem, extension = os.path.splitext(name)
+                name = f"{stem} ({item['video_id']}){extension}"
+            names.add(name)
+            entries.append((name, file_path))
+            job_ids.append(job_id)
+        if not entries:
+            return jsonify({'error': 'No finished downloads in this batch yet'}), 409
         
-        return send_file(file_path, as_attachment=True, download_name=filename)
+        # Same lease rules as single files: nothing is cleaned up while the zip is being sent
+        for _, file_path in entries:
+            file_leases.acquire(file_path)
+            storage_manager.touch(os.path.dirname(file_path), FILE_RETENTION_SECONDS)
         
+        started = time.perf_counter()
+        
+        def end_transfer():
+            metrics.observe('ytdl_stage_duration_seconds', time.perf_counter() - started, stage='send_zip')
+            for _, file_path in entries:
+                file_leases.release(file_path)
+            for job_id in job_ids:
+                progress_store.update(job_id, {'last_served_at': time.time()})
+            for _, file_path in entries:
+                storage_manager.touch(os.path.dirname(file_path), FILE_RETENTION_SECONDS)
+        
+        response = Response(stream_zip(entries), mimetype='application/zip')
+        response.headers['Content-Disposition'] = f'attachment; filename="batch_{batch_id}.zip"'
+        response.call_on_close(end_transfer)
+        return response
+        
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Download file error: {e}")
+        logger.error(f"Batch zip error: {e}")
         abort(500)
 
 # Template filters
@@ -615,6 +4290,33 @@ def not_found_error(error):
 def internal_error(error):
     return jsonify({'error': 'Internal server error'}), 500
 
+def warm_up():
+    """Do yt-dlp's one-time setup now instead of in each worker's first request.
+
+    Builds a YoutubeDL, which imports the extractor registry, compiles the
+    URL patterns of the extractors tried before YouTube's and creates the
+    YouTube extractor, and imports PIL. Under gunicorn --preload this runs
+    once in the master; gc.freeze() then keeps the garbage collector from
+    writing to these objects, so the forked workers go on sharing their
+    memory pages instead of each getting a copy.
+    """
+    started = time.perf_counter()
+    from PIL import Image  # noqa: F401
+
+    url = 'https://www.youtube.com/watch?v=dQw4w9WgXcQ'
+    method_name = next(iter(EXTRACTION_METHODS))
+    with yt_dlp.YoutubeDL(ydl_factory.info_options(method_name, EGRESS_IDENTITIES[0])) as ydl:
+        for ie in yt_dlp.extractor.gen_extractor_classes():
+            if ie.suitable(url):
+                ydl.get_info_extractor(ie.ie_key())
+                break
+    gc.collect()
+    gc.freeze()
+    logger.info(f"Warmed up yt-dlp in {time.perf_counter() - started:.2f}s")
+
+if YTDL_PRELOAD:
+    warm_up()
+
 if __name__ == '__main__':
     # Create templates directory if it doesn't exist
     os.makedirs('templates', exist_ok=True)
@@ -0,0 +1,101 @@
+"""Bytes fetched, disk used and time of a clip download vs. the whole video.
+
+Generates a test video with ffmpeg (an H.264/AAC mp4 with a keyframe every
+two seconds) and serves it from the local fake YouTube backend
+(fake_youtube.py) with limited bandwidth. The app then downloads it in-process,
+first whole and then only a clip from the middle, and the report compares what
+the backend sent, the size of the result and the job time. Needs ffmpeg on
+PATH, as clip downloads themselves do.
+
+    python benchmarks/bench_clip.py --video-seconds 600 --clip-seconds 30
+"""
+import argparse
+import contextlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_youtube import FakeYouTube, install_stub_extractor  # noqa: E402
+
+
+def make_video(path, seconds):
+    subprocess.run([
+        'ffmpeg', '-v', 'error', '-y',
+        '-f', 'lavfi', '-i', f'testsrc2=size=640x360:rate=25:duration={seconds}',
+        '-f', 'lavfi', '-i', f'sine=frequency=440:duration={seconds}',
+        '-c:v', 'libx264', '-preset', 'veryfast', '-g', '50', '-b:v', '800k',
+        '-c:a', 'aac', '-b:a', '96k', '-movflags', '+faststart', path
+    ], check=True)
+
+
+def run(ytapp, backend, name, clip):
+    sent_before = backend.stats()['media_bytes_sent']
+    started = time.perf_counter()
+    file_path = ytapp.download_video(
+        'https://www.youtube.com/watch?v=benchclip01', 'best', f'bench_{name}', clip=clip
+    )
+    seconds = time.perf_counter() - started
+    probe = subprocess.run(
+        ['ffmpeg', '-i', file_path, '-f', 'null', '-'], capture_output=True, text=True
+    ).stderr
+    duration = [line for line in probe.splitlines() if 'Duration:' in line]
+    result = {
+        'download': name,
+        'clip': clip,
+        'seconds': round(seconds, 2),
+        'bytes_fetched': backend.stats()['media_bytes_sent'] - sent_before,
+        'file_bytes': os.path.getsize(file_path),
+        'file_duration': duration[0].split(',')[0].split('Duration:')[1].strip() if duration else None
+    }
+    ytapp.storage_manager.remove(os.path.dirname(file_path))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--video-seconds', type=int, default=600)
+    parser.add_argument('--clip-seconds', type=float, default=30)
+    parser.add_argument('--bandwidth-kbps', type=int, default=4096, help='backend bandwidth per connection')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='ytdl_bench_clip_')
+    video_path = os.path.join(work_dir, 'source.mp4')
+    make_video(video_path, args.video_seconds)
+    os.environ.update({
+        'YTDL_STATE_DIR': os.path.join(work_dir, 'state'),
+        'STORAGE_DIR': os.path.join(work_dir, 'downloads'),
+        'YOUTUBE_REQUESTS_PER_MINUTE': '1000000',
+        'EGRESS_REQUESTS_PER_MINUTE': '1000000'
+    })
+    backend = FakeYouTube(
+        bytes_per_second=args.bandwidth_kbps * 1024, media_path=video_path, duration=args.video_seconds
+    ).start()
+    install_stub_extractor(backend.base_url)
+    sys.path.insert(0, ROOT)
+    import logging
+    import app as ytapp
+
+    logging.getLogger('app').setLevel(logging.ERROR)
+    start = args.video_seconds / 2
+    try:
+        # yt-dlp prints download progress to stdout, which is reserved for the report
+        with contextlib.redirect_stdout(sys.stderr):
+            results = [
+                run(ytapp, backend, 'full', None),
+                run(ytapp, backend, 'clip', [start, start + args.clip_seconds])
+            ]
+    finally:
+        backend.shutdown()
+        shutil.rmtree(work_dir, ignore_errors=True)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
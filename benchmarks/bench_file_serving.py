@@ -0,0 +1,156 @@
+"""Throughput and worker occupancy when serving large files to slow clients.
+
+Runs the app under gunicorn with a shared SQLite progress store, creates a
+large finished download, and has N clients fetch it through
+/api/download-file/<id> at a limited read rate (one of them resuming with a
+Range request). Meanwhile a probe hits /api/progress every 200ms; its latency
+shows whether slow transfers are tying up workers.
+
+    python benchmarks/bench_file_serving.py --size-mb 300 --clients 16
+"""
+import argparse
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODES = {
+    'sync-sendfile': ['-k', 'sync'],
+    'sync-no-sendfile': ['-k', 'sync', '--no-sendfile'],
+    'gthread-sendfile': ['-k', 'gthread', '--threads', '16'],
+}
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError('server did not start')
+
+
+def slow_client(url, rate, seconds, results, headers=None):
+    """Read the response at about rate bytes/second for at most seconds"""
+    received = 0
+    started = time.time()
+    with requests.get(url, stream=True, headers=headers or {}) as response:
+        status = response.status_code
+        for chunk in response.iter_content(64 * 1024):
+            received += len(chunk)
+            ahead = received / rate - (time.time() - started)
+            if ahead > 0:
+                time.sleep(ahead)
+            if time.time() - started >= seconds:
+                break
+    results.append({'status': status, 'bytes': received, 'seconds': time.time() - started})
+
+
+def probe(url, stop, latencies):
+    while not stop.is_set():
+        started = time.time()
+        try:
+            requests.get(url, timeout=30)
+            latencies.append(time.time() - started)
+        except requests.RequestException:
+            latencies.append(30.0)
+        time.sleep(0.2)
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def run(mode, args, state_dir, file_size):
+    env = dict(os.environ, PROGRESS_BACKEND='sqlite', YTDL_STATE_DIR=state_dir)
+    server = subprocess.Popen(
+        ['gunicorn', '-w', str(args.workers), '-b', f'127.0.0.1:{args.port}', '--log-level', 'warning']
+        + MODES[mode] + ['app:app'],
+        cwd=ROOT, env=env
+    )
+    try:
+        wait_for_port(args.port)
+        base = f'http://127.0.0.1:{args.port}'
+        url = f'{base}/api/download-file/1_bench'
+        rate = args.client_kbps * 1024
+
+        results, latencies = [], []
+        stop = threading.Event()
+        prober = threading.Thread(target=probe, args=(f'{base}/api/progress/1_bench', stop, latencies))
+        prober.start()
+        clients = [
+            threading.Thread(target=slow_client, args=(url, rate, args.seconds, results))
+            for _ in range(args.clients - 1)
+        ]
+        # One client resumes an interrupted transfer from the middle of the file
+        clients.append(threading.Thread(
+            target=slow_client,
+            args=(url, rate, args.seconds, results, {'Range': f'bytes={file_size // 2}-'})
+        ))
+        started = time.time()
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        elapsed = time.time() - started
+        stop.set()
+        prober.join()
+    finally:
+        server.terminate()
+        server.wait()
+
+    latencies.sort()
+    total = sum(r['bytes'] for r in results)
+    return {
+        'mode': mode,
+        'clients': args.clients,
+        'workers': args.workers,
+        'throughput_mb_s': round(total / elapsed / (1024 * 1024), 2),
+        'statuses': sorted({r['status'] for r in results}),
+        'probe_p50_ms': round(percentile(latencies, 0.5) * 1000, 1) if latencies else None,
+        'probe_p99_ms': round(percentile(latencies, 0.99) * 1000, 1) if latencies else None,
+        'probe_requests': len(latencies)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size-mb', type=int, default=300)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--client-kbps', type=int, default=2048, help='read rate per client')
+    parser.add_argument('--seconds', type=float, default=10, help='how long each client reads')
+    parser.add_argument('--port', type=int, default=5056)
+    parser.add_argument('--modes', default=','.join(MODES))
+    args = parser.parse_args()
+
+    state_dir = tempfile.mkdtemp(prefix='ytdl_bench_')
+    os.environ['PROGRESS_BACKEND'] = 'sqlite'
+    os.environ['YTDL_STATE_DIR'] = state_dir
+    sys.path.insert(0, ROOT)
+    import app as ytapp
+
+    try:
+        file_path = os.path.join(state_dir, 'bench.mp4')
+        with open(file_path, 'wb') as f:
+            f.truncate(args.size_mb * 1024 * 1024)
+        ytapp.progress_store.set('1_bench', {'status': 'finished', 'file_path': file_path})
+        results = [run(mode, args, state_dir, os.path.getsize(file_path)) for mode in args.modes.split(',')]
+    finally:
+        shutil.rmtree(state_dir, ignore_errors=True)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
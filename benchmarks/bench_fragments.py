@@ -0,0 +1,135 @@
+"""Wall-clock time of fragmented downloads at different concurrency levels.
+
+Serves a video and an audio HLS stream from a local HTTP server that adds a
+per-request delay and limits each connection's bandwidth, like a CDN seen
+from far away. Then downloads video+audio through the app's downloader for
+each fragment concurrency, with the two formats fetched one after another and
+in parallel. Only the download phase is timed; the formats are not merged.
+
+    python benchmarks/bench_fragments.py --segments 40 --levels 1,2,4,8
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def make_handler(segments, segment_bytes, latency, bytes_per_second):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            stream, _, name = self.path.strip('/').partition('/')
+            if name == 'index.m3u8':
+                lines = ['#EXTM3U', '#EXT-X-VERSION:3', '#EXT-X-TARGETDURATION:4', '#EXT-X-MEDIA-SEQUENCE:0']
+                for i in range(segments):
+                    lines += ['#EXTINF:4.0,', f'{i}.ts']
+                lines.append('#EXT-X-ENDLIST')
+                self.send_body('application/vnd.apple.mpegurl', '\n'.join(lines).encode())
+            elif name.endswith('.ts'):
+                time.sleep(latency)
+                self.send_body('video/mp2t', b'\x47' * segment_bytes, throttle=True)
+            else:
+                self.send_error(404)
+
+        def send_body(self, content_type, body, throttle=False):
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            chunk = 64 * 1024
+            started = time.time()
+            for offset in range(0, len(body), chunk):
+                self.wfile.write(body[offset:offset + chunk])
+                if throttle:
+                    ahead = (offset + chunk) / bytes_per_second - (time.time() - started)
+                    if ahead > 0:
+                        time.sleep(ahead)
+
+    return Handler
+
+
+def run(ytapp, base, concurrency, parallel_formats):
+    temp_dir = tempfile.mkdtemp(prefix='ytdl_bench_fragments_')
+    info = {
+        'id': 'bench',
+        'title': 'bench',
+        'extractor': 'generic',
+        'extractor_key': 'Generic',
+        'webpage_url': base,
+        'formats': [
+            {'format_id': 'video', 'url': f'{base}/video/index.m3u8', 'protocol': 'm3u8_native',
+             'ext': 'mp4', 'vcodec': 'avc1.640028', 'acodec': 'none', 'height': 1080},
+            {'format_id': 'audio', 'url': f'{base}/audio/index.m3u8', 'protocol': 'm3u8_native',
+             'ext': 'm4a', 'vcodec': 'none', 'acodec': 'mp4a.40.2'},
+        ]
+    }
+    ydl_opts = {
+        'quiet': True,
+        'no_warnings': True,
+        'noprogress': True,
+        'format': 'video+audio',
+        'outtmpl': os.path.join(temp_dir, '%(title)s.%(ext)s'),
+        'concurrent_fragment_downloads': concurrency,
+        # Keeps yt-dlp from requiring ffmpeg for the merge; only the downloads are measured
+        'allow_unplayable_formats': True
+    }
+    downloader_class = ytapp.ParallelFormatsYoutubeDL if parallel_formats else ytapp.yt_dlp.YoutubeDL
+    try:
+        started = time.time()
+        with downloader_class(ydl_opts) as ydl:
+            ydl.process_ie_result(info, download=True)
+        elapsed = time.time() - started
+        downloaded = sum(os.path.getsize(os.path.join(temp_dir, f)) for f in os.listdir(temp_dir))
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    return {
+        'concurrency': concurrency,
+        'parallel_formats': parallel_formats,
+        'seconds': round(elapsed, 2),
+        'mb_s': round(downloaded / elapsed / (1024 * 1024), 2)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--segments', type=int, default=40, help='segments per stream')
+    parser.add_argument('--segment-kb', type=int, default=512)
+    parser.add_argument('--latency-ms', type=int, default=100, help='delay before each segment')
+    parser.add_argument('--connection-kbps', type=int, default=4096, help='bandwidth of one connection')
+    parser.add_argument('--levels', default='1,2,4,8')
+    args = parser.parse_args()
+
+    state_dir = tempfile.mkdtemp(prefix='ytdl_bench_')
+    os.environ['YTDL_STATE_DIR'] = state_dir
+    sys.path.insert(0, ROOT)
+    import app as ytapp
+
+    handler = make_handler(args.segments, args.segment_kb * 1024, args.latency_ms / 1000, args.connection_kbps * 1024)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_address[1]}'
+
+    try:
+        results = [
+            run(ytapp, base, int(level), parallel_formats)
+            for level in args.levels.split(',')
+            for parallel_formats in (False, True)
+        ]
+    finally:
+        server.shutdown()
+        shutil.rmtree(state_dir, ignore_errors=True)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
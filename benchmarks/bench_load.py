@@ -0,0 +1,298 @@
+"""Load test of the full download flow against a local fake YouTube backend.
+
+Starts FakeYouTube (see fake_youtube.py) with the configured latency,
+bandwidth and injected bot-check/unavailable errors, then runs the app in a
+child process whose yt-dlp resolves YouTube URLs through it. Virtual users go
+through what the frontend does for each video: /api/video-info, /api/download,
+polling /api/progress until the download ends, then fetching
+/api/download-file. Reports request counts, throughput and p50/p99 latency per
+endpoint, the server's peak memory and the peak disk use of its download and
+cache directories.
+
+The JSON report can be saved with --output and compared against an earlier
+one with --baseline, which exits with status 1 when p99 latency or download
+throughput got worse by more than --tolerance, or when fetching a finished
+download failed, for use in CI.
+
+    python benchmarks/bench_load.py --users 8 --videos-per-user 5 --output load.json
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_youtube import FakeYouTube, install_stub_extractor  # noqa: E402
+
+ENDPOINTS = ('video_info', 'download', 'progress', 'download_file')
+
+
+def serve(port, backend_url):
+    """Child process: run the app with yt-dlp pointed at the fake backend"""
+    sys.path.insert(0, ROOT)
+    import logging
+    from werkzeug.serving import make_server
+
+    install_stub_extractor(backend_url)
+    import app as ytapp
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    logging.getLogger('app').setLevel(logging.ERROR)
+    make_server('127.0.0.1', port, ytapp.app, threaded=True).serve_forever()
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError('server did not start')
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def directory_bytes(path):
+    total = 0
+    for parent, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(parent, name))
+            except OSError:
+                pass
+    return total
+
+
+class Recorder:
+    """Latencies and status codes per endpoint, shared by the virtual users"""
+
+    def __init__(self):
+        self.latencies = {name: [] for name in ENDPOINTS}
+        self.statuses = {name: {} for name in ENDPOINTS}
+        self.downloads = {'finished': 0, 'error': 0, 'rejected': 0, 'timeout': 0}
+        self.download_seconds = []
+        self.bytes_received = 0
+        self._lock = threading.Lock()
+
+    def request(self, endpoint, session, method, url, **kwargs):
+        started = time.time()
+        try:
+            response = session.request(method, url, timeout=120, **kwargs)
+            if kwargs.get('stream'):
+                received = sum(len(chunk) for chunk in response.iter_content(256 * 1024))
+                with self._lock:
+                    self.bytes_received += received
+            status = response.status_code
+        except requests.RequestException:
+            response, status = None, 'exception'
+        with self._lock:
+            self.latencies[endpoint].append(time.time() - started)
+            self.statuses[endpoint][status] = self.statuses[endpoint].get(status, 0) + 1
+        return response
+
+    def outcome(self, name, seconds=None):
+        with self._lock:
+            self.downloads[name] += 1
+            if seconds is not None:
+                self.download_seconds.append(seconds)
+
+
+def virtual_user(base, video_ids, args, recorder, seed):
+    rng = random.Random(seed)
+    with requests.Session() as session:
+        for _ in range(args.videos_per_user):
+            url = f'https://www.youtube.com/watch?v={rng.choice(video_ids)}'
+            recorder.request('video_info', session, 'POST', f'{base}/api/video-info', json={'url': url})
+
+            started = time.time()
+            response = recorder.request('download', session, 'POST', f'{base}/api/download', json={
+                'url': url, 'quality': args.quality, 'download_thumbnail': args.thumbnails
+            })
+            if response is None or response.status_code != 200:
+                recorder.outcome('rejected')
+                continue
+            download_id = response.json()['download_id']
+
+            status = None
+            while time.time() - started < args.download_timeout:
+                response = recorder.request('progress', session, 'GET', f'{base}/api/progress/{download_id}')
+                status = response.json().get('status') if response is not None else None
+                if status in ('finished', 'error'):
+                    break
+                time.sleep(args.poll_ms / 1000)
+            if status != 'finished':
+                recorder.outcome('error' if status == 'error' else 'timeout')
+                continue
+            recorder.outcome('finished', time.time() - started)
+            recorder.request('download_file', session, 'GET', f'{base}/api/download-file/{download_id}', stream=True)
+
+
+def summarize(recorder, elapsed):
+    endpoints = {}
+    for name in ENDPOINTS:
+        latencies = sorted(recorder.latencies[name])
+        statuses = recorder.statuses[name]
+        endpoints[name] = {
+            'requests': len(latencies),
+            'requests_per_second': round(len(latencies) / elapsed, 2),
+            'errors': sum(count for status, count in statuses.items() if status == 'exception' or status >= 400),
+            'statuses': {str(status): count for status, count in sorted(statuses.items(), key=str)},
+            'p50_ms': round(percentile(latencies, 0.5) * 1000, 1) if latencies else None,
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 1) if latencies else None
+        }
+    seconds = sorted(recorder.download_seconds)
+    return endpoints, {
+        **recorder.downloads,
+        'per_second': round(recorder.downloads['finished'] / elapsed, 3),
+        'served_mb_s': round(recorder.bytes_received / elapsed / (1024 * 1024), 2),
+        'p50_seconds': round(percentile(seconds, 0.5), 2) if seconds else None,
+        'p99_seconds': round(percentile(seconds, 0.99), 2) if seconds else None
+    }
+
+
+def regressions(result, baseline, tolerance):
+    """Metrics that are worse than in the baseline report by more than tolerance"""
+    found = []
+    for name in ENDPOINTS:
+        old, new = baseline['endpoints'][name]['p99_ms'], result['endpoints'][name]['p99_ms']
+        if old and new and new > old * (1 + tolerance):
+            found.append(f'{name} p99 {old}ms -> {new}ms')
+    # Injected bot checks and unavailable videos fail downloads, but fetching a finished file never should
+    errors = result['endpoints']['download_file']['errors']
+    if errors:
+        found.append(f'download_file errors: {result["endpoints"]["download_file"]["statuses"]}')
+    old, new = baseline['downloads']['per_second'], result['downloads']['per_second']
+    if old and new < old * (1 - tolerance):
+        found.append(f'downloads/s {old} -> {new}')
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=8, help='concurrent virtual users')
+    parser.add_argument('--videos-per-user', type=int, default=5)
+    parser.add_argument('--videos', type=int, default=100, help='distinct video IDs to pick from')
+    parser.add_argument('--quality', default='best')
+    parser.add_argument('--thumbnails', action='store_true', help='ask for thumbnails with each download')
+    parser.add_argument('--media-kb', type=int, default=2048, help='size of each fake video')
+    parser.add_argument('--latency-ms', type=int, default=50, help='backend delay before each response')
+    parser.add_argument('--bandwidth-kbps', type=int, default=8192, help='backend bandwidth per connection, 0 for unlimited')
+    parser.add_argument('--bot-check-rate', type=float, default=0.02, help='share of watch pages answered with a bot check')
+    parser.add_argument('--unavailable-rate', type=float, default=0.02, help='share of watch pages saying the video is unavailable')
+    parser.add_argument('--youtube-rpm', type=int, default=100000, help='YOUTUBE_REQUESTS_PER_MINUTE for the app')
+    parser.add_argument('--poll-ms', type=int, default=250)
+    parser.add_argument('--download-timeout', type=float, default=300)
+    parser.add_argument('--port', type=int, default=5057)
+    parser.add_argument('--output', help='also write the report to this file')
+    parser.add_argument('--baseline', help='earlier report to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed regression against the baseline')
+    parser.add_argument('--serve', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.port, args.serve)
+        return
+
+    work_dir = tempfile.mkdtemp(prefix='ytdl_bench_load_')
+    backend = FakeYouTube(
+        latency=args.latency_ms / 1000,
+        bytes_per_second=args.bandwidth_kbps * 1024,
+        media_bytes=args.media_kb * 1024,
+        bot_check_rate=args.bot_check_rate,
+        unavailable_rate=args.unavailable_rate
+    ).start()
+    env = dict(
+        os.environ,
+        YTDL_STATE_DIR=os.path.join(work_dir, 'state'),
+        STORAGE_DIR=os.path.join(work_dir, 'downloads'),
+        YOUTUBE_REQUESTS_PER_MINUTE=str(args.youtube_rpm),
+        THUMBNAIL_REQUESTS_PER_MINUTE=str(args.youtube_rpm),
+        EGRESS_REQUESTS_PER_MINUTE=str(args.youtube_rpm)
+    )
+    # yt-dlp prints download progress to stdout, which is reserved for the report
+    server = subprocess.Popen(
+        [sys.executable, __file__, '--serve', backend.base_url, '--port', str(args.port)],
+        env=env, stdout=subprocess.DEVNULL
+    )
+    peak_disk = 0
+    stop = threading.Event()
+
+    def sample_disk():
+        nonlocal peak_disk
+        while not stop.is_set():
+            peak_disk = max(peak_disk, directory_bytes(work_dir))
+            time.sleep(0.2)
+
+    try:
+        wait_for_port(args.port)
+        base = f'http://127.0.0.1:{args.port}'
+        video_ids = [f'bench{i:06d}' for i in range(args.videos)]
+        recorder = Recorder()
+        sampler = threading.Thread(target=sample_disk, daemon=True)
+        sampler.start()
+        users = [
+            threading.Thread(target=virtual_user, args=(base, video_ids, args, recorder, seed))
+            for seed in range(args.users)
+        ]
+        started = time.time()
+        for user in users:
+            user.start()
+        for user in users:
+            user.join()
+        elapsed = time.time() - started
+        stop.set()
+        sampler.join()
+    finally:
+        server.terminate()
+        server.wait()
+        backend.shutdown()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    endpoints, downloads = summarize(recorder, elapsed)
+    result = {
+        'config': {
+            name: getattr(args, name) for name in (
+                'users', 'videos_per_user', 'videos', 'quality', 'media_kb', 'latency_ms',
+                'bandwidth_kbps', 'bot_check_rate', 'unavailable_rate'
+            )
+        },
+        'seconds': round(elapsed, 2),
+        'endpoints': endpoints,
+        'downloads': downloads,
+        'backend': backend.stats(),
+        'server': {
+            # ru_maxrss is in KiB on Linux
+            'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+            'peak_disk_mb': round(peak_disk / (1024 * 1024), 1)
+        }
+    }
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(result, json.load(f), args.tolerance)
+        for regression in found:
+            print(f'REGRESSION: {regression}', file=sys.stderr)
+        sys.exit(1 if found else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""Overhead of ProgressHook per yt-dlp callback and per download, with and without coalescing.
+
+Runs ProgressHook in-process against the memory or SQLite progress store.
+Each simulated download is a video and an audio file fetched in parallel,
+like a merged format, whose threads call the hook with the progress dicts
+yt-dlp passes at a steady rate. The first run writes every callback to the
+store (PROGRESS_MIN_INTERVAL and PROGRESS_MIN_DELTA at 0, like the hook
+used to); the second uses the configured coalescing. Time spent in the hook
+is measured around each call, so waits for its lock and the store count too.
+
+    python benchmarks/bench_progress_hook.py --jobs 16 --callbacks 400 --backend sqlite
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def feed(hook, filename, total, callbacks, interval, timings):
+    """Call the hook the way yt-dlp does while downloading one file"""
+    started = time.time()
+    for i in range(1, callbacks + 1):
+        downloaded = total * i // callbacks
+        elapsed = time.time() - started or interval
+        d = {
+            'status': 'downloading',
+            'filename': filename,
+            'downloaded_bytes': downloaded,
+            'total_bytes': total,
+            'speed': downloaded / elapsed,
+            'eta': int((total - downloaded) / (downloaded / elapsed)),
+            'elapsed': elapsed,
+            '_percent_str': f'{100 * downloaded / total:5.1f}%',
+            '_speed_str': f'{downloaded / elapsed / 1024 / 1024:.2f}MiB/s'
+        }
+        call_started = time.perf_counter()
+        hook(d)
+        timings.append(time.perf_counter() - call_started)
+        time.sleep(interval)
+    call_started = time.perf_counter()
+    hook({'status': 'finished', 'filename': filename, 'downloaded_bytes': total, 'total_bytes': total})
+    timings.append(time.perf_counter() - call_started)
+
+
+def run(ytapp, jobs, callbacks, seconds):
+    interval = seconds / callbacks
+    hooks, threads, timings = [], [], []
+    for job in range(jobs):
+        hook = ytapp.ProgressHook(f'bench_{job}')
+        hooks.append(hook)
+        for filename, total in (('video.f137.mp4', 80 * 1024 * 1024), ('audio.f140.m4a', 8 * 1024 * 1024)):
+            job_timings = []
+            timings.append(job_timings)
+            threads.append(threading.Thread(target=feed, args=(hook, filename, total, callbacks, interval, job_timings)))
+    cpu_started = time.process_time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    cpu = time.process_time() - cpu_started
+    calls = sorted(t for job_timings in timings for t in job_timings)
+    return {
+        'min_interval': ytapp.PROGRESS_MIN_INTERVAL,
+        'min_delta': ytapp.PROGRESS_MIN_DELTA,
+        'callbacks': len(calls),
+        'us_per_callback': round(sum(calls) / len(calls) * 1e6, 1),
+        'p99_us_per_callback': round(percentile(calls, 0.99) * 1e6, 1),
+        'hook_ms_per_job': round(sum(calls) / jobs * 1000, 2),
+        'store_writes_per_job': round(sum(hook.writes for hook in hooks) / jobs, 1),
+        'process_cpu_seconds': round(cpu, 3)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--jobs', type=int, default=16, help='downloads running at once')
+    parser.add_argument('--callbacks', type=int, default=400, help='progress callbacks per file')
+    parser.add_argument('--seconds', type=float, default=2, help='duration of each simulated download')
+    parser.add_argument('--backend', choices=('memory', 'sqlite'), default='sqlite')
+    args = parser.parse_args()
+
+    state_dir = tempfile.mkdtemp(prefix='ytdl_bench_')
+    os.environ.update({'YTDL_STATE_DIR': state_dir, 'PROGRESS_BACKEND': args.backend})
+    sys.path.insert(0, ROOT)
+    import app as ytapp
+
+    coalesced = (ytapp.PROGRESS_MIN_INTERVAL, ytapp.PROGRESS_MIN_DELTA)
+    try:
+        results = []
+        for min_interval, min_delta in ((0, 0), coalesced):
+            ytapp.PROGRESS_MIN_INTERVAL, ytapp.PROGRESS_MIN_DELTA = min_interval, min_delta
+            result = run(ytapp, args.jobs, args.callbacks, args.seconds)
+            results.append(dict(result, backend=args.backend))
+    finally:
+        shutil.rmtree(state_dir, ignore_errors=True)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""Compare progress polling with the SSE progress stream.
+
+Starts the app in a child process with N simulated downloads that report
+progress through ProgressHook, then follows every download either by polling
+/api/progress/<id> once a second (like the old frontend) or through
+/api/progress/<id>/stream. Reports HTTP requests made and the server's CPU time.
+
+    python benchmarks/bench_progress_stream.py --downloads 50 --duration 10
+"""
+import argparse
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def serve(port, downloads, duration):
+    """Child process: run the app with simulated downloads, exit after the run"""
+    sys.path.insert(0, ROOT)
+    import logging
+    from werkzeug.serving import make_server
+    import app as ytapp
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+    def simulate(download_id):
+        hook = ytapp.ProgressHook(download_id)
+        started = time.time()
+        total = 100 * 1024 * 1024
+        # yt-dlp calls the hook many times a second while fragments arrive
+        while time.time() - started < duration:
+            done = int(total * (time.time() - started) / duration)
+            hook({
+                'status': 'downloading',
+                '_percent_str': f'{done * 100 / total:.1f}%',
+                '_speed_str': '10.00MiB/s',
+                'downloaded_bytes': done,
+                'total_bytes': total
+            })
+            time.sleep(0.05)
+        hook({'status': 'finished', 'filename': f'/tmp/{download_id}.mp4'})
+
+    for i in range(downloads):
+        ytapp.progress_store.set(f'bench_{i}', {'status': 'queued'})
+        threading.Thread(target=simulate, args=(f'bench_{i}',), daemon=True).start()
+
+    server = make_server('127.0.0.1', port, ytapp.app, threaded=True)
+    threading.Timer(duration + 3, server.shutdown).start()
+    server.serve_forever()
+
+
+def follow_polling(port, download_id, counter):
+    with requests.Session() as session:
+        while True:
+            counter.append(1)
+            progress = session.get(f'http://127.0.0.1:{port}/api/progress/{download_id}').json()
+            if progress.get('status') in ('finished', 'error'):
+                return
+            time.sleep(1)
+
+
+def follow_stream(port, download_id, counter):
+    url = f'http://127.0.0.1:{port}/api/progress/{download_id}/stream'
+    retry = 1.0
+    # Streams end after PROGRESS_STREAM_MAX_SECONDS; reconnect like EventSource does
+    while True:
+        counter.append(1)
+        with requests.get(url, stream=True) as response:
+            for line in response.iter_lines():
+                if line.startswith(b'event: finished') or line.startswith(b'event: failed'):
+                    return
+                if line.startswith(b'retry:'):
+                    retry = int(line.split(b':')[1]) / 1000
+        time.sleep(retry)
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError('server did not start')
+
+
+def run(mode, port, downloads, duration):
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    server = subprocess.Popen([
+        sys.executable, __file__, '--serve', '--port', str(port),
+        '--downloads', str(downloads), '--duration', str(duration)
+    ])
+    wait_for_port(port)
+    follow = follow_polling if mode == 'poll' else follow_stream
+    counter = []
+    threads = [
+        threading.Thread(target=follow, args=(port, f'bench_{i}', counter))
+        for i in range(downloads)
+    ]
+    started = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - started
+    server.wait()
+    after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {
+        'mode': mode,
+        'downloads': downloads,
+        'requests': len(counter),
+        'client_seconds': round(elapsed, 2),
+        'server_cpu_seconds': round((after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime), 3)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--downloads', type=int, default=50)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.port, args.downloads, args.duration)
+        return
+
+    results = [run(mode, args.port, args.downloads, args.duration) for mode in ('poll', 'stream')]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+"""Worker startup cost under gunicorn, with and without the preloaded yt-dlp warm-up.
+
+For each mode this measures how long importing the app takes in a fresh
+interpreter, then starts gunicorn with sync workers and yt-dlp resolving
+YouTube URLs through the local fake backend (fake_youtube.py). It reports the
+time until the server answers its first request, the latency of each
+worker's first /api/video-info request and of a later one, and the memory of
+each worker: RSS, and the proportional (PSS) and private shares, which show
+how much of it is shared with the master. 'default' imports the app in every
+worker; 'preload' runs gunicorn --preload with YTDL_PRELOAD=1, so the app is
+imported and warmed up once in the master before the workers fork.
+
+    python benchmarks/bench_startup.py --workers 4
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCHMARKS)
+sys.path.insert(0, BENCHMARKS)
+
+from fake_youtube import FakeYouTube, install_stub_extractor  # noqa: E402
+
+
+def create_app():
+    """gunicorn entry point: the app with yt-dlp pointed at the fake backend in FAKE_YOUTUBE_URL"""
+    install_stub_extractor(os.environ['FAKE_YOUTUBE_URL'])
+    sys.path.insert(0, ROOT)
+    import app as ytapp
+
+    return ytapp.app
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def import_seconds(env):
+    code = 'import time; started = time.perf_counter(); import app; print(time.perf_counter() - started)'
+    output = subprocess.run(
+        [sys.executable, '-c', code], cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def memory_mb(pid):
+    """RSS, PSS and private memory of a process from /proc/<pid>/smaps_rollup, in MB"""
+    fields = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1])
+    return {
+        'rss_mb': round(fields['Rss'] / 1024, 1),
+        'pss_mb': round(fields['Pss'] / 1024, 1),
+        'private_mb': round((fields['Private_Clean'] + fields['Private_Dirty']) / 1024, 1)
+    }
+
+
+def children(pid):
+    found = []
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open(f'/proc/{entry}/stat') as f:
+                    # The command name may contain spaces, the fields after it don't
+                    if int(f.read().rsplit(')', 1)[1].split()[1]) == pid:
+                        found.append(int(entry))
+            except (OSError, IndexError, ValueError):
+                pass
+    return found
+
+
+def wait_until_serving(base, started, timeout=60):
+    while time.perf_counter() - started < timeout:
+        try:
+            if requests.get(f'{base}/api/cache-stats', timeout=5).status_code == 200:
+                return time.perf_counter() - started
+        except requests.RequestException:
+            time.sleep(0.01)
+    raise RuntimeError('server did not start')
+
+
+def video_info_round(base, video_ids):
+    """Latencies of concurrent /api/video-info requests, one per sync worker"""
+    def fetch(video_id):
+        started = time.perf_counter()
+        response = requests.post(f'{base}/api/video-info', json={'url': f'https://www.youtube.com/watch?v={video_id}'})
+        response.raise_for_status()
+        return time.perf_counter() - started
+
+    with ThreadPoolExecutor(len(video_ids)) as pool:
+        return sorted(pool.map(fetch, video_ids))
+
+
+def run(mode, args, env, offset):
+    env = dict(env, YTDL_PRELOAD='1' if mode == 'preload' else '0')
+    result = {'mode': mode, 'workers': args.workers, 'import_seconds': round(import_seconds(env), 3)}
+    port = args.port + offset
+    base = f'http://127.0.0.1:{port}'
+    command = [
+        'gunicorn', '-w', str(args.workers), '-b', f'127.0.0.1:{port}', '--log-level', 'warning',
+        '--pythonpath', BENCHMARKS
+    ]
+    if mode == 'preload':
+        command.append('--preload')
+    started = time.perf_counter()
+    server = subprocess.Popen(command + ['bench_startup:create_app()'], cwd=ROOT, env=env, stdout=subprocess.DEVNULL)
+    try:
+        result['seconds_to_first_response'] = round(wait_until_serving(base, started), 3)
+        # Give every worker time to boot, so the first requests measure the requests themselves
+        time.sleep(args.settle)
+        first = video_info_round(base, [f'first{offset}{i:05d}' for i in range(args.workers)])
+        later = video_info_round(base, [f'later{offset}{i:05d}' for i in range(args.workers)])
+        result.update({
+            'first_request_p50_ms': round(percentile(first, 0.5) * 1000, 1),
+            'first_request_max_ms': round(first[-1] * 1000, 1),
+            'later_request_p50_ms': round(percentile(later, 0.5) * 1000, 1)
+        })
+        workers = [memory_mb(pid) for pid in children(server.pid)]
+        result['master'] = memory_mb(server.pid)
+        result['per_worker'] = {
+            name: round(sum(worker[name] for worker in workers) / len(workers), 1)
+            for name in ('rss_mb', 'pss_mb', 'private_mb')
+        }
+    finally:
+        server.terminate()
+        server.wait()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    # The first requests go to all workers at once, so more workers than CPUs would measure contention
+    parser.add_argument('--workers', type=int, default=min(4, os.cpu_count() or 1))
+    parser.add_argument('--settle', type=float, default=3, help='seconds to wait for all workers to boot')
+    parser.add_argument('--port', type=int, default=5061)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='ytdl_bench_startup_')
+    backend = FakeYouTube().start()
+    env = dict(
+        os.environ,
+        FAKE_YOUTUBE_URL=backend.base_url,
+        YTDL_STATE_DIR=os.path.join(work_dir, 'state'),
+        VIDEO_INFO_CACHE_BACKEND='none',
+        YOUTUBE_REQUESTS_PER_MINUTE='1000000',
+        EGRESS_REQUESTS_PER_MINUTE='1000000'
+    )
+    try:
+        results = [run(mode, args, env, offset) for offset, mode in enumerate(('default', 'preload'))]
+    finally:
+        backend.shutdown()
+        shutil.rmtree(work_dir, ignore_errors=True)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
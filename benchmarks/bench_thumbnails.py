@@ -0,0 +1,144 @@
+"""Bytes served and latency of full-size thumbnails vs. resized variants.
+
+Runs the app in-process with video lookups pointed at a local image server
+that returns 1280x720 JPEGs after a short delay, like i.ytimg.com. Clients
+then fetch thumbnails for a set of videos through /api/thumbnail/<id>, first
+the original image (as before) and then a small variant such as a mobile
+client would ask for. Each video's first request is a cold miss.
+
+    python benchmarks/bench_thumbnails.py --videos 20 --requests 200 --width 320 --format webp
+"""
+import argparse
+import io
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def make_image(seed):
+    """A 1280x720 JPEG with enough detail to compress like a real frame"""
+    from PIL import Image, ImageDraw, ImageFilter
+
+    rng = random.Random(seed)
+    image = Image.effect_noise((1280, 720), 40).convert('RGB')
+    draw = ImageDraw.Draw(image)
+    for _ in range(60):
+        x, y = rng.randrange(1280), rng.randrange(720)
+        color = tuple(rng.randrange(256) for _ in range(3))
+        draw.ellipse((x, y, x + rng.randrange(50, 400), y + rng.randrange(50, 300)), fill=color)
+    image = image.filter(ImageFilter.GaussianBlur(1))
+    output = io.BytesIO()
+    image.save(output, 'JPEG', quality=90)
+    return output.getvalue()
+
+
+def make_handler(images, latency):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            time.sleep(latency)
+            body = images[self.path.strip('/').split('/')[1]]
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/jpeg')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return Handler
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def run(base, video_ids, total, concurrency, query):
+    order = [video_ids[i % len(video_ids)] for i in range(total)]
+    random.Random(1).shuffle(order)
+
+    def fetch(video_id):
+        started = time.time()
+        response = requests.get(f'{base}/api/thumbnail/{video_id}{query}')
+        response.raise_for_status()
+        return time.time() - started, len(response.content)
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(fetch, order))
+    latencies = sorted(latency for latency, _ in results)
+    return {
+        'variant': query or 'original',
+        'requests': total,
+        'bytes_served': sum(size for _, size in results),
+        'avg_bytes': round(sum(size for _, size in results) / total),
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 1),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 1)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--videos', type=int, default=20)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--latency-ms', type=int, default=50, help='image server delay per request')
+    parser.add_argument('--width', type=int, default=320)
+    parser.add_argument('--format', default='webp')
+    args = parser.parse_args()
+
+    state_dir = tempfile.mkdtemp(prefix='ytdl_bench_')
+    os.environ['YTDL_STATE_DIR'] = state_dir
+    sys.path.insert(0, ROOT)
+    import logging
+    from werkzeug.serving import make_server
+    import app as ytapp
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+    video_ids = [f'bench{i:06d}' for i in range(args.videos)]
+    images = {video_id: make_image(i) for i, video_id in enumerate(video_ids)}
+    image_server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(images, args.latency_ms / 1000))
+    image_server.daemon_threads = True
+    threading.Thread(target=image_server.serve_forever, daemon=True).start()
+    image_base = f'http://127.0.0.1:{image_server.server_address[1]}'
+
+    def fake_video_info(url):
+        video_id = ytapp.extract_video_id(url)
+        return {'video_id': video_id, 'thumbnail': f'{image_base}/vi/{video_id}/maxresdefault.jpg'}
+
+    ytapp.get_video_info = fake_video_info
+    server = make_server('127.0.0.1', 0, ytapp.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_port}'
+
+    try:
+        results = []
+        for query in ('', f'?width={args.width}&format={args.format}'):
+            # Start each run cold, as if the thumbnails had never been requested
+            ytapp.thumbnail_cache = ytapp.ThumbnailCache(ytapp.THUMBNAIL_CACHE_MAX_BYTES, ytapp.THUMBNAIL_CACHE_TTL)
+            ytapp.thumbnail_variants = ytapp.ThumbnailVariants(ytapp.THUMBNAIL_WORKERS)
+            result = run(base, video_ids, args.requests, args.concurrency, query)
+            result['variants_rendered'] = ytapp.thumbnail_variants.stats()['rendered']
+            results.append(result)
+    finally:
+        server.shutdown()
+        image_server.shutdown()
+        shutil.rmtree(state_dir, ignore_errors=True)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""Latency and CPU per /api/video-info request with and without YoutubeDL reuse.
+
+Runs the app in-process with the video info cache off and yt-dlp resolving
+YouTube URLs through the local fake backend (fake_youtube.py), then sends
+info requests for distinct videos, first creating a YoutubeDL per request
+(as before) and then with the per-thread instances of YoutubeDLFactory.
+CPU time is that of the whole benchmark process divided by the number of
+requests, so it includes the fake backend's share, which is the same in both runs.
+
+    python benchmarks/bench_ydl_reuse.py --requests 300 --concurrency 4
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_youtube import FakeYouTube, install_stub_extractor  # noqa: E402
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def run(ytapp, reuse, total, concurrency, offset):
+    ytapp.YDL_REUSE_INSTANCES = reuse
+    ytapp.ydl_factory = ytapp.YoutubeDLFactory(
+        ytapp.EXTRACTION_METHODS, ytapp.QUALITY_FORMATS, ytapp.YDL_INSTANCE_MAX_USES
+    )
+    # Distinct videos per run, so no lookup is answered by a cache
+    urls = [f'https://www.youtube.com/watch?v=bench{offset + i:06d}' for i in range(total)]
+
+    def fetch(url):
+        client = ytapp.app.test_client()
+        started = time.perf_counter()
+        response = client.post('/api/video-info', json={'url': url})
+        return time.perf_counter() - started, response.status_code
+
+    cpu_started, wall_started = time.process_time(), time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(fetch, urls))
+    cpu, wall = time.process_time() - cpu_started, time.perf_counter() - wall_started
+    latencies = sorted(latency for latency, _ in results)
+    return {
+        'reuse': reuse,
+        'requests': total,
+        'errors': sum(1 for _, status in results if status != 200),
+        'requests_per_second': round(total / wall, 1),
+        'cpu_ms_per_request': round(cpu / total * 1000, 2),
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'instances': ytapp.ydl_factory.stats()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=300)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--latency-ms', type=int, default=5, help='fake backend delay per request')
+    args = parser.parse_args()
+
+    state_dir = tempfile.mkdtemp(prefix='ytdl_bench_')
+    os.environ.update({
+        'YTDL_STATE_DIR': state_dir,
+        'VIDEO_INFO_CACHE_BACKEND': 'none',
+        'YOUTUBE_REQUESTS_PER_MINUTE': '1000000',
+        'EGRESS_REQUESTS_PER_MINUTE': '1000000'
+    })
+    backend = FakeYouTube(latency=args.latency_ms / 1000).start()
+    install_stub_extractor(backend.base_url)
+    sys.path.insert(0, ROOT)
+    import logging
+    import app as ytapp
+
+    logging.getLogger('app').setLevel(logging.ERROR)
+    try:
+        # Warm up imports and the SQLite files so the first run isn't penalized
+        run(ytapp, False, 10, 1, 900000)
+        results = [
+            run(ytapp, reuse, args.requests, args.concurrency, offset)
+            for offset, reuse in ((0, False), (args.requests, True))
+        ]
+    finally:
+        backend.shutdown()
+        shutil.rmtree(state_dir, ignore_errors=True)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
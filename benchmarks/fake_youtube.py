@@ -0,0 +1,249 @@
+"""Local stand-in for YouTube used by the benchmarks.
+
+FakeYouTube is an HTTP server with watch pages (carrying a player response
+like the real ones), media files and thumbnails for any 11-character video
+ID. It can add latency, limit each connection's bandwidth and answer a share
+of watch pages with a bot check or "Video unavailable". Media files are zeros
+unless media_path names a real video to serve, e.g. for ffmpeg to seek in.
+install_stub_extractor
+makes yt-dlp resolve YouTube URLs through this server instead of youtube.com.
+
+    server = FakeYouTube(latency=0.05, bytes_per_second=4 * 1024 * 1024, bot_check_rate=0.05)
+    server.start()
+    install_stub_extractor(server.base_url)
+"""
+import io
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+BOT_CHECK_REASON = "Sign in to confirm you're not a bot"
+UNAVAILABLE_REASON = 'Video unavailable'
+
+
+def make_thumbnail():
+    """A small JPEG; thumbnails only need to be real images for the resizing code"""
+    from PIL import Image
+
+    output = io.BytesIO()
+    Image.effect_noise((1280, 720), 40).convert('RGB').save(output, 'JPEG', quality=85)
+    return output.getvalue()
+
+
+class FakeYouTube:
+    """Threaded HTTP server imitating the parts of YouTube the app talks to"""
+
+    def __init__(self, latency=0.0, bytes_per_second=0, media_bytes=1024 * 1024,
+                 bot_check_rate=0.0, unavailable_rate=0.0, seed=1, media_path=None, duration=212):
+        self.latency = latency
+        self.bytes_per_second = bytes_per_second  # per connection; 0 means unlimited
+        self.media = None
+        if media_path:
+            with open(media_path, 'rb') as f:
+                self.media = f.read()
+            media_bytes = len(self.media)
+        self.media_bytes = media_bytes
+        self.duration = duration
+        self.bot_check_rate = bot_check_rate
+        self.unavailable_rate = unavailable_rate
+        self.requests = {'watch': 0, 'media': 0, 'thumbnail': 0}
+        self.bytes_sent = 0
+        self.injected = {'bot_check': 0, 'unavailable': 0}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thumbnail = make_thumbnail()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+
+    @property
+    def base_url(self):
+        return f'http://127.0.0.1:{self._server.server_address[1]}'
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def shutdown(self):
+        self._server.shutdown()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'requests': dict(self.requests),
+                'injected_errors': dict(self.injected),
+                'media_bytes_sent': self.bytes_sent
+            }
+
+    def _count(self, kind):
+        with self._lock:
+            self.requests[kind] += 1
+
+    def playability(self):
+        """Status of one watch page request, with errors injected at the configured rates"""
+        with self._lock:
+            roll = self._random.random()
+            if roll < self.bot_check_rate:
+                self.injected['bot_check'] += 1
+                return {'status': 'LOGIN_REQUIRED', 'reason': BOT_CHECK_REASON}
+            if roll < self.bot_check_rate + self.unavailable_rate:
+                self.injected['unavailable'] += 1
+                return {'status': 'ERROR', 'reason': UNAVAILABLE_REASON}
+        return {'status': 'OK'}
+
+    def player_response(self, video_id):
+        return {
+            'playabilityStatus': self.playability(),
+            'videoDetails': {
+                'videoId': video_id,
+                'title': f'Benchmark video {video_id}',
+                'author': 'Benchmark channel',
+                'lengthSeconds': str(self.duration),
+                'viewCount': '123456',
+                'shortDescription': 'Served by the local fake YouTube backend'
+            },
+            'streamingData': {
+                'formats': [{
+                    'itag': 18,
+                    'url': f'{self.base_url}/media/{video_id}.mp4',
+                    'mimeType': 'video/mp4; codecs="avc1.42001E, mp4a.40.2"',
+                    'width': 640,
+                    'height': 360,
+                    'contentLength': str(self.media_bytes)
+                }]
+            }
+        }
+
+    def _handler(self):
+        backend = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                parsed = urlparse(self.path)
+                if backend.latency:
+                    time.sleep(backend.latency)
+                if parsed.path == '/watch':
+                    backend._count('watch')
+                    video_id = parse_qs(parsed.query).get('v', [''])[0]
+                    response = json.dumps(backend.player_response(video_id))
+                    page = f'<html><script>var ytInitialPlayerResponse = {response};</script></html>'
+                    self.send_body('text/html; charset=utf-8', page.encode())
+                elif parsed.path.startswith('/media/'):
+                    backend._count('media')
+                    self.send_media()
+                elif parsed.path.startswith('/vi/'):
+                    backend._count('thumbnail')
+                    self.send_body('image/jpeg', backend._thumbnail)
+                else:
+                    self.send_error(404)
+
+            def send_body(self, content_type, body):
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def send_media(self):
+                size = backend.media_bytes
+                start, end = 0, size - 1
+                match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+                if match:
+                    start = int(match.group(1))
+                    end = min(int(match.group(2)), end) if match.group(2) else end
+                    self.send_response(206)
+                    self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+                else:
+                    self.send_response(200)
+                self.send_header('Content-Type', 'video/mp4')
+                self.send_header('Content-Length', str(end - start + 1))
+                self.send_header('Accept-Ranges', 'bytes')
+                self.end_headers()
+                chunk = b'\x00' * (64 * 1024)
+                sent, remaining = 0, end - start + 1
+                started = time.time()
+                try:
+                    while remaining > 0:
+                        if backend.media is not None:
+                            piece = backend.media[start + sent:start + sent + min(len(chunk), remaining)]
+                        else:
+                            piece = chunk[:min(len(chunk), remaining)]
+                        self.wfile.write(piece)
+                        sent += len(piece)
+                        remaining -= len(piece)
+                        with backend._lock:
+                            backend.bytes_sent += len(piece)
+                        if backend.bytes_per_second:
+                            ahead = sent / backend.bytes_per_second - (time.time() - started)
+                            if ahead > 0:
+                                time.sleep(ahead)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+        return Handler
+
+
+def install_stub_extractor(base_url):
+    """Make every YoutubeDL created from now on in this process resolve YouTube URLs through base_url"""
+    import yt_dlp
+    from yt_dlp.extractor.common import InfoExtractor
+    from yt_dlp.utils import ExtractorError
+
+    class FakeYoutubeIE(InfoExtractor):
+        IE_NAME = 'fakeyoutube'
+        _VALID_URL = (
+            r'https?://(?:www\.)?(?:youtube\.com/(?:watch\?v=|embed/|v/|shorts/)|youtu\.be/)'
+            r'(?P<id>[a-zA-Z0-9_-]{11})'
+        )
+
+        def _real_extract(self, url):
+            video_id = self._match_id(url)
+            webpage = self._download_webpage(f'{base_url}/watch?v={video_id}', video_id)
+            player_response = self._search_json(
+                r'var\s+ytInitialPlayerResponse\s*=', webpage, 'player response', video_id
+            )
+            status = player_response['playabilityStatus']
+            if status['status'] != 'OK':
+                raise ExtractorError(status['reason'], expected=True, video_id=video_id)
+            details = player_response['videoDetails']
+            formats = []
+            for fmt in player_response['streamingData']['formats']:
+                vcodec, acodec = re.search(r'codecs="([^,]+), ([^"]+)"', fmt['mimeType']).groups()
+                formats.append({
+                    'format_id': str(fmt['itag']),
+                    'url': fmt['url'],
+                    'ext': 'mp4',
+                    'vcodec': vcodec,
+                    'acodec': acodec,
+                    'width': fmt['width'],
+                    'height': fmt['height'],
+                    'filesize': int(fmt['contentLength'])
+                })
+            return {
+                'id': video_id,
+                'title': details['title'],
+                'uploader': details['author'],
+                'duration': int(details['lengthSeconds']),
+                'view_count': int(details['viewCount']),
+                'description': details['shortDescription'],
+                'thumbnail': f'{base_url}/vi/{video_id}/maxresdefault.jpg',
+                'formats': formats
+            }
+
+    add_default_info_extractors = yt_dlp.YoutubeDL.add_default_info_extractors
+
+    def add_stub_first(ydl):
+        # The first suitable extractor wins, so the stub shadows the real YouTube extractor
+        ydl.add_info_extractor(FakeYoutubeIE())
+        add_default_info_extractors(ydl)
+
+    yt_dlp.YoutubeDL.add_default_info_extractors = add_stub_first
+    return FakeYoutubeIE
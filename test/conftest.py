@@ -0,0 +1,8 @@
+import os
+import sys
+import tempfile
+
+# app reads its configuration at import; keep the tests' state away from real state directories
+os.environ.setdefault('YTDL_STATE_DIR', tempfile.mkdtemp(prefix='ytdl_tests_'))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
@@ -0,0 +1,213 @@
+"""Local stand-in for Redis used by the tests.
+
+FakeRedis is a threaded TCP server speaking RESP with the commands the
+progress store uses: strings and hashes with expiry, SCAN, and transactions
+with MULTI/EXEC/DISCARD and WATCH. Errors inside a transaction are reported
+in the EXEC reply like Redis does. advance() moves its clock forward to
+expire keys without waiting, and garbage_next makes it answer the next
+command with a malformed reply.
+
+    server = FakeRedis().start()
+    store = RedisProgressStore(server.url)
+"""
+import fnmatch
+import socketserver
+import threading
+import time
+
+
+class CommandError(Exception):
+    pass
+
+
+class FakeRedis:
+    """In-memory Redis imitation, one dict for all clients"""
+
+    def __init__(self):
+        self.values = {}  # key -> bytes or dict of bytes
+        self.expires_at = {}
+        self.versions = {}  # key -> count of changes, for WATCH
+        self.offset = 0.0
+        self.garbage_next = False
+        self.commands = []
+        self._lock = threading.Lock()
+        self._server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f'redis://{host}:{port}/0'
+
+    def start(self):
+        thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+    def shutdown(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def advance(self, seconds):
+        with self._lock:
+            self.offset += seconds
+
+    def ttl(self, key):
+        with self._lock:
+            return self._ttl(key.encode())
+
+    def _now(self):
+        return time.time() + self.offset
+
+    def _changed(self, key):
+        self.versions[key] = self.versions.get(key, 0) + 1
+
+    def _alive(self, key):
+        expires_at = self.expires_at.get(key)
+        if expires_at is not None and expires_at <= self._now():
+            del self.values[key]
+            del self.expires_at[key]
+            self._changed(key)
+        return key in self.values
+
+    def _ttl(self, key):
+        if not self._alive(key):
+            return -2
+        if key not in self.expires_at:
+            return -1
+        return int(self.expires_at[key] - self._now() + 0.5)
+
+    def _hash(self, key, create=False):
+        if not self._alive(key):
+            if not create:
+                return {}
+            self.values[key] = {}
+        value = self.values[key]
+        if not isinstance(value, dict):
+            raise CommandError('WRONGTYPE Operation against a key holding the wrong kind of value')
+        return value
+
+    def _delete(self, key):
+        existed = self._alive(key)
+        self.values.pop(key, None)
+        self.expires_at.pop(key, None)
+        if existed:
+            self._changed(key)
+        return int(existed)
+
+    def run(self, name, args):
+        """Run one command outside a transaction; returns its reply or raises CommandError"""
+        if name in ('AUTH', 'SELECT', 'PING'):
+            return 'OK'
+        if name == 'SET':
+            self._delete(args[0])
+            self.values[args[0]] = args[1]
+            self._changed(args[0])
+            return 'OK'
+        if name == 'DEL':
+            return sum(self._delete(key) for key in args)
+        if name == 'EXISTS':
+            return sum(int(self._alive(key)) for key in args)
+        if name == 'EXPIRE':
+            if not self._alive(args[0]):
+                return 0
+            self.expires_at[args[0]] = self._now() + int(args[1])
+            self._changed(args[0])
+            return 1
+        if name == 'TTL':
+            return self._ttl(args[0])
+        if name == 'HSET':
+            value = self._hash(args[0], create=True)
+            added = 0
+            for field, data in zip(args[1::2], args[2::2]):
+                added += field not in value
+                value[field] = data
+            self._changed(args[0])
+            return added
+        if name == 'HGET':
+            return self._hash(args[0]).get(args[1])
+        if name == 'HGETALL':
+            return [item for pair in self._hash(args[0]).items() for item in pair]
+        if name == 'SCAN':
+            pattern = args[args.index(b'MATCH') + 1].decode() if b'MATCH' in args else '*'
+            keys = [key for key in list(self.values) if self._alive(key) and fnmatch.fnmatchcase(key.decode(), pattern)]
+            return [b'0', keys]
+        raise CommandError(f"ERR unknown command '{name}'")
+
+    def _handler(self):
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                queued = None  # commands of an open MULTI
+                watched = {}
+                while True:
+                    command = self._read_command()
+                    if command is None:
+                        return
+                    name, args = command[0].decode().upper(), command[1:]
+                    with server._lock:
+                        server.commands.append(name)
+                        if server.garbage_next:
+                            server.garbage_next = False
+                            self.wfile.write(b'?garbage\r\n')
+                            continue
+                        if name == 'MULTI':
+                            queued = []
+                            reply = 'OK'
+                        elif name == 'DISCARD':
+                            queued, watched, reply = None, {}, 'OK'
+                        elif name == 'WATCH':
+                            for key in args:
+                                server._alive(key)
+                                watched[key] = server.versions.get(key, 0)
+                            reply = 'OK'
+                        elif name == 'UNWATCH':
+                            watched, reply = {}, 'OK'
+                        elif name == 'EXEC':
+                            for key in watched:
+                                server._alive(key)
+                            if any(server.versions.get(key, 0) != version for key, version in watched.items()):
+                                reply = None
+                            else:
+                                reply = []
+                                for queued_name, queued_args in queued:
+                                    try:
+                                        reply.append(server.run(queued_name, queued_args))
+                                    except CommandError as e:
+                                        reply.append(e)
+                            queued, watched = None, {}
+                        elif queued is not None:
+                            queued.append((name, args))
+                            reply = 'QUEUED'
+                        else:
+                            try:
+                                reply = server.run(name, args)
+                            except CommandError as e:
+                                reply = e
+                    self.wfile.write(self._encode(reply))
+
+            def _read_command(self):
+                line = self.rfile.readline()
+                if not line:
+                    return None
+                args = []
+                for _ in range(int(line[1:-2])):
+                    length = int(self.rfile.readline()[1:-2])
+                    args.append(self.rfile.read(length + 2)[:-2])
+                return args
+
+            def _encode(self, reply):
+                if reply is None:
+                    return b'*-1\r\n'
+                if isinstance(reply, CommandError):
+                    return f'-{reply}\r\n'.encode()
+                if isinstance(reply, str):
+                    return f'+{reply}\r\n'.encode()
+                if isinstance(reply, int):
+                    return f':{reply}\r\n'.encode()
+                if isinstance(reply, bytes):
+                    return f'${len(reply)}\r\n'.encode() + reply + b'\r\n'
+                return f'*{len(reply)}\r\n'.encode() + b''.join(self._encode(item) for item in reply)
+
+        return Handler
@@ -0,0 +1,65 @@
+import itertools
+
+import pytest
+
+import app
+
+ids = itertools.count()
+
+
+@pytest.fixture
+def client(monkeypatch):
+    # Jobs stay where the test puts them
+    monkeypatch.setattr(app.download_scheduler, 'start', lambda: None)
+    return app.app.test_client()
+
+
+def new_id(prefix):
+    return f'{prefix}-{next(ids)}'
+
+
+def test_cancel_attached_download_after_shared_one_finished(client):
+    leader, follower = new_id('leader'), new_id('follower')
+    app.progress_store.set(leader, {'status': 'finished', 'file_path': '/tmp/video.mp4'})
+    app.progress_store.set(follower, {'status': 'queued', 'follows': leader})
+    response = client.delete(f'/api/download/{follower}')
+    assert response.status_code == 409
+    assert response.json['status'] == 'finished'
+
+
+def test_cancel_attached_download_leaves_shared_one_running(client):
+    leader, follower = new_id('leader'), new_id('follower')
+    app.progress_store.set(leader, {'status': 'downloading'})
+    app.progress_store.set(follower, {'status': 'queued', 'follows': leader})
+    assert client.delete(f'/api/download/{follower}').json['status'] == 'cancelled'
+    assert app.progress_store.get(leader)['status'] == 'downloading'
+    assert client.delete(f'/api/download/{follower}').status_code == 409
+
+
+def test_cancel_queued_download(client):
+    download_id = new_id('queued')
+    app.progress_store.set(download_id, {'status': 'queued'})
+    app.download_scheduler.submit(download_id, 'client-a', {'url': 'u', 'flight_key': download_id})
+    app.download_flights.claim(download_id, download_id)
+    response = client.delete(f'/api/download/{download_id}')
+    assert response.status_code == 200
+    assert app.progress_store.get(download_id)['status'] == 'cancelled'
+    assert app.download_scheduler.queue_status(download_id) is None
+    # The next request for the same work starts a new download instead of attaching to the cancelled one
+    assert app.download_flights.claim(download_id, new_id('next')) is None
+
+
+def test_cancel_running_download(client):
+    download_id = new_id('running')
+    app.progress_store.set(download_id, {'status': 'downloading'})
+    app.download_scheduler.submit(download_id, 'client-a', {'url': 'u'})
+    conn = app._sqlite_connect(app.download_scheduler.path)
+    try:
+        conn.execute("UPDATE jobs SET status = 'running', owner_pid = ? WHERE id = ?", (app.os.getpid(), download_id))
+    finally:
+        conn.close()
+    with app.job_control.running(download_id):
+        response = client.delete(f'/api/download/{download_id}')
+        assert response.status_code == 202
+        assert response.json['status'] == 'cancelling'
+        assert app.job_control.is_cancelled(download_id)
@@ -0,0 +1,35 @@
+import os
+
+import app
+
+
+def touch(directory, name):
+    path = os.path.join(directory, name)
+    open(path, 'wb').close()
+    return path
+
+
+def test_reported_file_wins(tmp_path):
+    media = touch(tmp_path, 'Video.mp4')
+    touch(tmp_path, 'Other.mp4')
+    result = {'ext': 'mp4', 'requested_downloads': [{'filepath': media}]}
+    assert app.find_downloaded_file(str(tmp_path), result) == media
+
+
+def test_fallback_skips_partial_files_and_thumbnails(tmp_path):
+    thumbnail = touch(tmp_path, 'abc_thumbnail.jpg')
+    for name in ('A.f137.mp4.part', 'A.f137.mp4.ytdl', 'A.f140.m4a', 'A.mp4.part-Frag3', 'A.webp', '.hidden'):
+        touch(tmp_path, name)
+    media = touch(tmp_path, 'A.mp4')
+    assert app.find_downloaded_file(str(tmp_path), {'ext': 'mp4'}, thumbnail) == media
+
+
+def test_fallback_prefers_expected_extension(tmp_path):
+    touch(tmp_path, 'A.description')
+    media = touch(tmp_path, 'B.m4a')
+    assert app.find_downloaded_file(str(tmp_path), {'ext': 'm4a'}) == media
+
+
+def test_nothing_but_leftovers(tmp_path):
+    touch(tmp_path, 'A.mp4.part')
+    assert app.find_downloaded_file(str(tmp_path), None) is None
@@ -0,0 +1,31 @@
+import sys
+
+import yt_dlp
+
+import app
+
+
+def test_parallel_format_thread_works_for_the_download(monkeypatch):
+    seen = []
+
+    def dl(self, name, info, subtitle=False, test=False):
+        seen.append((info['format_id'], app.job_control.current()))
+        return True, True
+
+    monkeypatch.setattr(yt_dlp.YoutubeDL, 'dl', dl)
+    ydl = app.ParallelFormatsYoutubeDL({'quiet': True})
+    group = {'remaining': 2, 'pending': []}
+    with app.job_control.running('job-1'):
+        ydl.dl('video', {'format_id': 'video', '_parallel_formats': group})
+        assert ydl.dl('audio', {'format_id': 'audio', '_parallel_formats': group}) == (True, True)
+    assert sorted(seen) == [('audio', 'job-1'), ('video', 'job-1')]
+
+
+def test_cancel_kills_processes_started_by_helper_threads():
+    with app.job_control.running('job-2'):
+        with app.job_control.working_for('job-2'):
+            process = app.TrackedPopen([sys.executable, '-c', 'import time; time.sleep(30)'])
+        assert app.job_control.cancel('job-2')
+        assert process.wait(timeout=5) != 0
+        assert app.job_control.current() == 'job-2'
+    assert app.job_control.current() is None
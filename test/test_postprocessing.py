@@ -0,0 +1,16 @@
+import pytest
+
+import app
+
+
+@pytest.mark.parametrize('vcodec, acodec, ext, expected', [
+    ('avc1.64001F', 'mp4a.40.2', 'mp4', 'none'),
+    ('avc1.64001F', 'mp4a.40.2', 'mkv', 'remux'),
+    ('avc1.64001F', 'opus', 'webm', 'transcode'),
+    ('av01.0.08M.08', 'mp4a.40.2', 'mp4', 'transcode'),
+    ('hev1.1.6.L93.B0', 'mp4a.40.2', 'mp4', 'transcode'),
+    ('vp9', 'none', 'webm', 'transcode'),
+])
+def test_only_widely_playable_codecs_skip_transcoding(vcodec, acodec, ext, expected):
+    info = {'vcodec': vcodec, 'acodec': acodec, 'ext': ext}
+    assert app.choose_postprocessing(info, 'best') == expected
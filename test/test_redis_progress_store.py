@@ -0,0 +1,90 @@
+import pytest
+
+import app
+from fake_redis import FakeRedis
+
+
+@pytest.fixture
+def server():
+    server = FakeRedis().start()
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture
+def store(server):
+    return app.RedisProgressStore(server.url, ttl=60)
+
+
+def test_set_get_and_replace(store):
+    store.set('a', {'status': 'queued', 'percent': '0%'})
+    assert store.get('a') == {'status': 'queued', 'percent': '0%'}
+    store.set('a', {'status': 'finished'})
+    assert store.get('a') == {'status': 'finished'}
+    assert store.get('missing') is None
+
+
+def test_set_expires_after_ttl(store, server):
+    store.set('a', {'status': 'queued'})
+    store.set('b', {'status': 'batch'}, ttl=3600)
+    assert server.ttl('ytdl:progress:a') == 60
+    server.advance(61)
+    assert store.get('a') is None
+    assert store.get('b') == {'status': 'batch'}
+
+
+def test_update_merges_and_refreshes_expiry(store, server):
+    store.set('a', {'status': 'queued'})
+    store.set('b', {'status': 'batch'}, ttl=3600)
+    server.advance(50)
+    assert store.update('a', {'status': 'downloading', 'percent': '5%'})
+    assert store.update('b', {'percent': '1%'})
+    assert store.get('a') == {'status': 'downloading', 'percent': '5%'}
+    assert server.ttl('ytdl:progress:a') == 60
+    # The entry's own ttl, not the store's default
+    assert server.ttl('ytdl:progress:b') == 3600
+
+
+def test_update_does_not_recreate_expired_entry(store, server):
+    store.set('a', {'status': 'queued'})
+    server.advance(61)
+    assert not store.update('a', {'status': 'downloading'})
+    assert store.get('a') is None
+    assert server.ttl('ytdl:progress:a') == -2
+
+
+def test_error_inside_exec_is_raised_and_connection_stays_usable(store, server):
+    conn = store._conn()
+    conn.execute('SET', 'ytdl:progress:a', 'not a hash')
+    with pytest.raises(app.RedisError, match='WRONGTYPE'):
+        store.update('a', {'status': 'downloading'})
+    store.set('a', {'status': 'queued'})
+    assert store.get('a') == {'status': 'queued'}
+
+
+def test_error_in_exec_reply_leaves_connection_in_step(server):
+    conn = app.RedisConnection(server.url)
+    conn.execute('SET', 'key', 'not a hash')
+    with pytest.raises(app.RedisError, match='WRONGTYPE'):
+        conn.transaction(['HSET', 'key', 'field', 'value'], ['EXPIRE', 'key', 5])
+    # The whole EXEC reply was read: the next reply belongs to the next command
+    assert conn.execute('TTL', 'key') == 5
+    assert conn.execute('EXISTS', 'key') == 1
+
+
+def test_protocol_error_drops_connection(store, server):
+    store.set('a', {'status': 'queued'})
+    conn = store._conn()
+    server.garbage_next = True
+    with pytest.raises(RuntimeError, match='Unexpected Redis reply'):
+        store.get('a')
+    assert conn._sock is None
+    assert store.get('a') == {'status': 'queued'}
+
+
+def test_items_and_delete(store):
+    store.set('a', {'status': 'queued'})
+    store.set('b', {'status': 'finished', 'file_path': '/tmp/x'})
+    assert sorted(store.items()) == [('a', {'status': 'queued'}), ('b', {'status': 'finished', 'file_path': '/tmp/x'})]
+    store.delete('a')
+    assert store.get('a') is None
@@ -0,0 +1,186 @@
+import threading
+import time
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def scheduler(tmp_path, monkeypatch):
+    scheduler = app.DownloadScheduler(str(tmp_path / 'queue.sqlite3'), 2, 100, lambda download_id, job: None)
+    # Jobs are claimed by the tests, not a dispatcher thread
+    monkeypatch.setattr(scheduler, 'start', lambda: None)
+    monkeypatch.setattr(app, 'download_scheduler', scheduler)
+    return scheduler
+
+
+@pytest.fixture
+def pool(tmp_path, monkeypatch):
+    pool = app.PostprocessPool(str(tmp_path / 'postprocess.sqlite3'), 1)
+    monkeypatch.setattr(app, 'postprocess_pool', pool)
+    return pool
+
+
+def claim(scheduler):
+    claimed = scheduler._claim_next()
+    return claimed[0] if claimed else None
+
+
+def test_clients_with_fewer_running_jobs_go_first(scheduler):
+    for download_id in ('a1', 'a2', 'a3'):
+        scheduler.submit(download_id, 'client-a', {})
+    scheduler.submit('b1', 'client-b', {})
+    assert [claim(scheduler), claim(scheduler), claim(scheduler)] == ['a1', 'b1', None]
+    scheduler._finish('a1')
+    scheduler._finish('b1')
+    assert [claim(scheduler), claim(scheduler)] == ['a2', 'a3']
+
+
+def test_queue_positions_follow_claim_order(scheduler):
+    for download_id in ('a1', 'a2', 'a3'):
+        scheduler.submit(download_id, 'client-a', {})
+    scheduler.submit('b1', 'client-b', {})
+    scheduler.submit_many([('c1', {}), ('c2', {})], 'client-c', 1, 100)
+    statuses = scheduler.queue_statuses(['a1', 'a2', 'a3', 'b1', 'c1', 'c2'])
+    predicted = sorted(statuses, key=lambda download_id: statuses[download_id]['queue_position'])
+    assert scheduler.queue_status('b1') == statuses['b1']
+
+    claimed = []
+    while len(claimed) < 6:
+        download_id = claim(scheduler)
+        if download_id is None:
+            # Slots free up in the order jobs started, as the replay assumes
+            scheduler._finish(claimed[len(claimed) - 2])
+            continue
+        claimed.append(download_id)
+    assert claimed == predicted
+    assert scheduler.queue_statuses(['a1']) == {}
+
+
+def test_batch_limit_holds_back_its_own_jobs_only(scheduler):
+    scheduler.submit_many([('c1', {}), ('c2', {})], 'client-c', 1, 100)
+    scheduler.submit('b1', 'client-b', {})
+    assert [claim(scheduler), claim(scheduler)] == ['c1', 'b1']
+    scheduler._finish('b1')
+    assert claim(scheduler) is None
+    assert scheduler.queue_status('c2')['queue_position'] == 1
+    scheduler._finish('c1')
+    assert claim(scheduler) == 'c2'
+
+
+def test_full_queue_is_rejected(scheduler):
+    scheduler.max_queued = 1
+    assert scheduler.submit('a1', 'client-a', {})
+    assert not scheduler.submit('a2', 'client-a', {})
+
+
+def test_streams_take_download_slots(scheduler):
+    assert scheduler.acquire('s1', 'client-a')
+    assert scheduler.acquire('s2', 'client-b')
+    assert not scheduler.acquire('s3', 'client-c')
+    scheduler.submit('a1', 'client-a', {})
+    assert claim(scheduler) is None
+    scheduler.release('s1')
+    assert claim(scheduler) == 'a1'
+    assert scheduler.counts() == {'queued': 0, 'running': 1, 'streaming': 1, 'postprocessing': 0}
+
+
+def test_handoff_frees_the_download_slot(scheduler):
+    scheduler.max_workers = 1
+    scheduler.submit('a1', 'client-a', {})
+    scheduler.submit('b1', 'client-b', {})
+    assert claim(scheduler) == 'a1'
+    assert claim(scheduler) is None
+    scheduler.handoff('a1')
+    assert claim(scheduler) == 'b1'
+    assert scheduler.counts() == {'queued': 0, 'running': 1, 'streaming': 0, 'postprocessing': 1}
+
+
+def test_retry_after_postprocessing_waits_for_a_download_slot(scheduler, pool):
+    scheduler.max_workers = 1
+    scheduler.submit('a1', 'client-a', {})
+    assert claim(scheduler) == 'a1'
+    stage = app.PostprocessStage('a1')
+    with app.job_control.running('a1'):
+        stage({'status': 'started', 'postprocessor': 'Merger'})
+        assert pool.counts() == {'waiting': 0, 'running': 1}
+        scheduler.submit('b1', 'client-b', {})
+        assert claim(scheduler) == 'b1'
+        # The attempt fails and another one follows
+        stage.leave()
+        assert pool.counts() == {'waiting': 0, 'running': 0}
+        threading.Timer(0.5, scheduler._finish, ['b1']).start()
+        started = time.perf_counter()
+        stage.resume()
+        assert time.perf_counter() - started >= 0.4
+    assert scheduler.counts() == {'queued': 0, 'running': 1, 'streaming': 0, 'postprocessing': 0}
+    assert stage.wait_seconds == 0.0
+    # The retry holds the only slot again
+    scheduler.submit('c1', 'client-c', {})
+    assert claim(scheduler) is None
+
+
+def test_resume_without_handoff_takes_no_slot(scheduler):
+    scheduler.submit('a1', 'client-a', {})
+    assert claim(scheduler) == 'a1'
+    app.PostprocessStage('a1').resume()
+    assert scheduler.counts()['running'] == 1
+
+
+def test_postprocessing_slots_are_handed_out_in_order(pool):
+    assert pool.acquire('p1', None) == app.DEFAULT_POSTPROCESS_SECONDS
+    waits = []
+    waiter = threading.Thread(target=pool.acquire, args=('p2', lambda *position_eta: waits.append(position_eta)))
+    waiter.start()
+    time.sleep(0.2)
+    assert pool.counts() == {'waiting': 1, 'running': 1}
+    pool.release('p1')
+    waiter.join(5)
+    assert waits[0] == (1, app.DEFAULT_POSTPROCESS_SECONDS)
+    assert pool.counts() == {'waiting': 0, 'running': 1}
+
+
+def test_cancel_queued_job(scheduler):
+    scheduler.submit('a1', 'client-a', {'url': 'u'})
+    assert scheduler.cancel('a1') == ('queued', {'url': 'u'})
+    assert scheduler.counts()['queued'] == 0
+    assert scheduler.cancel('a1') == (None, None)
+
+
+@pytest.mark.parametrize('handed_off', [False, True])
+def test_cancel_running_or_postprocessing_job(scheduler, handed_off):
+    scheduler.submit('a1', 'client-a', {'url': 'u'})
+    assert claim(scheduler) == 'a1'
+    if handed_off:
+        scheduler.handoff('a1')
+    with app.job_control.running('a1'):
+        assert scheduler.cancel('a1') == ('running', {'url': 'u'})
+        assert app.job_control.is_cancelled('a1')
+
+
+def test_cancel_reaches_job_running_here_through_the_flag(scheduler):
+    scheduler.submit('a1', 'client-a', {})
+    assert claim(scheduler) == 'a1'
+    scheduler.handoff('a1')
+    # As if cancelled through another worker: only the flag is set
+    scheduler.cancel('a1')
+    with app.job_control.running('a1'):
+        scheduler._running_here.add('a1')
+        scheduler._apply_cancellations()
+        assert app.job_control.is_cancelled('a1')
+
+
+def test_jobs_of_dead_workers_are_requeued(scheduler):
+    scheduler.submit('a1', 'client-a', {})
+    scheduler.acquire('s1', 'client-b')
+    dead_pid = 2 ** 22 + 1
+    assert not app._pid_alive(dead_pid)
+    conn = app._sqlite_connect(scheduler.path)
+    try:
+        conn.execute("UPDATE jobs SET status = 'postprocessing', owner_pid = ? WHERE id = 'a1'", (dead_pid,))
+        conn.execute("UPDATE jobs SET owner_pid = ? WHERE id = 's1'", (dead_pid,))
+    finally:
+        conn.close()
+    assert claim(scheduler) == 'a1'
+    assert scheduler.counts() == {'queued': 0, 'running': 1, 'streaming': 0, 'postprocessing': 0}